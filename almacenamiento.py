@@ -0,0 +1,123 @@
+"""
+Almacenamiento de los archivos de documentos (blobs).
+
+ALMACENAMIENTO_BACKEND elige dónde viven:
+- "local" (por defecto): carpeta ALMACENAMIENTO_DIRECTORIO (uploads/) del nodo.
+- "s3": un bucket compatible con S3 (S3_ENDPOINT, S3_BUCKET, S3_ACCESS_KEY,
+  S3_SECRET_KEY, S3_REGION), compartido por todos los nodos de la aplicación.
+  Para desarrollo sirve el servidor de `objetos_s3.py`.
+
+Los dos exponen la misma interfaz con claves tipo "blobs/ab/<sha256>.pdf":
+`subir`, `existe`, `borrar` y `leer` (por bloques, opcionalmente un rango de
+bytes), que usa el endpoint de descarga para responder peticiones Range.
+`leer` abre el archivo (o envía el GET) al llamarla y lanza FileNotFoundError
+si no existe, así el endpoint puede responder 404 antes de empezar a enviar.
+"""
+import os
+import shutil
+import tempfile
+import uuid
+from typing import Iterator, Optional
+
+from objetos_s3 import ClienteS3, ErrorS3
+
+TAMANO_BLOQUE = 1024 * 1024
+
+
+class AlmacenLocal:
+    """Archivos en una carpeta local; subir con `mover` es un renombrado atómico"""
+
+    def __init__(self, raiz: str):
+        self.raiz = raiz
+        # Temporales en la misma carpeta (mismo sistema de archivos) para poder usar os.replace
+        self.directorio_temporal = os.path.join(raiz, "blobs")
+
+    def _ruta(self, clave: str) -> str:
+        return os.path.join(self.raiz, *clave.split("/"))
+
+    def subir(self, clave: str, ruta_archivo: str, sha256_hex: str, mover: bool = False):
+        ruta = self._ruta(clave)
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        if mover:
+            os.replace(ruta_archivo, ruta)
+            return
+        temporal = f"{ruta}.{uuid.uuid4().hex}.part"  # Único: puede haber subidas simultáneas del mismo contenido
+        try:
+            os.link(ruta_archivo, temporal)  # Mismo disco: sin copiar bytes
+        except OSError:
+            shutil.copyfile(ruta_archivo, temporal)
+        os.replace(temporal, ruta)
+
+    def existe(self, clave: str) -> bool:
+        return os.path.isfile(self._ruta(clave))
+
+    def borrar(self, clave: str):
+        try:
+            os.remove(self._ruta(clave))
+        except FileNotFoundError:
+            pass
+
+    def leer(self, clave: str, inicio: Optional[int] = None, fin: Optional[int] = None) -> Iterator[bytes]:
+        # Se abre aquí y no al iterar: FileNotFoundError antes de enviar las cabeceras
+        archivo = open(self._ruta(clave), "rb")
+        if inicio is not None:
+            archivo.seek(inicio)
+        return self._bloques(archivo, None if inicio is None else fin - inicio + 1)
+
+    @staticmethod
+    def _bloques(archivo, restante: Optional[int]) -> Iterator[bytes]:
+        with archivo:
+            while restante is None or restante > 0:
+                bloque = archivo.read(TAMANO_BLOQUE if restante is None else min(restante, TAMANO_BLOQUE))
+                if not bloque:
+                    break
+                if restante is not None:
+                    restante -= len(bloque)
+                yield bloque
+
+
+class AlmacenS3:
+    """Objetos en un bucket compatible con S3"""
+
+    def __init__(self, cliente: ClienteS3):
+        self.cliente = cliente
+        self.directorio_temporal = tempfile.gettempdir()
+
+    def subir(self, clave: str, ruta_archivo: str, sha256_hex: str, mover: bool = False):
+        with open(ruta_archivo, "rb") as archivo:
+            self.cliente.put_object(clave, archivo, os.path.getsize(ruta_archivo), sha256_hex)
+        if mover:
+            os.remove(ruta_archivo)
+
+    def existe(self, clave: str) -> bool:
+        return self.cliente.head_object(clave) is not None
+
+    def borrar(self, clave: str):
+        try:
+            self.cliente.delete_object(clave)
+        except ErrorS3 as e:
+            if e.estado != 404:
+                raise
+
+    def leer(self, clave: str, inicio: Optional[int] = None, fin: Optional[int] = None) -> Iterator[bytes]:
+        try:
+            return self.cliente.get_object(clave, inicio, fin)
+        except ErrorS3 as e:
+            if e.estado == 404:
+                raise FileNotFoundError(clave) from e
+            raise
+
+
+def _crear_almacen():
+    if os.getenv("ALMACENAMIENTO_BACKEND", "local").lower() == "s3":
+        return AlmacenS3(ClienteS3(
+            os.getenv("S3_ENDPOINT", "http://localhost:9000"),
+            os.getenv("S3_BUCKET", "prospectos"),
+            os.getenv("S3_ACCESS_KEY", "minioadmin"),
+            os.getenv("S3_SECRET_KEY", "minioadmin"),
+            os.getenv("S3_REGION", "us-east-1")
+        ))
+    return AlmacenLocal(os.getenv("ALMACENAMIENTO_DIRECTORIO", "uploads"))
+
+
+almacen = _crear_almacen()
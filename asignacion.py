@@ -0,0 +1,264 @@
+"""
+Asignación masiva de prospectos a agentes.
+
+`asignar_en_bloque` reparte muchos prospectos en una sola transacción: un
+UPDATE masivo por clave primaria, las notificaciones en un INSERT masivo y un
+correo de resumen por agente en la bandeja de salida (en vez de uno por
+prospecto).
+
+Estrategias de reparto:
+- "round_robin": por turnos, empezando por el agente que lleva más tiempo sin
+  recibir una asignación (así los repartos sucesivos siguen la rotación).
+- "menos_cargado": cada prospecto va al agente con menos prospectos abiertos
+  (nuevo, en seguimiento, cotizado), contando los que se le van asignando.
+- "ponderado": proporcional a la tasa de conversión (ganados / cotizaciones)
+  de los últimos DIAS_CONVERSION días según el resumen diario; los agentes con
+  poca historia se acercan a la media del equipo.
+"""
+import heapq
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import case, func, insert, update
+
+import correo
+import estadisticas
+import indice_busqueda
+import models
+from models import TipoUsuario, EstadoProspecto
+
+ESTRATEGIAS = ("round_robin", "menos_cargado", "ponderado")
+ESTADOS_ABIERTOS = [
+    EstadoProspecto.NUEVO.value,
+    EstadoProspecto.EN_SEGUIMIENTO.value,
+    EstadoProspecto.COTIZADO.value
+]
+DIAS_CONVERSION = 90
+# Cotizaciones "virtuales" con la tasa media del equipo que se suman a cada agente
+COTIZACIONES_PREVIAS = 5
+MAX_PROSPECTOS_EN_CORREO = 20
+
+
+def agentes_disponibles(db, agentes_ids: Optional[List[int]] = None) -> List[models.Usuario]:
+    """Agentes activos (todos o los indicados); error si alguno de los indicados no lo es"""
+    query = db.query(models.Usuario).filter(
+        models.Usuario.tipo_usuario == TipoUsuario.AGENTE.value,
+        models.Usuario.activo == 1
+    )
+    if agentes_ids:
+        query = query.filter(models.Usuario.id.in_(agentes_ids))
+    agentes = query.order_by(models.Usuario.id).all()
+    if agentes_ids and len(agentes) != len(set(agentes_ids)):
+        desconocidos = set(agentes_ids) - {a.id for a in agentes}
+        raise ValueError(f"Agentes no válidos o inactivos: {sorted(desconocidos)}")
+    if not agentes:
+        raise ValueError("No hay agentes activos para asignar")
+    return agentes
+
+
+def consultar_prospectos(db, prospecto_ids: Optional[List[int]] = None, estado: Optional[str] = None,
+                         agente_asignado_id: Optional[str] = None, medio_ingreso_id: Optional[str] = None,
+                         destino: Optional[str] = None, busqueda_global: Optional[str] = None,
+                         limite: Optional[int] = None):
+    """
+    Prospectos a repartir: los ids indicados o los que cumplen los filtros (los
+    mismos del listado). Sin ids ni filtros, la bandeja por defecto del
+    supervisor: nuevos sin asignar. Solo se leen las columnas necesarias.
+    """
+    P = models.Prospecto
+    query = db.query(P.id, P.nombre, P.apellido, P.fecha_registro, P.agente_asignado_id)
+
+    if prospecto_ids:
+        query = query.filter(P.id.in_(prospecto_ids))
+    else:
+        if estado is None and agente_asignado_id is None:
+            estado, agente_asignado_id = EstadoProspecto.NUEVO.value, "sin_asignar"
+        if estado and estado != "todos":
+            query = query.filter(P.estado == estado)
+        if agente_asignado_id == "sin_asignar":
+            query = query.filter(P.agente_asignado_id == None)
+        elif agente_asignado_id and agente_asignado_id != "todos":
+            query = query.filter(P.agente_asignado_id == int(agente_asignado_id))
+        if medio_ingreso_id and medio_ingreso_id != "todos":
+            query = query.filter(P.medio_ingreso_id == int(medio_ingreso_id))
+        if destino:
+            query = query.filter(P.destino.ilike(f"%{destino}%"))
+        if busqueda_global:
+            query, _ = indice_busqueda.aplicar_busqueda(query, busqueda_global)
+
+    # Los más antiguos primero: son los que más tiempo llevan esperando
+    query = query.order_by(P.fecha_registro, P.id)
+    if limite:
+        query = query.limit(limite)
+    return query.all()
+
+
+# ========== ESTRATEGIAS ==========
+
+def _orden_rotacion(db, agentes: List[models.Usuario]) -> List[models.Usuario]:
+    """Agentes ordenados por su última asignación recibida (el que más espera, primero)"""
+    N = models.Notificacion
+    ultimas = dict(db.query(N.usuario_id, func.max(N.fecha_creacion)).filter(
+        N.tipo == "asignacion",
+        N.usuario_id.in_([a.id for a in agentes])
+    ).group_by(N.usuario_id).all())
+    return sorted(agentes, key=lambda a: (ultimas.get(a.id) or datetime.min, a.id))
+
+
+def cargas_abiertas(db, agentes_ids: List[int]) -> Dict[int, int]:
+    """Prospectos abiertos por agente en una sola consulta agrupada"""
+    P = models.Prospecto
+    filas = db.query(P.agente_asignado_id, func.count(P.id)).filter(
+        P.estado.in_(ESTADOS_ABIERTOS),
+        P.agente_asignado_id.in_(agentes_ids)
+    ).group_by(P.agente_asignado_id).all()
+    cargas = dict.fromkeys(agentes_ids, 0)
+    cargas.update(filas)
+    return cargas
+
+
+def tasas_conversion(db, agentes_ids: List[int], dias: int = DIAS_CONVERSION) -> Dict[int, float]:
+    """Ganados / cotizaciones por agente en los últimos días, suavizada hacia la media del equipo"""
+    R = models.ResumenDiario
+    filas = db.query(
+        R.agente_id,
+        func.sum(case((R.estado == EstadoProspecto.GANADO.value, R.cambios_estado), else_=0)),
+        func.sum(R.cotizaciones)
+    ).filter(
+        R.fecha >= date.today() - timedelta(days=dias),
+        R.agente_id.in_(agentes_ids)
+    ).group_by(R.agente_id).all()
+    ganados = {agente_id: g or 0 for agente_id, g, _ in filas}
+    cotizaciones = {agente_id: c or 0 for agente_id, _, c in filas}
+
+    total_cotizaciones = sum(cotizaciones.values())
+    media = sum(ganados.values()) / total_cotizaciones if total_cotizaciones else 0
+    if not media:
+        # Sin ventas registradas en el periodo: todos pesan lo mismo
+        return dict.fromkeys(agentes_ids, 1.0)
+    return {
+        agente_id: (ganados.get(agente_id, 0) + COTIZACIONES_PREVIAS * media)
+        / (cotizaciones.get(agente_id, 0) + COTIZACIONES_PREVIAS)
+        for agente_id in agentes_ids
+    }
+
+
+def repartir(db, cantidad: int, agentes: List[models.Usuario], estrategia: str) -> tuple:
+    """
+    Devuelve (ids de agente para cada uno de los `cantidad` prospectos, métrica por
+    agente usada en el reparto: carga abierta o tasa de conversión)
+    """
+    if estrategia not in ESTRATEGIAS:
+        raise ValueError(f"Estrategia desconocida: {estrategia} (use {', '.join(ESTRATEGIAS)})")
+
+    orden = _orden_rotacion(db, agentes)
+    ids = [a.id for a in orden]
+
+    if estrategia == "round_robin":
+        return [ids[i % len(ids)] for i in range(cantidad)], {}
+
+    if estrategia == "menos_cargado":
+        cargas = cargas_abiertas(db, ids)
+        # (carga, turno en la rotación, agente): a igual carga decide la rotación
+        monton = [(cargas[agente_id], turno, agente_id) for turno, agente_id in enumerate(ids)]
+        heapq.heapify(monton)
+        elegidos = []
+        for _ in range(cantidad):
+            carga, turno, agente_id = heapq.heappop(monton)
+            elegidos.append(agente_id)
+            heapq.heappush(monton, (carga + 1, turno, agente_id))
+        return elegidos, cargas
+
+    # ✅ Round robin ponderado "suave": reparte en proporción al peso sin rachas largas
+    pesos = tasas_conversion(db, ids)
+    total = sum(pesos.values())
+    acumulado = dict.fromkeys(ids, 0.0)
+    elegidos = []
+    for _ in range(cantidad):
+        for agente_id in ids:
+            acumulado[agente_id] += pesos[agente_id]
+        agente_id = max(ids, key=lambda a: acumulado[a])  # max() se queda con el primero en empate
+        acumulado[agente_id] -= total
+        elegidos.append(agente_id)
+    return elegidos, pesos
+
+
+# ========== APLICACIÓN EN BLOQUE ==========
+
+def _nombre(prospecto) -> str:
+    return " ".join(parte for parte in (prospecto.nombre, prospecto.apellido) if parte) or f"#{prospecto.id}"
+
+
+def asignar_en_bloque(db, prospectos: list, agentes: List[models.Usuario], estrategia: str,
+                      simular: bool = False) -> tuple:
+    """
+    Reparte los prospectos (filas de `consultar_prospectos`) y, salvo que se
+    simule, escribe asignaciones, notificaciones y correos. No hace commit: la
+    petición confirma todo junto. Devuelve (resultado, notificaciones creadas
+    como (usuario_id, tipo, mensaje) para publicarlas tras el commit).
+    """
+    elegidos, metrica = repartir(db, len(prospectos), agentes, estrategia)
+    por_id = {a.id: a for a in agentes}
+
+    # Los que ya tienen al agente elegido no se tocan ni se notifican
+    cambios = [(p, agente_id) for p, agente_id in zip(prospectos, elegidos) if p.agente_asignado_id != agente_id]
+    por_agente = defaultdict(list)
+    for prospecto, agente_id in cambios:
+        por_agente[agente_id].append(prospecto)
+
+    resultado = {
+        "estrategia": estrategia,
+        "total": len(prospectos),
+        "asignados": len(cambios),
+        "sin_cambios": len(prospectos) - len(cambios),
+        "por_agente": [
+            {
+                "agente_id": agente.id,
+                "username": agente.username,
+                "asignados": len(por_agente.get(agente.id, [])),
+                **({"carga_abierta": metrica[agente.id]} if estrategia == "menos_cargado" else {}),
+                **({"tasa_conversion": round(metrica[agente.id], 4)} if estrategia == "ponderado" else {})
+            }
+            for agente in agentes
+        ],
+        "asignaciones": [{"prospecto_id": p.id, "agente_id": agente_id} for p, agente_id in cambios]
+    }
+    if simular or not cambios:
+        return resultado, []
+
+    P = models.Prospecto
+    ahora = datetime.now()
+    # ✅ UPDATE masivo por clave primaria (executemany)
+    db.execute(update(P), [{"id": p.id, "agente_asignado_id": agente_id} for p, agente_id in cambios])
+
+    # ✅ Una notificación por prospecto, igual que en la asignación individual
+    notificaciones = [{
+        "usuario_id": agente_id,
+        "prospecto_id": p.id,
+        "tipo": "asignacion",
+        "mensaje": f"Te han asignado un nuevo prospecto: {_nombre(p)}",
+        "fecha_creacion": ahora,
+        "leida": False,
+        "email_enviado": False
+    } for p, agente_id in cambios]
+    db.execute(insert(models.Notificacion), notificaciones)
+
+    # ✅ Un solo correo por agente con el resumen
+    for agente_id, asignados in por_agente.items():
+        agente = por_id[agente_id]
+        if not agente.email:
+            continue
+        lineas = [f"- {_nombre(p)}" for p in asignados[:MAX_PROSPECTOS_EN_CORREO]]
+        if len(asignados) > MAX_PROSPECTOS_EN_CORREO:
+            lineas.append(f"... y {len(asignados) - MAX_PROSPECTOS_EN_CORREO} más")
+        cuerpo = (
+            f"Hola {agente.username},\n\nSe te han asignado {len(asignados)} prospectos:\n"
+            + "\n".join(lineas)
+            + "\n\nIngresa al sistema para gestionarlos."
+        )
+        correo.encolar_correo(db, agente.email, "Nuevos Prospectos Asignados 🚀", cuerpo)
+
+    # El resumen diario cuenta los registros por agente asignado: recalcular sus días
+    estadisticas.marcar_dias_resumen(db, {p.fecha_registro.date() for p, _ in cambios if p.fecha_registro})
+    return resultado, [(n["usuario_id"], n["tipo"], n["mensaje"]) for n in notificaciones]
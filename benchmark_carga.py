@@ -0,0 +1,123 @@
+"""
+Benchmark: latencia de /prospectos mientras /dashboard?periodo=año está bajo carga.
+
+Un cliente consulta /prospectos cada 50 ms mientras N clientes piden sin pausa el
+dashboard del año. Imprime p50/p99 de /prospectos sin carga y con carga, y las
+respuestas por segundo del dashboard. Sirve para comprobar que un handler lento
+no bloquea a los demás (pool de hilos, HILOS_TRABAJO y DB_POOL_SIZE).
+
+Uso (con la aplicación ya arrancada, p. ej. uvicorn main:app --port 8000):
+    python benchmark_carga.py --sembrar 100000   # opcional: volumen en DATABASE_URL
+    python benchmark_carga.py --url http://127.0.0.1:8000 --segundos 15 --clientes 16
+
+Requiere httpx (pip install httpx).
+"""
+import argparse
+import asyncio
+import random
+import time
+from datetime import datetime, timedelta
+
+import httpx
+
+LISTADO = "/prospectos?estado=todos&agente_asignado_id=todos"
+DASHBOARD = "/dashboard?periodo=año"
+
+
+def sembrar_prospectos(cantidad: int, lote: int = 5000):
+    """Inserta prospectos sintéticos del último año directamente en la base de datos"""
+    from sqlalchemy import insert
+    import database
+    import estadisticas
+    import models
+
+    database.check_and_migrate()
+    db = database.SessionLocal()
+    try:
+        medios = [m.id for m in db.query(models.MedioIngreso.id)]
+        agentes = [u.id for u in db.query(models.Usuario.id).filter(
+            models.Usuario.tipo_usuario == models.TipoUsuario.AGENTE.value
+        )]
+        destinos = ["Cancún, México", "Punta Cana", "Madrid, España", "San Andrés", "Cartagena"]
+        inicio = datetime.now() - timedelta(days=360)
+        filas = []
+        for i in range(cantidad):
+            telefono = f"39{i:08d}"
+            filas.append({
+                "nombre": f"Carga{i}", "apellido": "Benchmark", "telefono": telefono,
+                "telefono_normalizado": models.normalizar_telefono(telefono),
+                "destino": random.choice(destinos), "estado": models.EstadoProspecto.NUEVO.value,
+                "fecha_registro": inicio + timedelta(seconds=random.randint(0, 360 * 86400)),
+                "medio_ingreso_id": random.choice(medios) if medios else None,
+                "agente_asignado_id": random.choice(agentes) if agentes else None,
+                "tiene_datos_completos": i % 2 == 0, "cliente_recurrente": False,
+                "pasajeros_adultos": 1, "pasajeros_ninos": 0, "pasajeros_infantes": 0,
+            })
+            if len(filas) == lote:
+                db.execute(insert(models.Prospecto), filas)
+                filas = []
+        if filas:
+            db.execute(insert(models.Prospecto), filas)
+        db.commit()
+        # Las inserciones sin ORM no pasan por los listeners del resumen diario
+        estadisticas.reconstruir_resumen_diario(db)
+        print(f"🌱 {cantidad} prospectos insertados")
+    finally:
+        db.close()
+
+
+def percentil(valores, p: float) -> float:
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p))] * 1000
+
+
+async def medir(args):
+    limites = httpx.Limits(max_connections=args.clientes + 10)
+    async with httpx.AsyncClient(base_url=args.url, limits=limites, timeout=120) as cliente:
+        respuesta = await cliente.post("/login", data={"username": args.usuario, "password": args.clave})
+        if "session_token" not in cliente.cookies:
+            raise SystemExit(f"❌ Login fallido ({respuesta.status_code})")
+
+        async def sondeo(fin, latencias):
+            while time.monotonic() < fin:
+                inicio = time.perf_counter()
+                respuesta = await cliente.get(LISTADO)
+                latencias.append(time.perf_counter() - inicio)
+                assert respuesta.status_code == 200, respuesta.status_code
+                await asyncio.sleep(0.05)
+
+        async def martillo(fin, codigos):
+            while time.monotonic() < fin:
+                respuesta = await cliente.get(DASHBOARD)
+                codigos.append(respuesta.status_code)
+
+        # Calentamiento y referencia sin carga
+        await cliente.get(LISTADO)
+        await cliente.get(DASHBOARD)
+        sin_carga = []
+        await sondeo(time.monotonic() + 3, sin_carga)
+
+        fin = time.monotonic() + args.segundos
+        con_carga, codigos = [], []
+        await asyncio.gather(sondeo(fin, con_carga), *[martillo(fin, codigos) for _ in range(args.clientes)])
+
+    print(f"📋 /prospectos sin carga: p50 {percentil(sin_carga, .5):.0f} ms, p99 {percentil(sin_carga, .99):.0f} ms")
+    print(f"📋 /prospectos con {args.clientes} clientes en {DASHBOARD}: n={len(con_carga)}, "
+          f"p50 {percentil(con_carga, .5):.0f} ms, p99 {percentil(con_carga, .99):.0f} ms, "
+          f"máx {max(con_carga) * 1000:.0f} ms")
+    print(f"📊 {DASHBOARD}: {len(codigos)} respuestas ({len(codigos) / args.segundos:.1f}/s), códigos {sorted(set(codigos))}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--usuario", default="admin")
+    parser.add_argument("--clave", default="admin123")
+    parser.add_argument("--segundos", type=float, default=15)
+    parser.add_argument("--clientes", type=int, default=16, help="clientes pidiendo el dashboard")
+    parser.add_argument("--sembrar", type=int, default=0, help="inserta N prospectos en DATABASE_URL y termina")
+    args = parser.parse_args()
+    if args.sembrar:
+        sembrar_prospectos(args.sembrar)
+    else:
+        asyncio.run(medir(args))
@@ -0,0 +1,124 @@
+"""
+Benchmark: subidas simultáneas de documentos grandes (por defecto 8 de 20 MB).
+
+Sube N PDF sintéticos distintos a la vez a /prospectos/{id}/documento mientras otro
+proceso pide /login cada 20 ms, e imprime el tiempo total de las subidas y la
+latencia del ping (p50/p99/máx): la copia, el SHA-256 y el fsync no deben frenar
+al resto de peticiones. Con --verificar comprueba además, leyendo DATABASE_URL y el
+almacenamiento configurado, que el hash y el tamaño guardados coinciden con lo
+enviado y que no quedan temporales .part.
+
+Uso (con la aplicación ya arrancada, p. ej. uvicorn main:app --port 8000):
+    python benchmark_subidas.py --url http://127.0.0.1:8000 --mb 20 --subidas 8 --verificar
+
+Requiere httpx (pip install httpx).
+"""
+import argparse
+import asyncio
+import hashlib
+import multiprocessing
+import os
+import time
+
+import httpx
+
+
+def percentil(valores, p: float) -> float:
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p))] * 1000
+
+
+def ping(url: str, detener, resultado):
+    """GET /login cada 20 ms en otro proceso: el bucle que sube no atrasa las mediciones"""
+    latencias = []
+    with httpx.Client(base_url=url, timeout=300) as cliente:
+        while not detener.is_set():
+            inicio = time.perf_counter()
+            cliente.get("/login")
+            latencias.append(time.perf_counter() - inicio)
+            time.sleep(0.02)
+    resultado.put(latencias)
+
+
+async def subir(args, contenidos):
+    async with httpx.AsyncClient(base_url=args.url, timeout=300) as cliente:
+        respuesta = await cliente.post("/login", data={"username": args.usuario, "password": args.clave})
+        if "session_token" not in cliente.cookies:
+            raise SystemExit(f"❌ Login fallido ({respuesta.status_code})")
+        return await asyncio.gather(*[
+            cliente.post(
+                f"/prospectos/{args.prospecto}/documento",
+                files={"archivo": (f"benchmark_{i}.pdf", contenido, "application/pdf")},
+                data={"tipo_documento": "otro"}, follow_redirects=False
+            )
+            for i, contenido in enumerate(contenidos)
+        ])
+
+
+def medir(args, contenidos) -> bool:
+    detener, resultado = multiprocessing.Event(), multiprocessing.Queue()
+    proceso = multiprocessing.Process(target=ping, args=(args.url, detener, resultado))
+    proceso.start()
+    time.sleep(0.5)
+    inicio = time.perf_counter()
+    respuestas = asyncio.run(subir(args, contenidos))
+    total = time.perf_counter() - inicio
+    detener.set()
+    latencias = resultado.get()
+    proceso.join()
+
+    fallidas = [r for r in respuestas if r.status_code != 303 or "error" in r.headers.get("location", "")]
+    print(f"📤 {len(contenidos)} x {args.mb} MB en {total:.2f} s ({len(fallidas)} fallidas)")
+    print(f"🏓 /login durante las subidas: p50 {percentil(latencias, .5):.0f} ms, "
+          f"p99 {percentil(latencias, .99):.0f} ms, máx {max(latencias) * 1000:.0f} ms ({len(latencias)} pings)")
+    return not fallidas
+
+
+def verificar(contenidos) -> bool:
+    """Hash, tamaño y contenido guardados de cada subida; sin temporales .part"""
+    import database
+    import documentos
+    import models
+
+    db = database.SessionLocal()
+    correctos = True
+    try:
+        for contenido in contenidos:
+            esperado = hashlib.sha256(contenido).hexdigest()
+            documento = db.query(models.Documento).filter(models.Documento.hash_sha256 == esperado).first()
+            guardado = hashlib.sha256()
+            if documento is not None:
+                for bloque in documentos.almacen.leer(documento.ruta_archivo):
+                    guardado.update(bloque)
+            if documento is None or documento.tamano_bytes != len(contenido) or guardado.hexdigest() != esperado:
+                print(f"❌ Documento {esperado[:12]} no coincide con lo enviado")
+                correctos = False
+    finally:
+        db.close()
+    directorio = getattr(documentos.almacen, "raiz", None)  # Solo el almacenamiento local
+    if directorio:
+        parciales = [f for _, _, archivos in os.walk(directorio) for f in archivos if f.endswith(".part")]
+        if parciales:
+            print(f"❌ Temporales sin borrar: {parciales}")
+            correctos = False
+    print("✅ Hash, tamaño y contenido correctos" if correctos else "❌ Verificación fallida")
+    return correctos
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--usuario", default="admin")
+    parser.add_argument("--clave", default="admin123")
+    parser.add_argument("--mb", type=int, default=20)
+    parser.add_argument("--subidas", type=int, default=8)
+    parser.add_argument("--prospecto", type=int, default=1, help="prospecto al que se suben los documentos")
+    parser.add_argument("--verificar", action="store_true", help="compara lo guardado con lo enviado")
+    args = parser.parse_args()
+
+    # Contenido distinto en cada subida: con el mismo, la deduplicación guardaría un solo archivo
+    contenidos = [b"%PDF-1.4\n" + os.urandom(args.mb * 1024 * 1024) for _ in range(args.subidas)]
+    correcto = medir(args, contenidos)
+    if args.verificar:
+        correcto = verificar(contenidos) and correcto
+    raise SystemExit(0 if correcto else 1)
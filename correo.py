@@ -0,0 +1,273 @@
+"""
+Envío de correos por bandeja de salida (outbox).
+
+Los handlers no hablan con el servidor SMTP: `encolar_correo` guarda el correo
+en la tabla `correos_pendientes` dentro de la misma transacción que la
+notificación, y el planificador llama a `enviar_pendientes`, que los envía
+reutilizando una sola conexión SMTP, reintenta con espera exponencial y marca
+`Notificacion.email_enviado` al enviarse. Cada correo se reclama con un UPDATE
+condicional (estado "enviando" hasta un vencimiento) y se confirma uno a uno.
+
+Sin SMTP_HOST los envíos se simulan (solo se imprimen). Para probar contra un
+servidor real sin enviar nada, levantar el servidor de depuración local:
+
+    python correo.py --puerto 1025
+    SMTP_HOST=localhost SMTP_PUERTO=1025 uvicorn main:app
+"""
+import argparse
+import asyncio
+import os
+import smtplib
+import time
+from datetime import datetime, timedelta
+from email import message_from_bytes, policy
+from email.mime.text import MIMEText
+from typing import Optional
+
+import database
+import models
+
+SMTP_HOST = os.getenv("SMTP_HOST", "")
+SMTP_PUERTO = int(os.getenv("SMTP_PUERTO", "587"))
+SMTP_USUARIO = os.getenv("SMTP_USUARIO", "")
+SMTP_PASSWORD = os.getenv("SMTP_PASSWORD", "")
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "false").lower() in ("1", "true", "si", "sí")
+SMTP_REMITENTE = os.getenv("SMTP_REMITENTE", "sistema@prospectos.com")
+SMTP_TIMEOUT = 10
+
+CORREO_INTERVALO_SEGUNDOS = int(os.getenv("CORREO_INTERVALO_SEGUNDOS", "30"))
+CORREO_LOTE = int(os.getenv("CORREO_LOTE", "50"))  # Correos por lote
+CORREO_MAX_INTENTOS = int(os.getenv("CORREO_MAX_INTENTOS", "5"))
+CORREO_REINTENTO_BASE = 60  # segundos; se duplica en cada intento (máximo 1 hora)
+# Tiempo que un correo queda reclamado ("enviando") por un worker; si muere sin
+# confirmar el envío, otro lo reintenta al caducar
+CORREO_RECLAMO_SEGUNDOS = int(os.getenv("CORREO_RECLAMO_SEGUNDOS", "300"))
+
+# Errores que afectan solo a un mensaje: la conexión sigue sirviendo para los demás
+ERRORES_DE_MENSAJE = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError)
+
+
+def encolar_correo(db, destinatario: str, asunto: str, cuerpo: str,
+                   notificacion: Optional[models.Notificacion] = None) -> models.CorreoPendiente:
+    """Guarda el correo en la bandeja de salida (se confirma con el commit de la petición)"""
+    correo = models.CorreoPendiente(
+        destinatario=destinatario,
+        asunto=asunto,
+        cuerpo=cuerpo,
+        notificacion=notificacion
+    )
+    db.add(correo)
+    return correo
+
+
+def _construir_mensaje(correo: models.CorreoPendiente) -> MIMEText:
+    mensaje = MIMEText(correo.cuerpo, "plain", "utf-8")
+    mensaje["Subject"] = correo.asunto
+    mensaje["From"] = SMTP_REMITENTE
+    mensaje["To"] = correo.destinatario
+    return mensaje
+
+
+def _conectar() -> smtplib.SMTP:
+    servidor = smtplib.SMTP(SMTP_HOST, SMTP_PUERTO, timeout=SMTP_TIMEOUT)
+    if SMTP_STARTTLS:
+        servidor.starttls()
+    if SMTP_USUARIO:
+        servidor.login(SMTP_USUARIO, SMTP_PASSWORD)
+    return servidor
+
+
+def _programar_reintento(correo: models.CorreoPendiente, error: Exception):
+    correo.intentos = (correo.intentos or 0) + 1
+    correo.ultimo_error = str(error)[:500]
+    if correo.intentos >= CORREO_MAX_INTENTOS:
+        correo.estado = "fallido"
+        print(f"❌ Correo {correo.id} a {correo.destinatario} descartado tras {correo.intentos} intentos: {error}")
+    else:
+        espera = min(CORREO_REINTENTO_BASE * 2 ** (correo.intentos - 1), 3600)
+        correo.estado = "pendiente"
+        correo.proximo_intento = datetime.now() + timedelta(seconds=espera)
+
+
+def reclamar_correo(db, correo_id: int) -> bool:
+    """
+    Marca el correo como "enviando" si sigue disponible: pendiente y vencido, o un
+    reclamo anterior caducado (el worker murió enviándolo). UPDATE condicional y
+    commit: si otro worker lo reclamó antes, no afecta filas y se salta.
+    """
+    C = models.CorreoPendiente
+    ahora = datetime.now()
+    reclamado = db.query(C).filter(
+        C.id == correo_id,
+        C.estado.in_(["pendiente", "enviando"]),
+        C.proximo_intento <= ahora
+    ).update({
+        C.estado: "enviando",
+        C.proximo_intento: ahora + timedelta(seconds=CORREO_RECLAMO_SEGUNDOS)
+    }, synchronize_session=False)
+    db.commit()
+    return reclamado == 1
+
+
+def enviar_pendientes(duracion_maxima: Optional[float] = None) -> dict:
+    """
+    Envía los correos vencidos reutilizando una sola conexión SMTP; devuelve los conteos.
+
+    Cada correo se reclama antes de enviarlo y se confirma justo después, así dos
+    workers nunca envían el mismo y un error a mitad de lote no reenvía los ya enviados.
+    """
+    if duracion_maxima is None:
+        # Sin reclamar más correos cuando el último envío (conexión + envío) podría
+        # pasarse del lease del planificador (intervalo - 5 s)
+        duracion_maxima = max(CORREO_INTERVALO_SEGUNDOS - 5 - 2 * SMTP_TIMEOUT, 1)
+    inicio = time.monotonic()
+    enviados = reintentos = 0
+    servidor = None
+    conexion_caida = False
+    db = database.SessionLocal()
+    try:
+        while not conexion_caida and time.monotonic() - inicio < duracion_maxima:
+            C = models.CorreoPendiente
+            candidatos = [i for (i,) in db.query(C.id).filter(
+                C.estado.in_(["pendiente", "enviando"]),
+                C.proximo_intento <= datetime.now()
+            ).order_by(C.id).limit(CORREO_LOTE)]
+            if not candidatos:
+                break
+
+            for correo_id in candidatos:
+                if time.monotonic() - inicio >= duracion_maxima:
+                    break
+                if not reclamar_correo(db, correo_id):
+                    continue  # Lo está enviando otro worker
+                correo = db.get(C, correo_id)
+                try:
+                    if SMTP_HOST:
+                        if servidor is None:
+                            servidor = _conectar()
+                        servidor.send_message(_construir_mensaje(correo))
+                    else:
+                        print(f"📧 [EMAIL SIMULADO] A: {correo.destinatario} | Asunto: {correo.asunto}")
+                except ERRORES_DE_MENSAJE as e:
+                    _programar_reintento(correo, e)
+                    reintentos += 1
+                    db.commit()
+                    continue
+                except (smtplib.SMTPException, OSError) as e:
+                    # Servidor caído o conexión rota: el correo vuelve a la cola y se para
+                    print(f"⚠️ Servidor SMTP no disponible: {e}")
+                    _programar_reintento(correo, e)
+                    reintentos += 1
+                    db.commit()
+                    servidor = None
+                    conexion_caida = True
+                    break
+                except Exception as e:
+                    # Error ajeno al SMTP (p. ej. al construir el mensaje): solo este correo
+                    print(f"⚠️ Error preparando el correo {correo.id}: {e}")
+                    _programar_reintento(correo, e)
+                    reintentos += 1
+                    db.commit()
+                    continue
+
+                correo.estado = "enviado"
+                correo.fecha_envio = datetime.now()
+                correo.ultimo_error = None
+                if correo.notificacion_id:
+                    db.query(models.Notificacion).filter(
+                        models.Notificacion.id == correo.notificacion_id
+                    ).update({models.Notificacion.email_enviado: True}, synchronize_session=False)
+                db.commit()  # ✅ Confirmado al momento: nunca se vuelve a enviar
+                enviados += 1
+
+            if len(candidatos) < CORREO_LOTE:
+                break
+    finally:
+        if servidor is not None:
+            try:
+                servidor.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+        db.close()
+
+    if enviados or reintentos:
+        print(f"📧 Correos enviados: {enviados}, con reintento: {reintentos}")
+    return {"enviados": enviados, "reintentos": reintentos}
+
+
+# ========== SERVIDOR SMTP DE DEPURACIÓN ==========
+
+class ServidorSmtpPrueba:
+    """Servidor SMTP local que acepta todo y muestra los correos recibidos (solo desarrollo)"""
+
+    def __init__(self):
+        self.mensajes = []
+
+    async def atender(self, lector: asyncio.StreamReader, escritor: asyncio.StreamWriter):
+        def responder(texto: str):
+            escritor.write(f"{texto}\r\n".encode("utf-8"))
+
+        responder("220 prospectos SMTP de prueba")
+        remitente, destinatarios = None, []
+        try:
+            while True:
+                linea = await lector.readline()
+                if not linea:
+                    break
+                comando = linea.decode("utf-8", "replace").strip()
+                verbo = comando[:4].upper()
+                if verbo == "EHLO":
+                    responder("250-localhost")
+                    responder("250 8BITMIME")
+                elif verbo in ("HELO", "NOOP"):
+                    responder("250 OK")
+                elif verbo == "MAIL":
+                    remitente, destinatarios = comando[10:].strip(" <>"), []
+                    responder("250 OK")
+                elif verbo == "RCPT":
+                    destinatarios.append(comando[8:].strip(" <>"))
+                    responder("250 OK")
+                elif verbo == "DATA":
+                    responder("354 Terminar con <CRLF>.<CRLF>")
+                    await escritor.drain()
+                    lineas = []
+                    while True:
+                        linea = await lector.readline()
+                        if linea in (b".\r\n", b".\n", b""):
+                            break
+                        lineas.append(linea[1:] if linea.startswith(b"..") else linea)
+                    mensaje = message_from_bytes(b"".join(lineas), policy=policy.default)
+                    self.mensajes.append((remitente, destinatarios, mensaje))
+                    print(f"📨 De: {remitente} | Para: {', '.join(destinatarios)} | Asunto: {mensaje['Subject']}")
+                    responder("250 OK")
+                elif verbo == "RSET":
+                    remitente, destinatarios = None, []
+                    responder("250 OK")
+                elif verbo == "QUIT":
+                    responder("221 Adiós")
+                    break
+                else:
+                    responder("502 Comando no soportado")
+                await escritor.drain()
+        except ConnectionError:
+            pass
+        finally:
+            escritor.close()
+
+    async def iniciar(self, host: str = "127.0.0.1", puerto: int = 1025):
+        return await asyncio.start_server(self.atender, host, puerto)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Servidor SMTP local de depuración")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--puerto", type=int, default=1025)
+    opciones = parser.parse_args()
+
+    async def principal():
+        servidor = await ServidorSmtpPrueba().iniciar(opciones.host, opciones.puerto)
+        print(f"✅ Servidor SMTP de depuración escuchando en {opciones.host}:{opciones.puerto}")
+        async with servidor:
+            await servidor.serve_forever()
+
+    asyncio.run(principal())
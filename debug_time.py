@@ -2,17 +2,13 @@
 import sys
 import os
 from datetime import datetime
-from sqlalchemy import create_engine, text
-from sqlalchemy.orm import sessionmaker
 import models
 
 # Configura la ruta correcta
 sys.path.append(os.getcwd())
 
-# Configuración base de datos
-SQLALCHEMY_DATABASE_URL = "sqlite:///./prospectos.db"
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Configuración base de datos (misma URL que la aplicación, ver DATABASE_URL)
+from database import SessionLocal
 db = SessionLocal()
 
 print(f"Hora del Sistema (datetime.now): {datetime.now()}")
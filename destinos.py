@@ -0,0 +1,235 @@
+"""
+Índice en memoria de destinos para el autocompletado (/api/destinos/sugerencias).
+
+Un trie de prefijos sobre la forma normalizada de cada destino (minúsculas, sin
+tildes: "Cancún" y "cancun" son el mismo) con el número de prospectos de cada
+uno. Se indexa el destino completo y cada palabra, así "cana" encuentra
+"Punta Cana"; las coincidencias en medio de una palabra se buscan recorriendo
+las claves solo si el trie no llena el límite. Ordena por tipo de coincidencia
+y luego por popularidad.
+
+Se construye al arrancar con una consulta agrupada y se mantiene con los
+listeners de sesión (altas, cambios de destino y bajas de prospectos) al
+confirmar la transacción. Es por proceso: lo que escriben otros workers o las
+inserciones masivas (importación) se ve al reconstruirse, cada
+DESTINOS_REFRESCO_SEGUNDOS o al invalidarlo.
+"""
+import heapq
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter
+from typing import List, Optional
+
+from sqlalchemy import event, func
+from sqlalchemy.orm import attributes
+from sqlalchemy.orm.base import PASSIVE_NO_INITIALIZE
+
+import database
+import models
+
+DESTINOS_REFRESCO_SEGUNDOS = int(os.getenv("DESTINOS_REFRESCO_SEGUNDOS", "300"))
+
+# Clave en session.info donde se acumulan los cambios de destino hasta el commit
+CLAVE_DESTINOS = "destinos_cambios"
+
+
+def normalizar_destino(texto: Optional[str]) -> str:
+    """Clave de comparación: sin tildes, en minúsculas y con espacios simples"""
+    if not texto:
+        return ""
+    sin_tildes = "".join(
+        c for c in unicodedata.normalize("NFKD", texto) if not unicodedata.combining(c)
+    )
+    return re.sub(r"\s+", " ", sin_tildes.casefold()).strip()
+
+
+class _Nodo:
+    __slots__ = ("hijos", "claves")
+
+    def __init__(self):
+        self.hijos = {}
+        self.claves = set()  # Claves de destino bajo este prefijo
+
+
+class IndiceDestinos:
+    """Trie de prefijos + frecuencias; seguro entre hilos"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._lock_construccion = threading.Lock()
+        self._raiz = _Nodo()
+        self._variantes = {}  # clave -> Counter(texto original -> prospectos)
+        self._frecuencia = Counter()  # clave -> prospectos
+        self._construido = None  # instante de la última construcción
+
+    # ----- mantenimiento -----
+
+    def _insertar_en_trie(self, raiz: _Nodo, clave: str):
+        for inicio in _inicios_de_palabra(clave):
+            nodo = raiz
+            for caracter in clave[inicio:]:
+                nodo = nodo.hijos.setdefault(caracter, _Nodo())
+                nodo.claves.add(clave)
+
+    def _quitar_del_trie(self, clave: str):
+        for inicio in _inicios_de_palabra(clave):
+            camino = [self._raiz]
+            for caracter in clave[inicio:]:
+                nodo = camino[-1].hijos.get(caracter)
+                if nodo is None:
+                    break
+                nodo.claves.discard(clave)
+                camino.append(nodo)
+            # Podar los nodos que quedaron vacíos
+            for padre, caracter, nodo in reversed(list(zip(camino, clave[inicio:], camino[1:]))):
+                if nodo.claves:
+                    break
+                del padre.hijos[caracter]
+
+    def ajustar(self, cambios: Counter):
+        """Aplica {destino original: +n/-n prospectos}"""
+        with self._lock:
+            for destino, delta in cambios.items():
+                clave = normalizar_destino(destino)
+                if not clave or not delta:
+                    continue
+                variantes = self._variantes.setdefault(clave, Counter())
+                variante = destino.strip()
+                variantes[variante] += delta
+                if variantes[variante] <= 0:
+                    del variantes[variante]
+                nueva = self._frecuencia[clave] + delta
+                if nueva > 0 and variantes:
+                    if self._frecuencia[clave] <= 0:
+                        self._insertar_en_trie(self._raiz, clave)
+                    self._frecuencia[clave] = nueva
+                else:
+                    self._quitar_del_trie(clave)
+                    self._frecuencia.pop(clave, None)
+                    self._variantes.pop(clave, None)
+
+    def reconstruir(self, db):
+        """Reconstruye el índice desde la base de datos (una consulta agrupada)"""
+        P = models.Prospecto
+        filas = db.query(P.destino, func.count(P.id)).filter(
+            P.destino.isnot(None), P.destino != ''
+        ).group_by(P.destino).all()
+
+        raiz, variantes, frecuencia = _Nodo(), {}, Counter()
+        for destino, total in filas:
+            clave = normalizar_destino(destino)
+            if not clave:
+                continue
+            if clave not in frecuencia:
+                self._insertar_en_trie(raiz, clave)
+            variantes.setdefault(clave, Counter())[destino.strip()] += total
+            frecuencia[clave] += total
+
+        with self._lock:
+            self._raiz, self._variantes, self._frecuencia = raiz, variantes, frecuencia
+            self._construido = time.monotonic()
+        return len(frecuencia)
+
+    def invalidar(self):
+        """La próxima consulta reconstruye el índice (tras escrituras que no pasan por el ORM)"""
+        self._construido = None
+
+    def _vigente(self, db):
+        construido = self._construido
+        if construido is not None and time.monotonic() - construido < DESTINOS_REFRESCO_SEGUNDOS:
+            return
+        # Solo un hilo reconstruye; el resto sigue con el índice anterior si lo hay
+        if self._lock_construccion.acquire(blocking=construido is None):
+            try:
+                if self._construido is construido:
+                    self.reconstruir(db)
+            finally:
+                self._lock_construccion.release()
+
+    # ----- consulta -----
+
+    def sugerir(self, db, termino: str, limite: int = 10) -> List[str]:
+        """Destinos que coinciden con el término, los más relevantes y populares primero"""
+        self._vigente(db)
+        buscado = normalizar_destino(termino)
+        if not buscado or limite <= 0:
+            return []
+
+        with self._lock:
+            nodo = self._raiz
+            for caracter in buscado:
+                nodo = nodo.hijos.get(caracter)
+                if nodo is None:
+                    break
+            candidatos = set(nodo.claves) if nodo is not None else set()
+            if len(candidatos) < limite:
+                # Coincidencias en medio de una palabra: recorrido lineal de las claves
+                candidatos.update(c for c in self._frecuencia if buscado in c)
+
+            def orden(clave):
+                if clave.startswith(buscado):
+                    tipo = 0
+                elif _empieza_palabra(clave, buscado):
+                    tipo = 1
+                else:
+                    tipo = 2
+                return (tipo, -self._frecuencia[clave], clave)
+
+            mejores = heapq.nsmallest(limite, candidatos, key=orden)
+            # Se muestra la forma escrita más usada de cada destino
+            return [self._variantes[clave].most_common(1)[0][0] for clave in mejores]
+
+
+def _inicios_de_palabra(clave: str) -> List[int]:
+    return [0] + [m.end() for m in re.finditer(r"[\s\-/,.()]+", clave) if m.end() < len(clave)]
+
+
+def _empieza_palabra(clave: str, buscado: str) -> bool:
+    return any(clave.startswith(buscado, inicio) for inicio in _inicios_de_palabra(clave))
+
+
+indice_destinos = IndiceDestinos()
+
+
+# ========== MANTENIMIENTO AL CONFIRMAR TRANSACCIONES ==========
+
+@event.listens_for(database.SessionLocal, "after_flush")
+def _registrar_cambios_destino(session, flush_context):
+    """Acumula +1/-1 por destino de los prospectos creados, editados o eliminados en el flush"""
+    cambios = Counter()
+    for obj in session.new:
+        if isinstance(obj, models.Prospecto) and obj.destino:
+            cambios[obj.destino] += 1
+    for obj in session.dirty:
+        if isinstance(obj, models.Prospecto):
+            historial = attributes.get_history(obj, 'destino', passive=PASSIVE_NO_INITIALIZE)
+            if historial.deleted or historial.added:
+                for anterior in historial.deleted or ():
+                    if anterior:
+                        cambios[anterior] -= 1
+                for nuevo in historial.added or ():
+                    if nuevo:
+                        cambios[nuevo] += 1
+    for obj in session.deleted:
+        if isinstance(obj, models.Prospecto):
+            historial = attributes.get_history(obj, 'destino', passive=PASSIVE_NO_INITIALIZE)
+            for anterior in list(historial.unchanged or ()) + list(historial.deleted or ()):
+                if anterior:
+                    cambios[anterior] -= 1
+    if cambios:
+        session.info.setdefault(CLAVE_DESTINOS, Counter()).update(cambios)
+
+
+@event.listens_for(database.SessionLocal, "after_commit")
+def _aplicar_cambios_destino(session):
+    cambios = session.info.pop(CLAVE_DESTINOS, None)
+    if cambios and indice_destinos._construido is not None:
+        indice_destinos.ajustar(cambios)
+
+
+@event.listens_for(database.SessionLocal, "after_rollback")
+def _descartar_cambios_destino(session):
+    session.info.pop(CLAVE_DESTINOS, None)
@@ -0,0 +1,330 @@
+"""
+Almacén de documentos subidos (cotizaciones en PDF, etc.) direccionado por contenido.
+
+Cada contenido distinto se guarda una sola vez con la clave blobs/<ab>/<sha256>.<ext>
+en el almacenamiento configurado (carpeta local o bucket S3, ver almacenamiento.py)
+y la tabla archivos_blob lleva cuántos documentos lo referencian: subir el mismo
+PDF a varios prospectos reutiliza el archivo, y al eliminar el último documento
+que lo usa se borra.
+
+`guardar_blob` copia la subida por bloques a un temporal, calculando el SHA-256 y
+el tamaño sobre la marcha (sin cargar el archivo en memoria), lo sube a su clave
+final si el contenido no tiene ya referencias y solo después suma la referencia
+con un UPSERT: el bloqueo de escritura (que dura hasta el commit del handler) no
+se mantiene durante la subida al almacenamiento. Antes de subir confirma la fila
+del blob con 0 referencias, así un rollback del handler no deja el archivo fuera
+del alcance de la purga. `purgar_blobs` vuelve a
+comprobar las referencias bajo el bloqueo antes de borrar, y si una purga se
+cruzó con la subida (el UPSERT deja una sola referencia en un blob que ya
+existía), `guardar_blob` comprueba el archivo y lo vuelve a subir.
+Se llama desde handlers síncronos, que FastAPI ejecuta en el pool de hilos, así
+la escritura no bloquea el event loop.
+
+Los documentos anteriores (una copia con fecha por subida en uploads/) se pasan
+al almacén con:
+
+    python documentos.py [--simular]
+"""
+import argparse
+import hashlib
+import os
+import re
+import tempfile
+from datetime import datetime
+from typing import BinaryIO, Optional
+
+from sqlalchemy import delete, select, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+import models
+from almacenamiento import AlmacenLocal, almacen
+
+UPLOAD_DIR = "uploads"  # Documentos anteriores al almacén (copias locales)
+PREFIJO_BLOBS = "blobs/"
+TAMANO_BLOQUE = 1024 * 1024
+MAX_TAMANO_DOCUMENTO = int(os.getenv("MAX_TAMANO_DOCUMENTO_MB", "25")) * 1024 * 1024
+
+
+class ArchivoDemasiadoGrande(ValueError):
+    def __init__(self, maximo: int):
+        super().__init__(f"El archivo supera el máximo permitido ({maximo // (1024 * 1024)} MB)")
+        self.maximo = maximo
+
+
+def nombre_seguro(nombre: str) -> str:
+    """Nombre del archivo sin rutas (evita escribir fuera de la carpeta de destino)"""
+    return os.path.basename((nombre or "").replace("\\", "/")).strip() or "documento"
+
+
+def clave_blob(hash_sha256: str, nombre: str) -> str:
+    """Clave del blob con la extensión del nombre original (p. ej. .pdf)"""
+    extension = os.path.splitext(nombre_seguro(nombre))[1].lower()
+    return f"{PREFIJO_BLOBS}{hash_sha256[:2]}/{hash_sha256}{extension}"
+
+
+def clave_miniatura(hash_sha256: str) -> str:
+    """Miniatura de la primera página (la genera procesamiento_documentos.py)"""
+    return f"miniaturas/{hash_sha256[:2]}/{hash_sha256}.png"
+
+
+def _copiar_a_temporal(origen: BinaryIO, directorio: str, maximo: int) -> tuple:
+    """Copia `origen` por bloques a un temporal de `directorio`; devuelve (ruta, sha256, tamaño)"""
+    os.makedirs(directorio, exist_ok=True)
+    sha256 = hashlib.sha256()
+    tamano = 0
+    descriptor, ruta_temporal = tempfile.mkstemp(dir=directorio, prefix=".subida-", suffix=".part")
+    try:
+        with os.fdopen(descriptor, "wb") as destino:
+            while True:
+                bloque = origen.read(TAMANO_BLOQUE)
+                if not bloque:
+                    break
+                tamano += len(bloque)
+                if tamano > maximo:
+                    raise ArchivoDemasiadoGrande(maximo)
+                sha256.update(bloque)
+                destino.write(bloque)
+            destino.flush()
+            os.fsync(destino.fileno())
+    except BaseException:
+        _borrar(ruta_temporal)
+        raise
+    return ruta_temporal, sha256.hexdigest(), tamano
+
+
+def _borrar(ruta: str):
+    try:
+        os.remove(ruta)
+    except FileNotFoundError:
+        pass
+
+
+def sumar_referencias(connection, hash_sha256: str, ruta: str, tamano: int, cantidad: int = 1) -> int:
+    """Crea el blob o suma `cantidad` referencias en un UPSERT; devuelve las referencias resultantes"""
+    tabla = models.ArchivoBlob.__table__
+    if connection.dialect.name in ("sqlite", "postgresql"):
+        insertar = sqlite_insert if connection.dialect.name == "sqlite" else postgresql_insert
+        sentencia = insertar(tabla).values(
+            hash_sha256=hash_sha256, ruta=ruta, tamano_bytes=tamano,
+            referencias=cantidad, fecha_creacion=datetime.now()
+        )
+        return connection.execute(sentencia.on_conflict_do_update(
+            index_elements=[tabla.c.hash_sha256],
+            set_={"referencias": tabla.c.referencias + sentencia.excluded.referencias}
+        ).returning(tabla.c.referencias)).scalar_one()
+
+    condicion = tabla.c.hash_sha256 == hash_sha256
+    if connection.execute(update(tabla).where(condicion).values(referencias=tabla.c.referencias + cantidad)).rowcount == 0:
+        connection.execute(tabla.insert().values(
+            hash_sha256=hash_sha256, ruta=ruta, tamano_bytes=tamano,
+            referencias=cantidad, fecha_creacion=datetime.now()
+        ))
+    return connection.execute(select(tabla.c.referencias).where(condicion)).scalar_one()
+
+
+def guardar_blob(db, origen: BinaryIO, nombre: str, maximo: int = MAX_TAMANO_DOCUMENTO) -> tuple:
+    """
+    Guarda la subida en el almacén y suma una referencia (sin commit).
+    Devuelve (clave del blob, sha256, tamaño en bytes).
+    """
+    ruta_temporal, hash_sha256, tamano = _copiar_a_temporal(origen, almacen.directorio_temporal, maximo)
+    try:
+        clave = clave_blob(hash_sha256, nombre)
+        B = models.ArchivoBlob
+        # Lectura sin bloqueo: si el contenido ya tiene referencias, el archivo está guardado
+        previas = db.execute(select(B.referencias).where(B.hash_sha256 == hash_sha256)).scalar()
+        if not previas:
+            # Fila sin referencias confirmada antes de subir: si el handler hace rollback,
+            # `purgar_blobs` la encuentra y borra el archivo en vez de dejarlo huérfano
+            with db.get_bind().begin() as conexion:
+                sumar_referencias(conexion, hash_sha256, clave, tamano, cantidad=0)
+            almacen.subir(clave, ruta_temporal, hash_sha256)  # Sin bloqueo de escritura
+        referencias = sumar_referencias(db.connection(), hash_sha256, clave, tamano)
+        if referencias == 1 and not almacen.existe(clave):
+            # Solo queda esta referencia: una purga pudo borrar la fila y el archivo
+            # entre la lectura (o la subida) y el UPSERT. Ya con la referencia tomada nadie lo borra.
+            almacen.subir(clave, ruta_temporal, hash_sha256)
+    finally:
+        _borrar(ruta_temporal)
+    return clave, hash_sha256, tamano
+
+
+def quitar_referencia(db, hash_sha256: Optional[str]):
+    """Resta la referencia de un documento que se elimina (sin commit; el archivo lo borra `purgar_blobs`)"""
+    if not hash_sha256:
+        return
+    B = models.ArchivoBlob
+    db.execute(update(B).where(B.hash_sha256 == hash_sha256).values(referencias=B.referencias - 1))
+
+
+def purgar_blobs(db) -> int:
+    """
+    Borra (fila y archivo) los blobs sin referencias, uno por transacción. Se
+    llama después del commit que quitó las referencias. El DELETE vuelve a
+    comprobar `referencias <= 0` con el bloqueo tomado, y el archivo se borra
+    antes de confirmar: una subida del mismo contenido que suma su referencia
+    antes gana (no se borra nada), y una que la suma después ve una fila nueva
+    y vuelve a subir el archivo.
+    """
+    B = models.ArchivoBlob
+    candidatos = db.execute(select(B.hash_sha256).where(B.referencias <= 0)).scalars().all()
+    borrados = 0
+    for hash_sha256 in candidatos:
+        fila = db.execute(
+            delete(B).where(B.hash_sha256 == hash_sha256, B.referencias <= 0).returning(B.ruta)
+        ).first()
+        if fila:
+            almacen.borrar(fila.ruta)
+            almacen.borrar(clave_miniatura(hash_sha256))
+            borrados += 1
+        db.commit()
+    if borrados:
+        print(f"🧹 Blobs de documentos sin referencias eliminados: {borrados}")
+    return borrados
+
+
+def contenido_documento(documento: models.Documento) -> Optional[tuple]:
+    """
+    (almacén, clave, tamaño, ETag) para servir el archivo del documento, o None
+    si no está. Los documentos anteriores al almacén se leen de su copia local.
+    """
+    if documento.hash_sha256:
+        return almacen, documento.ruta_archivo, documento.tamano_bytes, f'"{documento.hash_sha256}"'
+    ruta = ruta_local(documento.ruta_archivo)
+    if not ruta.startswith(os.path.normpath(UPLOAD_DIR) + os.sep) or not os.path.isfile(ruta):
+        return None
+    estado = os.stat(ruta)
+    return AlmacenLocal(os.curdir), ruta.replace(os.sep, "/"), estado.st_size, f'W/"{estado.st_size}-{int(estado.st_mtime)}"'
+
+
+def rango_solicitado(cabecera: str, tamano: int) -> Optional[tuple]:
+    """
+    (inicio, fin) de una cabecera Range de un solo rango ("bytes=0-99",
+    "bytes=100-", "bytes=-500"). None si no aplica (varios rangos o formato
+    desconocido: se sirve el archivo completo); ValueError si queda fuera del archivo.
+    """
+    coincidencia = re.fullmatch(r"bytes=(\d*)-(\d*)", cabecera.strip())
+    if not coincidencia or not any(coincidencia.groups()):
+        return None
+    desde, hasta = coincidencia.groups()
+    if desde:
+        inicio = int(desde)
+        fin = min(int(hasta), tamano - 1) if hasta else tamano - 1
+        if hasta and int(hasta) < inicio:
+            return None
+    else:
+        if int(hasta) == 0:
+            raise ValueError("Rango vacío")
+        inicio, fin = max(tamano - int(hasta), 0), tamano - 1
+    if inicio >= tamano:
+        raise ValueError("Rango fuera del archivo")
+    return inicio, fin
+
+
+# ========== MIGRACIÓN DE LOS DOCUMENTOS ANTERIORES ==========
+
+def ruta_local(ruta: str) -> str:
+    """Rutas guardadas antes: con barras de Windows o con '/' inicial (uploads\\prospecto_1\\...)"""
+    return os.path.normpath(ruta.replace("\\", "/").lstrip("/"))
+
+
+def _hash_archivo(ruta: str) -> tuple:
+    sha256 = hashlib.sha256()
+    tamano = 0
+    with open(ruta, "rb") as archivo:
+        for bloque in iter(lambda: archivo.read(TAMANO_BLOQUE), b""):
+            sha256.update(bloque)
+            tamano += len(bloque)
+    return sha256.hexdigest(), tamano
+
+
+def deduplicar_existentes(db, simular: bool = False) -> dict:
+    """
+    Pasa al almacén los archivos de los documentos que aún apuntan a una copia
+    propia y borra las copias repetidas de uploads/ que no usa ningún documento
+    (se conserva la primera de cada contenido). Los archivos originales se borran
+    solo después del commit.
+    """
+    D = models.Documento
+    B = models.ArchivoBlob
+    blobs = {b.hash_sha256: b for b in db.query(B)}
+    directorio_blobs = os.path.join(os.path.normpath(UPLOAD_DIR), "blobs")
+    resumen = {"documentos": 0, "sin_archivo": 0, "blobs_nuevos": 0, "copias_borradas": 0, "bytes_liberados": 0}
+    por_borrar = set()
+    referencias = {}
+
+    # Documentos que todavía apuntan a una copia propia (fuera del almacén)
+    pendientes = D.ruta_archivo.notlike(PREFIJO_BLOBS + "%")
+    documentos = db.query(D).filter(pendientes).order_by(D.id).all()
+    for documento in documentos:
+        ruta_origen = ruta_local(documento.ruta_archivo)
+        if not os.path.isfile(ruta_origen):
+            resumen["sin_archivo"] += 1
+            continue
+        hash_sha256, tamano = _hash_archivo(ruta_origen)
+        clave = blobs[hash_sha256].ruta if hash_sha256 in blobs else clave_blob(hash_sha256, documento.nombre_archivo or ruta_origen)
+        if hash_sha256 not in blobs and hash_sha256 not in referencias:
+            resumen["blobs_nuevos"] += 1
+            if not simular and not almacen.existe(clave):
+                # El original se borra solo tras el commit
+                almacen.subir(clave, ruta_origen, hash_sha256)
+        referencias.setdefault(hash_sha256, [clave, tamano, 0])[2] += 1
+        if not simular:
+            documento.ruta_archivo = clave
+            documento.hash_sha256 = hash_sha256
+            documento.tamano_bytes = tamano
+        por_borrar.add(ruta_origen)
+        resumen["documentos"] += 1
+
+    # Copias sueltas en uploads/ que ningún documento usa: se deja una por contenido
+    rutas_en_uso = {ruta_local(r) for (r,) in db.query(D.ruta_archivo)} - por_borrar
+    vistos = set(blobs) | set(referencias)
+    for carpeta, subcarpetas, archivos in os.walk(UPLOAD_DIR):
+        if os.path.normpath(carpeta) == directorio_blobs:
+            subcarpetas.clear()
+            continue
+        for nombre in sorted(archivos):
+            ruta_origen = os.path.normpath(os.path.join(carpeta, nombre))
+            if ruta_origen in rutas_en_uso or ruta_origen in por_borrar or nombre.endswith(".part"):
+                continue
+            hash_sha256, _ = _hash_archivo(ruta_origen)
+            if hash_sha256 in vistos:
+                por_borrar.add(ruta_origen)
+            else:
+                vistos.add(hash_sha256)
+
+    bytes_liberados = sum(os.path.getsize(r) for r in por_borrar)
+    resumen["copias_borradas"] = len(por_borrar)
+    if isinstance(almacen, AlmacenLocal):
+        # En disco local lo que pasa al almacén sigue ocupando una vez por contenido
+        bytes_liberados -= sum(t for h, (_, t, _) in referencias.items() if h not in blobs)
+    resumen["bytes_liberados"] = bytes_liberados
+    if simular:
+        db.rollback()
+        return resumen
+
+    for hash_sha256, (clave, tamano, cantidad) in referencias.items():
+        sumar_referencias(db.connection(), hash_sha256, clave, tamano, cantidad)
+    db.commit()
+    for ruta_origen in por_borrar:
+        _borrar(ruta_origen)
+    return resumen
+
+
+if __name__ == "__main__":
+    import database
+
+    parser = argparse.ArgumentParser(description="Pasa los documentos subidos al almacén por contenido (sin copias repetidas)")
+    parser.add_argument("--simular", action="store_true", help="Solo mostrar lo que se haría")
+    opciones = parser.parse_args()
+
+    database.check_and_migrate()
+    db = database.SessionLocal()
+    try:
+        resumen = deduplicar_existentes(db, opciones.simular)
+        print(f"{'🔎 Simulación' if opciones.simular else '✅ Deduplicación'}: {resumen['documentos']} documentos al almacén "
+              f"({resumen['blobs_nuevos']} contenidos distintos), {resumen['sin_archivo']} sin archivo en disco, "
+              f"{resumen['copias_borradas']} copias borradas, {resumen['bytes_liberados'] / 1024 / 1024:.1f} MB liberados")
+    finally:
+        db.close()
@@ -0,0 +1,445 @@
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from typing import Iterable, List, Optional
+from sqlalchemy import func, case, literal, select, insert, delete, union_all, event, inspect, text
+from sqlalchemy.orm import Session, attributes
+from sqlalchemy.orm.base import PASSIVE_NO_INITIALIZE
+import models
+from models import TipoUsuario, EstadoProspecto
+
+# Clave en session.info donde se acumulan los días a recalcular antes del commit
+CLAVE_DIAS_RESUMEN = "resumen_diario_dias"
+# Días recalculados en el commit en curso (para avisar a los dashboards abiertos)
+CLAVE_DIAS_ACTUALIZADOS = "resumen_diario_actualizados"
+
+# Espacio de los advisory locks por día del resumen en PostgreSQL (clave = (espacio, día))
+ESPACIO_BLOQUEO_RESUMEN = 2002
+
+# Estados que se cuentan desde el historial de cambios (no desde el estado actual)
+ESTADOS_HISTORIAL = [
+    EstadoProspecto.EN_SEGUIMIENTO.value,
+    EstadoProspecto.GANADO.value,
+    EstadoProspecto.CERRADO_PERDIDO.value
+]
+
+@dataclass
+class DestinoPopular:
+    destino: str
+    count: int
+
+@dataclass
+class ConversionAgente:
+    id: int
+    username: str
+    total_prospectos: int = 0
+    cotizados: int = 0
+    ganados: int = 0
+
+@dataclass
+class EstadisticasDashboard:
+    """Resultado tipado con todos los contadores del dashboard"""
+    total_prospectos: int = 0
+    prospectos_con_datos: int = 0
+    prospectos_sin_datos: int = 0
+    clientes_sin_asignar: int = 0
+    clientes_asignados: int = 0
+    destinos_count: int = 0
+    ventas_count: int = 0
+    prospectos_nuevos: int = 0
+    prospectos_seguimiento: int = 0
+    prospectos_cotizados: int = 0
+    prospectos_ganados: int = 0
+    prospectos_perdidos: int = 0
+    destinos_populares: List[DestinoPopular] = field(default_factory=list)
+    conversion_agentes: List[ConversionAgente] = field(default_factory=list)
+
+    def como_contexto(self) -> dict:
+        """Devuelve los contadores con los nombres que espera dashboard.html"""
+        return {
+            "total_prospectos": self.total_prospectos,
+            "prospectos_con_datos": self.prospectos_con_datos,
+            "prospectos_sin_datos": self.prospectos_sin_datos,
+            "clientes_sin_asignar": self.clientes_sin_asignar,
+            "clientes_asignados": self.clientes_asignados,
+            "destinos_count": self.destinos_count,
+            "ventas_count": self.ventas_count,
+            "prospectos_nuevos": self.prospectos_nuevos,
+            "prospectos_seguimiento": self.prospectos_seguimiento,
+            "prospectos_cotizados": self.prospectos_cotizados,
+            "prospectos_ganados": self.prospectos_ganados,
+            "prospectos_perdidos": self.prospectos_perdidos,
+            "destinos_populares": self.destinos_populares,
+            "conversion_agentes": self.conversion_agentes
+        }
+
+def _contar_si(condicion):
+    """SUM(CASE WHEN condicion THEN 1 ELSE 0 END)"""
+    return func.coalesce(func.sum(case((condicion, 1), else_=0)), 0)
+
+# ========== RESUMEN DIARIO MATERIALIZADO ==========
+
+def _select_registros(inicio: Optional[datetime], fin: Optional[datetime]):
+    """Prospectos registrados agrupados por día, agente, estado, medio y destino"""
+    P = models.Prospecto
+    fecha = func.date(P.fecha_registro)
+    query = select(
+        fecha.label('fecha'),
+        P.agente_asignado_id.label('agente_id'),
+        P.estado.label('estado'),
+        P.medio_ingreso_id.label('medio_ingreso_id'),
+        P.destino.label('destino'),
+        func.count(P.id).label('registrados'),
+        _contar_si(P.tiene_datos_completos == True).label('con_datos'),
+        _contar_si(P.tiene_datos_completos == False).label('sin_datos'),
+        literal(0).label('cambios_estado'),
+        literal(0).label('cotizaciones')
+    ).where(P.fecha_registro.isnot(None))
+    if inicio is not None:
+        query = query.where(P.fecha_registro >= inicio, P.fecha_registro <= fin)
+    return query.group_by(fecha, P.agente_asignado_id, P.estado, P.medio_ingreso_id, P.destino)
+
+def _select_cambios_estado(inicio: Optional[datetime], fin: Optional[datetime]):
+    """Cambios de estado agrupados por día, usuario, estado nuevo, medio y destino"""
+    P, H = models.Prospecto, models.HistorialEstado
+    fecha = func.date(H.fecha_cambio)
+    query = select(
+        fecha.label('fecha'),
+        H.usuario_id.label('agente_id'),
+        H.estado_nuevo.label('estado'),
+        P.medio_ingreso_id.label('medio_ingreso_id'),
+        P.destino.label('destino'),
+        literal(0).label('registrados'),
+        literal(0).label('con_datos'),
+        literal(0).label('sin_datos'),
+        func.count(H.id).label('cambios_estado'),
+        literal(0).label('cotizaciones')
+    ).select_from(H).outerjoin(P, P.id == H.prospecto_id).where(H.fecha_cambio.isnot(None))
+    if inicio is not None:
+        query = query.where(H.fecha_cambio >= inicio, H.fecha_cambio <= fin)
+    return query.group_by(fecha, H.usuario_id, H.estado_nuevo, P.medio_ingreso_id, P.destino)
+
+def _select_cotizaciones(inicio: Optional[date], fin: Optional[date]):
+    """Cotizaciones agrupadas por día, agente, medio y destino"""
+    P, E = models.Prospecto, models.EstadisticaCotizacion
+    fecha = func.date(E.fecha_cotizacion)
+    query = select(
+        fecha.label('fecha'),
+        E.agente_id.label('agente_id'),
+        literal(EstadoProspecto.COTIZADO.value).label('estado'),
+        P.medio_ingreso_id.label('medio_ingreso_id'),
+        P.destino.label('destino'),
+        literal(0).label('registrados'),
+        literal(0).label('con_datos'),
+        literal(0).label('sin_datos'),
+        literal(0).label('cambios_estado'),
+        func.count(E.id).label('cotizaciones')
+    ).select_from(E).outerjoin(P, P.id == E.prospecto_id)
+    if inicio is not None:
+        query = query.where(E.fecha_cotizacion >= inicio, E.fecha_cotizacion <= fin)
+    return query.group_by(fecha, E.agente_id, P.medio_ingreso_id, P.destino)
+
+def _insertar_resumen(db: Session, inicio: Optional[date] = None, fin: Optional[date] = None):
+    """INSERT ... SELECT del resumen para el rango [inicio, fin] (o todo el historial)"""
+    inicio_dt = datetime.combine(inicio, datetime.min.time()) if inicio else None
+    fin_dt = datetime.combine(fin, datetime.max.time()) if fin else None
+    fuentes = union_all(
+        _select_registros(inicio_dt, fin_dt),
+        _select_cambios_estado(inicio_dt, fin_dt),
+        _select_cotizaciones(inicio, fin)
+    )
+    columnas = ['fecha', 'agente_id', 'estado', 'medio_ingreso_id', 'destino',
+                'registrados', 'con_datos', 'sin_datos', 'cambios_estado', 'cotizaciones']
+    db.execute(insert(models.ResumenDiario).from_select(columnas, fuentes))
+
+def _bloquear_dias(db: Session, dias: List[date]):
+    """Serializa el recálculo por día entre transacciones concurrentes (PostgreSQL)
+
+    Sin el bloqueo, dos transacciones que recalculan el mismo día no ven las filas
+    sin confirmar de la otra: el DELETE de cada una no borra las de la otra y el
+    día queda duplicado. En SQLite el bloqueo de escritura ya serializa.
+    Los días van ordenados para que dos transacciones no se bloqueen en cruz.
+    """
+    if db.get_bind().dialect.name != "postgresql":
+        return
+    for dia in dias:
+        db.execute(
+            text("SELECT pg_advisory_xact_lock(:espacio, :dia)"),
+            {"espacio": ESPACIO_BLOQUEO_RESUMEN, "dia": dia.toordinal()}
+        )
+
+def actualizar_resumen_diario(db: Session, dias: Iterable[date]):
+    """Recalcula (borra e inserta) las filas del resumen de los días indicados"""
+    dias = sorted(set(dias))
+    if not dias:
+        return
+    _bloquear_dias(db, dias)  # ✅ Hasta el commit: el INSERT ... SELECT ya ve lo confirmado por otras
+    db.execute(delete(models.ResumenDiario).where(models.ResumenDiario.fecha.in_(dias)))
+    for dia in dias:
+        _insertar_resumen(db, dia, dia)
+
+def reconstruir_resumen_diario(db: Session):
+    """Reconstruye el resumen completo desde las tablas originales"""
+    if db.get_bind().dialect.name == "postgresql":
+        # Espera a los recálculos por día en curso y bloquea los nuevos hasta el commit
+        db.execute(text("LOCK TABLE resumen_diario IN EXCLUSIVE MODE"))
+    db.execute(delete(models.ResumenDiario))
+    _insertar_resumen(db)
+    db.commit()
+    print("✅ Resumen diario reconstruido")
+
+def inicializar_resumen_diario(db: Session):
+    """Construye el resumen si está vacío y ya existen prospectos (bases de datos existentes)"""
+    if db.query(models.ResumenDiario.id).first() is None and db.query(models.Prospecto.id).first() is not None:
+        print("🔄 Construyendo resumen diario de estadísticas...")
+        reconstruir_resumen_diario(db)
+
+def marcar_dias_resumen(db: Session, dias: Iterable[date]):
+    """Marca días para recalcular en el próximo commit (p. ej. tras inserciones masivas sin ORM)"""
+    db.info.setdefault(CLAVE_DIAS_RESUMEN, set()).update(dias)
+
+def _a_dia(valor) -> Optional[date]:
+    if isinstance(valor, datetime):
+        return valor.date()
+    if isinstance(valor, date):
+        return valor
+    return None
+
+def _dias_atributo(obj, atributo: str) -> set:
+    """Días del valor actual y del valor anterior (si cambió) de un atributo fecha"""
+    historial = attributes.get_history(obj, atributo, passive=PASSIVE_NO_INITIALIZE)
+    valores = list(historial.added or []) + list(historial.unchanged or []) + list(historial.deleted or [])
+    return {d for d in (_a_dia(v) for v in valores) if d}
+
+# Fecha que decide el día del resumen de cada modelo
+FECHAS_RESUMEN = {
+    models.Prospecto: 'fecha_registro',
+    models.HistorialEstado: 'fecha_cambio',
+    models.EstadisticaCotizacion: 'fecha_cotizacion',
+}
+
+def _cargar_fechas(session, flush_context, instances):
+    """Carga la fecha de los objetos expirados que se editan o eliminan (su día también cambia)"""
+    for obj in list(session.dirty) + list(session.deleted):
+        atributo = FECHAS_RESUMEN.get(type(obj))
+        if atributo and atributo in inspect(obj).unloaded:
+            getattr(obj, atributo)
+
+def _registrar_dias_afectados(session, flush_context):
+    """Acumula los días del resumen afectados por los objetos escritos en el flush"""
+    dias = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        atributo = FECHAS_RESUMEN.get(type(obj))
+        if not atributo:
+            continue
+        dias |= _dias_atributo(obj, atributo)
+        # Si cambia el destino o el medio, también cambian las filas de historial/cotizaciones
+        if isinstance(obj, models.Prospecto) and obj.id and any(
+            attributes.get_history(obj, attr, passive=PASSIVE_NO_INITIALIZE).deleted
+            for attr in ('destino', 'medio_ingreso_id')
+        ):
+            H, E = models.HistorialEstado, models.EstadisticaCotizacion
+            dias |= {_a_dia(f) for (f,) in session.query(H.fecha_cambio).filter(H.prospecto_id == obj.id)}
+            dias |= {f for (f,) in session.query(E.fecha_cotizacion).filter(E.prospecto_id == obj.id)}
+    dias.discard(None)
+    if dias:
+        marcar_dias_resumen(session, dias)
+
+def _actualizar_resumen_antes_de_commit(session):
+    """Actualiza el resumen de los días afectados dentro de la misma transacción"""
+    session.flush()
+    dias = session.info.pop(CLAVE_DIAS_RESUMEN, None)
+    if dias:
+        actualizar_resumen_diario(session, dias)
+        session.info.setdefault(CLAVE_DIAS_ACTUALIZADOS, set()).update(dias)
+
+def _descartar_dias_afectados(session):
+    session.info.pop(CLAVE_DIAS_RESUMEN, None)
+    session.info.pop(CLAVE_DIAS_ACTUALIZADOS, None)
+
+def _conservar_valor_anterior(objetivo, valor, anterior, iniciador):
+    """Sin efecto: registrarlo con active_history hace que el historial tenga el valor anterior"""
+
+def registrar_listeners(fabrica_sesiones):
+    """
+    Mantiene el resumen diario en cada commit de las sesiones de `fabrica_sesiones`
+    (lo llama database.py con SessionLocal).
+    """
+    # active_history: al asignar un atributo expirado se carga su valor anterior,
+    # así el día (o las filas de destino/medio) que se deja también se recalcula
+    atributos = list(FECHAS_RESUMEN.items()) + [(models.Prospecto, 'destino'), (models.Prospecto, 'medio_ingreso_id')]
+    for modelo, nombre in atributos:
+        event.listen(getattr(modelo, nombre), "set", _conservar_valor_anterior, active_history=True)
+    event.listen(fabrica_sesiones, "before_flush", _cargar_fechas)
+    event.listen(fabrica_sesiones, "after_flush", _registrar_dias_afectados)
+    event.listen(fabrica_sesiones, "before_commit", _actualizar_resumen_antes_de_commit)
+    event.listen(fabrica_sesiones, "after_rollback", _descartar_dias_afectados)
+
+# ========== CONSULTAS SOBRE EL RESUMEN ==========
+
+def calcular_estadisticas_dashboard(
+    db: Session,
+    fecha_inicio: date,
+    fecha_fin: date,
+    agente_id: Optional[int] = None
+) -> EstadisticasDashboard:
+    """
+    Calcula todos los contadores del dashboard con una única consulta agrupada sobre
+    el resumen diario (≈ días × agentes filas). Si se indica agente_id se calculan solo
+    sus estadísticas (vista de agente); en caso contrario las generales y la conversión por agente.
+    """
+    es_agente = agente_id is not None
+    stats = EstadisticasDashboard()
+
+    R = models.ResumenDiario
+    query = db.query(
+        R.agente_id,
+        R.estado,
+        R.destino,
+        func.sum(R.registrados).label('registrados'),
+        func.sum(R.con_datos).label('con_datos'),
+        func.sum(R.sin_datos).label('sin_datos'),
+        func.sum(R.cambios_estado).label('cambios_estado'),
+        func.sum(R.cotizaciones).label('cotizaciones')
+    ).filter(
+        R.fecha >= fecha_inicio,
+        R.fecha <= fecha_fin
+    )
+    if es_agente:
+        query = query.filter(R.agente_id == agente_id)
+    filas = query.group_by(R.agente_id, R.estado, R.destino).all()
+
+    total_por_agente = {}
+    ganados_por_agente = {}
+    cotizados_por_agente = {}
+    conteo_destinos = {}
+    ganados_estado_actual = 0
+    for fila in filas:
+        registrados = fila.registrados or 0
+        cambios = fila.cambios_estado or 0
+        cotizaciones = fila.cotizaciones or 0
+
+        # ✅ Prospectos registrados en el periodo (estado actual)
+        stats.total_prospectos += registrados
+        stats.prospectos_con_datos += fila.con_datos or 0
+        stats.prospectos_sin_datos += fila.sin_datos or 0
+        if fila.estado == EstadoProspecto.NUEVO.value:
+            stats.prospectos_nuevos += registrados
+            if fila.agente_id is None:
+                stats.clientes_sin_asignar += registrados
+        if fila.estado == EstadoProspecto.GANADO.value:
+            ganados_estado_actual += registrados
+        if fila.agente_id is not None:
+            stats.clientes_asignados += registrados
+            total_por_agente[fila.agente_id] = total_por_agente.get(fila.agente_id, 0) + registrados
+        if fila.destino and registrados:
+            conteo_destinos[fila.destino] = conteo_destinos.get(fila.destino, 0) + registrados
+
+        # ✅ Cambios de estado en el periodo (historial)
+        if fila.estado == EstadoProspecto.EN_SEGUIMIENTO.value:
+            stats.prospectos_seguimiento += cambios
+        elif fila.estado == EstadoProspecto.GANADO.value:
+            stats.prospectos_ganados += cambios
+            ganados_por_agente[fila.agente_id] = ganados_por_agente.get(fila.agente_id, 0) + cambios
+        elif fila.estado == EstadoProspecto.CERRADO_PERDIDO.value:
+            stats.prospectos_perdidos += cambios
+
+        # ✅ Cotizaciones en el periodo
+        stats.prospectos_cotizados += cotizaciones
+        cotizados_por_agente[fila.agente_id] = cotizados_por_agente.get(fila.agente_id, 0) + cotizaciones
+
+    stats.destinos_count = len(conteo_destinos)
+    stats.destinos_populares = [
+        DestinoPopular(destino=d, count=c)
+        for d, c in sorted(conteo_destinos.items(), key=lambda x: (-x[1], x[0]))[:5]
+    ]
+
+    if es_agente:
+        # Ventas del agente basadas en el historial de cambios
+        stats.ventas_count = stats.prospectos_ganados
+        stats.clientes_sin_asignar = 0
+        return stats
+
+    # Ventas generales basadas en el estado actual de los prospectos del periodo
+    stats.ventas_count = ganados_estado_actual
+
+    # ✅ CONVERSIÓN POR AGENTE (sin consultas adicionales por agente)
+    agentes = db.query(models.Usuario.id, models.Usuario.username).filter(
+        models.Usuario.tipo_usuario == TipoUsuario.AGENTE.value
+    ).all()
+    stats.conversion_agentes = [
+        ConversionAgente(
+            id=agente.id,
+            username=agente.username,
+            total_prospectos=total_por_agente.get(agente.id, 0),
+            cotizados=cotizados_por_agente.get(agente.id, 0),
+            ganados=ganados_por_agente.get(agente.id, 0)
+        )
+        for agente in agentes
+    ]
+    return stats
+
+def resumen_cotizaciones_por_agente(
+    db: Session,
+    fecha_inicio: date,
+    fecha_fin: date,
+    agente_id: Optional[int] = None
+):
+    """Total de cotizaciones por agente en el periodo, leído del resumen diario"""
+    R = models.ResumenDiario
+    query = db.query(
+        models.Usuario.id,
+        models.Usuario.username,
+        func.sum(R.cotizaciones).label('total')
+    ).join(
+        R, R.agente_id == models.Usuario.id
+    ).filter(
+        R.fecha >= fecha_inicio,
+        R.fecha <= fecha_fin,
+        R.cotizaciones > 0
+    )
+    if agente_id is not None:
+        query = query.filter(R.agente_id == agente_id)
+    return query.group_by(models.Usuario.id, models.Usuario.username).all()
+
+def contar_filtro_dashboard(
+    db: Session,
+    fecha_inicio: date,
+    fecha_fin: date,
+    tipo_filtro: str,
+    valor_filtro: str,
+    agente_id: Optional[int] = None
+) -> Optional[int]:
+    """
+    Cuenta los registros de un filtro del dashboard usando el resumen diario.
+    Devuelve None si el filtro no se puede resolver con el resumen (p. ej. destino parcial).
+    """
+    R = models.ResumenDiario
+    query = db.query(R).filter(R.fecha >= fecha_inicio, R.fecha <= fecha_fin)
+    if agente_id is not None:
+        query = query.filter(R.agente_id == agente_id)
+
+    if tipo_filtro == "estado" and (valor_filtro == EstadoProspecto.COTIZADO.value or valor_filtro in ESTADOS_HISTORIAL):
+        # El listado combina la fecha del evento con el estado actual: no está en el resumen
+        return None
+    elif tipo_filtro == "ventas":
+        columna = R.cambios_estado
+        query = query.filter(R.estado == EstadoProspecto.GANADO.value)
+    elif tipo_filtro == "estado":
+        columna = R.registrados
+        query = query.filter(R.estado == valor_filtro)
+    elif tipo_filtro == "asignacion" and valor_filtro == "sin_asignar":
+        columna = R.registrados
+        query = query.filter(R.agente_id == None)
+    elif tipo_filtro == "asignacion" and valor_filtro == "asignados":
+        columna = R.registrados
+        query = query.filter(R.agente_id != None)
+    elif tipo_filtro == "datos" and valor_filtro == "con_datos":
+        columna = R.con_datos
+    elif tipo_filtro == "datos" and valor_filtro == "sin_datos":
+        columna = R.sin_datos
+    elif tipo_filtro == "total":
+        columna = R.registrados
+    else:
+        return None
+
+    return query.with_entities(func.coalesce(func.sum(columna), 0)).scalar()
@@ -0,0 +1,181 @@
+"""
+Eventos en vivo (pub/sub) para las páginas abiertas.
+
+Los listeners de sesión y algunos handlers publican eventos (notificaciones
+nuevas, asignaciones, días del dashboard que cambiaron) y el endpoint
+/eventos los reenvía por Server-Sent Events a cada usuario conectado, así las
+páginas no tienen que recargarse para enterarse.
+
+EVENTOS_BACKEND elige el bus:
+- "memoria" (por defecto): dentro del proceso; suficiente con un solo worker.
+- "redis": se publican en un canal de Redis (EVENTOS_REDIS_URL) y cada worker
+  los reparte a sus conexiones. Sirve también el servidor de `redis_resp.py`.
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from dataclasses import asdict, dataclass
+from typing import Iterable, List, Optional
+
+from sqlalchemy import event
+
+import database
+import estadisticas
+import models
+from redis_resp import ClienteResp
+
+CANAL_REDIS = "prospectos:eventos"
+MAX_EVENTOS_EN_COLA = 100  # Por conexión; si el cliente no lee, se descartan los más nuevos
+
+# Clave en session.info donde se acumulan las notificaciones creadas hasta el commit
+CLAVE_NOTIFICACIONES = "eventos_notificaciones"
+
+
+@dataclass
+class Evento:
+    tipo: str
+    datos: dict
+    usuarios: Optional[List[int]] = None  # Destinatarios por id
+    roles: Optional[List[str]] = None  # O por tipo de usuario (sin ninguno de los dos: todos)
+
+    def es_para(self, usuario_id: int, tipo_usuario: str) -> bool:
+        if self.usuarios is None and self.roles is None:
+            return True
+        return usuario_id in (self.usuarios or []) or tipo_usuario in (self.roles or [])
+
+
+class Suscripcion:
+    """Cola de eventos de una conexión, atada al event loop que la creó"""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.cola = asyncio.Queue(MAX_EVENTOS_EN_COLA)
+
+    def _entregar(self, evento: Evento):
+        try:
+            self.cola.put_nowait(evento)
+        except asyncio.QueueFull:
+            pass
+
+
+class BusMemoria:
+    """Bus dentro del proceso: publicar es seguro desde cualquier hilo"""
+
+    def __init__(self):
+        self._suscripciones = set()
+        self._lock = threading.Lock()
+
+    def suscribir(self) -> Suscripcion:
+        suscripcion = Suscripcion(asyncio.get_running_loop())
+        with self._lock:
+            self._suscripciones.add(suscripcion)
+        return suscripcion
+
+    def cancelar(self, suscripcion: Suscripcion):
+        with self._lock:
+            self._suscripciones.discard(suscripcion)
+
+    def contar(self) -> int:
+        with self._lock:
+            return len(self._suscripciones)
+
+    def entregar_local(self, evento: Evento):
+        with self._lock:
+            suscripciones = list(self._suscripciones)
+        for suscripcion in suscripciones:
+            try:
+                suscripcion.loop.call_soon_threadsafe(suscripcion._entregar, evento)
+            except RuntimeError:
+                # El event loop ya se cerró (apagado del servidor)
+                self.cancelar(suscripcion)
+
+    def publicar(self, evento: Evento):
+        self.entregar_local(evento)
+
+
+class BusRedis(BusMemoria):
+    """Bus compartido entre workers a través de un canal de Redis"""
+
+    def __init__(self, url: str):
+        super().__init__()
+        self.cliente = ClienteResp(url)
+        self._hilo = None
+
+    def suscribir(self) -> Suscripcion:
+        # El hilo que escucha el canal se arranca con la primera conexión del worker
+        if self._hilo is None:
+            self._hilo = threading.Thread(target=self._escuchar, name="eventos-redis", daemon=True)
+            self._hilo.start()
+        return super().suscribir()
+
+    def _escuchar(self):
+        while True:
+            try:
+                for mensaje in self.cliente.escuchar(CANAL_REDIS):
+                    self.entregar_local(Evento(**json.loads(mensaje)))
+            except (ConnectionError, OSError) as e:
+                print(f"⚠️ Canal de eventos Redis caído, reintentando: {e}")
+                time.sleep(1)
+
+    def publicar(self, evento: Evento):
+        try:
+            self.cliente.publish(CANAL_REDIS, json.dumps(asdict(evento)))
+        except (ConnectionError, OSError) as e:
+            # Sin Redis al menos se entregan a las conexiones de este worker
+            print(f"⚠️ No se pudo publicar el evento en Redis: {e}")
+            self.entregar_local(evento)
+
+
+def _crear_bus():
+    if os.getenv("EVENTOS_BACKEND", "memoria").lower() == "redis":
+        return BusRedis(os.getenv("EVENTOS_REDIS_URL", "redis://localhost:6379/0"))
+    return BusMemoria()
+
+
+bus = _crear_bus()
+
+
+def publicar(tipo: str, datos: dict, usuarios: Optional[List[int]] = None, roles: Optional[List[str]] = None):
+    """Publica un evento; sin usuarios ni roles llega a todas las conexiones"""
+    bus.publicar(Evento(tipo, datos, usuarios, roles))
+
+
+def publicar_notificaciones(notificaciones: Iterable[tuple]):
+    """Publica un evento por usuario con sus notificaciones nuevas (usuario_id, tipo, mensaje)"""
+    por_usuario = defaultdict(list)
+    for usuario_id, tipo, mensaje in notificaciones:
+        if usuario_id:
+            por_usuario[usuario_id].append((tipo, mensaje))
+    for usuario_id, nuevas in por_usuario.items():
+        tipo, mensaje = nuevas[-1]
+        publicar("notificaciones", {"nuevas": len(nuevas), "tipo": tipo, "mensaje": mensaje}, usuarios=[usuario_id])
+
+
+# ========== PUBLICACIÓN AL CONFIRMAR TRANSACCIONES ==========
+
+@event.listens_for(database.SessionLocal, "after_flush")
+def _registrar_notificaciones(session, flush_context):
+    nuevas = [
+        (obj.usuario_id, obj.tipo, obj.mensaje)
+        for obj in session.new if isinstance(obj, models.Notificacion)
+    ]
+    if nuevas:
+        session.info.setdefault(CLAVE_NOTIFICACIONES, []).extend(nuevas)
+
+
+@event.listens_for(database.SessionLocal, "after_commit")
+def _publicar_al_confirmar(session):
+    notificaciones = session.info.pop(CLAVE_NOTIFICACIONES, None)
+    if notificaciones:
+        publicar_notificaciones(notificaciones)
+    dias = session.info.pop(estadisticas.CLAVE_DIAS_ACTUALIZADOS, None)
+    if dias:
+        publicar("dashboard", {"dias": sorted(d.isoformat() for d in dias)})
+
+
+@event.listens_for(database.SessionLocal, "after_rollback")
+def _descartar_eventos(session):
+    session.info.pop(CLAVE_NOTIFICACIONES, None)
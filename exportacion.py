@@ -0,0 +1,101 @@
+"""
+Exportación de prospectos a Excel/CSV por streaming.
+
+Las filas se leen con una consulta de solo las columnas necesarias, en bloques
+(yield_per), y se escriben a medida que llegan: el CSV se envía al cliente
+bloque a bloque y el Excel se arma con un libro de solo escritura en un
+archivo temporal. La memoria usada no depende del número de prospectos.
+"""
+import csv
+import io
+import tempfile
+from typing import Iterator, Optional
+
+from openpyxl import Workbook
+from sqlalchemy import select
+
+import database
+import models
+
+TAMANO_LOTE = 1000  # Filas leídas de la base de datos por bloque
+TAMANO_BLOQUE = 64 * 1024  # Bytes enviados al cliente por bloque
+
+ENCABEZADOS = [
+    "ID", "Nombre", "Email", "Teléfono", "Destino", "Estado",
+    "Agente", "Fecha Registro", "Medio Ingreso"
+]
+
+
+def _consulta_exportacion(agente_id: Optional[int] = None):
+    """Consulta proyectada con los datos de la exportación (sin cargar objetos ORM)"""
+    consulta = (
+        select(
+            models.Prospecto.id,
+            models.Prospecto.nombre,
+            models.Prospecto.apellido,
+            models.Prospecto.correo_electronico,
+            models.Prospecto.telefono,
+            models.Prospecto.destino,
+            models.Prospecto.estado,
+            models.Usuario.username,
+            models.Prospecto.fecha_registro,
+            models.MedioIngreso.nombre.label("medio_ingreso"),
+        )
+        .outerjoin(models.Usuario, models.Usuario.id == models.Prospecto.agente_asignado_id)
+        .outerjoin(models.MedioIngreso, models.MedioIngreso.id == models.Prospecto.medio_ingreso_id)
+        .order_by(models.Prospecto.id)
+        .execution_options(yield_per=TAMANO_LOTE)
+    )
+    if agente_id is not None:
+        consulta = consulta.where(models.Prospecto.agente_asignado_id == agente_id)
+    return consulta
+
+
+def filas_exportacion(agente_id: Optional[int] = None) -> Iterator[list]:
+    """Recorre los prospectos a exportar ya formateados, con una sesión propia"""
+    db = database.SessionLocal()
+    try:
+        for fila in db.execute(_consulta_exportacion(agente_id)):
+            yield [
+                fila.id,
+                f"{fila.nombre or ''} {fila.apellido or ''}",
+                fila.correo_electronico or '',
+                fila.telefono or '',
+                fila.destino or '',
+                fila.estado,
+                fila.username or 'Sin asignar',
+                fila.fecha_registro.strftime('%d/%m/%Y') if fila.fecha_registro else '',
+                fila.medio_ingreso or '',
+            ]
+    finally:
+        db.close()
+
+
+def generar_csv(agente_id: Optional[int] = None) -> Iterator[bytes]:
+    """Genera el CSV por bloques (UTF-8 con BOM para que Excel respete los acentos)"""
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    buffer.write("\ufeff")
+    escritor.writerow(ENCABEZADOS)
+    for fila in filas_exportacion(agente_id):
+        escritor.writerow(fila)
+        if buffer.tell() >= TAMANO_BLOQUE:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode("utf-8")
+
+
+def generar_excel(agente_id: Optional[int] = None) -> Iterator[bytes]:
+    """Genera el Excel con un libro de solo escritura y lo envía por bloques"""
+    with tempfile.TemporaryFile() as archivo:
+        libro = Workbook(write_only=True)
+        hoja = libro.create_sheet("Prospectos")
+        hoja.append(ENCABEZADOS)
+        for fila in filas_exportacion(agente_id):
+            hoja.append(fila)
+        libro.save(archivo)
+
+        archivo.seek(0)
+        for bloque in iter(lambda: archivo.read(TAMANO_BLOQUE), b""):
+            yield bloque
@@ -2,17 +2,13 @@
 import sys
 import os
 from datetime import datetime, timedelta
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
 import models
 
 # Configurar path
 sys.path.append(os.getcwd())
 
-# DB Setup
-SQLALCHEMY_DATABASE_URL = "sqlite:///./prospectos.db"
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
-SessionLocal = sessionmaker(bind=engine)
+# DB Setup (misma URL que la aplicación, ver DATABASE_URL)
+from database import SessionLocal
 db = SessionLocal()
 
 # Obtener último prospecto
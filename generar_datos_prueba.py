@@ -266,14 +266,8 @@ def crear_datos_prueba():
         db.commit()
         print(f"✅ {len(prospectos)} prospectos creados exitosamente")
         
-        # Ahora necesitamos actualizar los IDs de cliente
-        print("🆔 Generando IDs de cliente únicos...")
+        # Los IDs de cliente (CL-...) se asignan en el propio INSERT
         todos_prospectos = db.query(Prospecto).all()
-        for prospecto in todos_prospectos:
-            if not prospecto.id_cliente:
-                prospecto.generar_id_cliente()
-        db.commit()
-        print("✅ IDs de cliente generados")
         
         # ✅ CREAR INTERACCIONES REALISTAS
         print("💬 Generando interacciones...")
@@ -337,13 +331,7 @@ def crear_datos_prueba():
                         )
                         db.add(estadistica)
             
-            db.commit()
-            
-            # Generar IDs de cotización
-            estadisticas = db.query(EstadisticaCotizacion).filter(EstadisticaCotizacion.id_cotizacion == None).all()
-            for estadistica in estadisticas:
-                estadistica.generar_id_cotizacion()
-            db.commit()
+            db.commit()  # Los IDs de cotización (COT-...) se asignan en el propio INSERT
             
             print(f"✅ {len(prospectos_cotizados)} estadísticas de cotizaciones generadas")
         
@@ -375,13 +363,7 @@ def crear_datos_prueba():
                     )
                     db.add(documento)
             
-            db.commit()
-            
-            # Generar IDs de documento
-            documentos = db.query(Documento).filter(Documento.id_documento == None).all()
-            for documento in documentos:
-                documento.generar_id_documento()
-            db.commit()
+            db.commit()  # Los IDs de documento (DOC-...) se asignan en el propio INSERT
             
             print(f"✅ {min(50, len(prospectos_con_documentos))} documentos generados")
         
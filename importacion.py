@@ -0,0 +1,450 @@
+"""
+Importación masiva de prospectos desde CSV/XLSX.
+
+El archivo se procesa por bloques con pandas: las validaciones (teléfono,
+indicativos, fechas, pasajeros, medio y agente) son operaciones vectorizadas
+sobre columnas, los clientes recurrentes se resuelven con una sola consulta
+por bloque sobre los teléfonos normalizados (indexados) y un merge, y las
+filas válidas se insertan con INSERT masivos. Cada fila del archivo queda en
+el reporte como creada, recurrente o con sus errores.
+
+Uso por consola:
+
+    python importacion.py leads.xlsx --medio REDES --usuario admin
+    python importacion.py leads.csv --medio "TEL TRAVEL" --usuario admin --agente maria_garcia --reporte reporte.csv
+"""
+import argparse
+import csv
+import re
+import unicodedata
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import IO, Dict, Iterator, List, Optional
+
+import pandas as pd
+from openpyxl import load_workbook
+from sqlalchemy import insert, or_
+
+import database
+import destinos
+import estadisticas
+import models
+from models import EstadoProspecto, TipoUsuario
+
+TAMANO_BLOQUE = 5000  # Filas por bloque (una consulta de recurrentes y un commit por bloque)
+
+# Nombre normalizado del encabezado -> columna de prospectos
+ALIAS_COLUMNAS = {
+    "telefono": ["telefono", "tel", "celular", "movil", "telefono_principal"],
+    "indicativo_telefono": ["indicativo", "indicativo_telefono", "codigo_pais"],
+    "telefono_secundario": ["telefono_secundario", "telefono_2", "telefono2", "otro_telefono"],
+    "indicativo_telefono_secundario": ["indicativo_secundario", "indicativo_telefono_secundario"],
+    "nombre": ["nombre", "nombres"],
+    "apellido": ["apellido", "apellidos"],
+    "correo_electronico": ["correo_electronico", "correo", "email", "e_mail"],
+    "ciudad_origen": ["ciudad_origen", "origen", "ciudad"],
+    "destino": ["destino"],
+    "fecha_ida": ["fecha_ida", "ida", "fecha_salida"],
+    "fecha_vuelta": ["fecha_vuelta", "vuelta", "fecha_regreso"],
+    "pasajeros_adultos": ["pasajeros_adultos", "adultos"],
+    "pasajeros_ninos": ["pasajeros_ninos", "ninos"],
+    "pasajeros_infantes": ["pasajeros_infantes", "infantes", "bebes"],
+    "observaciones": ["observaciones", "comentarios", "notas"],
+    "medio_ingreso": ["medio_ingreso", "medio", "fuente", "canal"],
+    "agente": ["agente", "asesor", "agente_asignado"],
+}
+COLUMNAS = list(ALIAS_COLUMNAS)
+
+
+@dataclass
+class ResultadoImportacion:
+    total: int = 0
+    creados: int = 0
+    recurrentes: int = 0
+    con_errores: int = 0
+    filas: List[dict] = field(default_factory=list)  # Reporte por fila del archivo
+
+    def resumen(self) -> dict:
+        return {
+            "total": self.total,
+            "creados": self.creados,
+            "recurrentes": self.recurrentes,
+            "con_errores": self.con_errores
+        }
+
+
+def _normalizar_encabezado(texto) -> str:
+    texto = unicodedata.normalize("NFKD", str(texto or "")).encode("ascii", "ignore").decode()
+    return re.sub(r"[^a-z0-9]+", "_", texto.lower()).strip("_")
+
+
+def _mapear_encabezados(encabezados: List) -> Dict[int, str]:
+    """Posición de la columna en el archivo -> columna de prospectos (las desconocidas se ignoran)"""
+    alias = {a: columna for columna, nombres in ALIAS_COLUMNAS.items() for a in nombres}
+    return {
+        posicion: alias[_normalizar_encabezado(nombre)]
+        for posicion, nombre in enumerate(encabezados)
+        if _normalizar_encabezado(nombre) in alias
+    }
+
+
+def _bloque(filas: List[list], mapa: Dict[int, str], primera_fila: int) -> pd.DataFrame:
+    df = pd.DataFrame(
+        [[fila[i] if i < len(fila) else None for i in mapa] for fila in filas],
+        columns=list(mapa.values()), dtype=object
+    )
+    for columna in COLUMNAS:
+        if columna not in df:
+            df[columna] = None
+    # Número de fila en el archivo (la 1 es el encabezado)
+    df.index = range(primera_fila, primera_fila + len(df))
+    return df
+
+
+def leer_bloques(archivo: IO, nombre_archivo: str) -> Iterator[pd.DataFrame]:
+    """Recorre el archivo (CSV o XLSX) en DataFrames de TAMANO_BLOQUE filas"""
+    if nombre_archivo.lower().endswith((".xlsx", ".xlsm")):
+        libro = load_workbook(archivo, read_only=True, data_only=True)
+        filas = libro.active.iter_rows(values_only=True)
+        mapa = _mapear_encabezados(list(next(filas, [])))
+        pendientes, primera = [], 2
+        for fila in filas:
+            if not any(valor not in (None, "") for valor in fila):
+                continue
+            pendientes.append(list(fila))
+            if len(pendientes) >= TAMANO_BLOQUE:
+                yield _bloque(pendientes, mapa, primera)
+                primera += len(pendientes)
+                pendientes = []
+        if pendientes:
+            yield _bloque(pendientes, mapa, primera)
+        libro.close()
+        return
+
+    # CSV: separador ; o , según la primera línea, leído en bloques (chunksize)
+    muestra = archivo.readline()
+    archivo.seek(0)
+    if isinstance(muestra, bytes):
+        muestra = muestra.decode("utf-8-sig", "ignore")
+    separador = ";" if muestra.count(";") > muestra.count(",") else ","
+    lector = pd.read_csv(
+        archivo, sep=separador, dtype=str, keep_default_na=False,
+        chunksize=TAMANO_BLOQUE, encoding="utf-8-sig"
+    )
+    primera = 2
+    for df in lector:
+        yield _bloque(df.values.tolist(), _mapear_encabezados(list(df.columns)), primera)
+        primera += len(df)
+
+
+# ========== VALIDACIÓN VECTORIZADA ==========
+
+def _texto(serie: pd.Series) -> pd.Series:
+    """Texto limpio; vacío -> None"""
+    limpio = serie.map(lambda v: v.strftime("%d/%m/%Y") if isinstance(v, datetime) else v)
+    limpio = limpio.astype("string").str.strip()
+    # Números leídos de Excel como float (3001234567.0)
+    limpio = limpio.str.replace(r"^(\d+)\.0$", r"\1", regex=True)
+    return limpio.astype(object).where((limpio.notna() & (limpio != "")).fillna(False), None)
+
+
+def _fechas(serie: pd.Series) -> pd.Series:
+    """Fechas DD/MM/YYYY o ISO (YYYY-MM-DD); las inválidas quedan NaT"""
+    fechas = pd.to_datetime(serie, format="%d/%m/%Y", errors="coerce")
+    iso = pd.to_datetime(serie.where(fechas.isna()), format="ISO8601", errors="coerce")
+    return fechas.fillna(iso)
+
+
+def _validar(df: pd.DataFrame, contexto: "ContextoImportacion") -> pd.DataFrame:
+    """Normaliza las columnas y agrega 'errores' (lista por fila)"""
+    for columna in COLUMNAS:
+        df[columna] = _texto(df[columna])
+    errores = pd.DataFrame(index=df.index)
+
+    errores["telefono"] = df["telefono"].fillna("").str.replace(r"\D", "", regex=True) == ""
+
+    df["indicativo_telefono"] = df["indicativo_telefono"].fillna("57").str.lstrip("+")
+    errores["indicativo"] = ~df["indicativo_telefono"].str.fullmatch(r"\d{1,4}")
+    df["indicativo_telefono_secundario"] = df["indicativo_telefono_secundario"].fillna("57").str.lstrip("+")
+    errores["indicativo_secundario"] = ~df["indicativo_telefono_secundario"].str.fullmatch(r"\d{1,4}")
+
+    for columna in ("fecha_ida", "fecha_vuelta"):
+        fechas = _fechas(df[columna])
+        errores[columna] = df[columna].notna() & fechas.isna()
+        df[columna] = fechas.dt.date.astype(object).where(fechas.notna(), None)
+    errores["fechas_orden"] = (
+        df["fecha_ida"].notna() & df["fecha_vuelta"].notna()
+        & (pd.to_datetime(df["fecha_vuelta"]) < pd.to_datetime(df["fecha_ida"]))
+    )
+
+    for columna, defecto in (("pasajeros_adultos", 1), ("pasajeros_ninos", 0), ("pasajeros_infantes", 0)):
+        numeros = pd.to_numeric(df[columna], errors="coerce")
+        errores[columna] = df[columna].notna() & (numeros.isna() | (numeros < 0) | (numeros % 1 != 0))
+        df[columna] = numeros.fillna(defecto).where(~errores[columna], defecto).astype(int)
+
+    medio = df["medio_ingreso"].fillna(contexto.medio_defecto or "").str.upper()
+    df["medio_ingreso_id"] = medio.map(contexto.medios)
+    errores["medio_ingreso"] = df["medio_ingreso_id"].isna()
+
+    agentes = df["agente"].str.lower().map(contexto.agentes)
+    errores["agente"] = df["agente"].notna() & agentes.isna()
+    df["agente_asignado_id"] = agentes.fillna(contexto.agente_defecto or 0).astype(int)
+
+    mensajes = {
+        "telefono": "Teléfono vacío o sin dígitos",
+        "indicativo": "Indicativo principal inválido (solo números, máximo 4 dígitos)",
+        "indicativo_secundario": "Indicativo secundario inválido (solo números, máximo 4 dígitos)",
+        "fecha_ida": "Fecha de ida inválida (DD/MM/AAAA)",
+        "fecha_vuelta": "Fecha de vuelta inválida (DD/MM/AAAA)",
+        "fechas_orden": "La fecha de vuelta es anterior a la de ida",
+        "pasajeros_adultos": "Pasajeros adultos inválido",
+        "pasajeros_ninos": "Pasajeros niños inválido",
+        "pasajeros_infantes": "Pasajeros infantes inválido",
+        "medio_ingreso": "Medio de ingreso desconocido",
+        "agente": "Agente desconocido",
+    }
+    df["errores"] = [
+        [mensajes[c] for c, hay_error in fila.items() if hay_error]
+        for fila in errores.fillna(False).astype(bool).to_dict("records")
+    ]
+
+    df["telefono_normalizado"] = [
+        models.normalizar_telefono(t, i) for t, i in zip(df["telefono"], df["indicativo_telefono"])
+    ]
+    df["telefono_secundario_normalizado"] = [
+        models.normalizar_telefono(t, i) for t, i in zip(df["telefono_secundario"], df["indicativo_telefono_secundario"])
+    ]
+    df["tiene_datos_completos"] = (
+        df["correo_electronico"].notna() | df["fecha_ida"].notna() | df["destino"].notna()
+        | df["ciudad_origen"].notna() | (df["pasajeros_adultos"] > 1)
+        | (df["pasajeros_ninos"] > 0) | (df["pasajeros_infantes"] > 0)
+    )
+    return df
+
+
+# ========== CLIENTES RECURRENTES E INSERCIÓN ==========
+
+@dataclass
+class ContextoImportacion:
+    usuario: models.Usuario
+    medios: Dict[str, int]
+    agentes: Dict[str, int]
+    medio_defecto: Optional[str] = None
+    agente_defecto: Optional[int] = None
+
+
+def _registros_previos(db, df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Registros existentes de cada fila (por teléfono principal o secundario) con una sola
+    consulta indexada y un merge, ordenados del más reciente al más antiguo
+    """
+    claves = pd.concat([
+        df["telefono_normalizado"].rename("clave"),
+        df["telefono_secundario_normalizado"].rename("clave")
+    ]).dropna()
+    if claves.empty:
+        return pd.DataFrame(columns=["fila", "id", "estado", "nombre", "apellido", "correo_electronico", "fecha_registro"])
+
+    P = models.Prospecto
+    valores = list(set(claves))
+    existentes = pd.DataFrame(db.query(
+        P.id, P.estado, P.nombre, P.apellido, P.correo_electronico, P.fecha_registro,
+        P.telefono_normalizado, P.telefono_secundario_normalizado
+    ).filter(or_(
+        P.telefono_normalizado.in_(valores),
+        P.telefono_secundario_normalizado.in_(valores)
+    )).all(), columns=["id", "estado", "nombre", "apellido", "correo_electronico", "fecha_registro",
+                       "telefono_normalizado", "telefono_secundario_normalizado"])
+
+    por_clave = pd.concat([
+        existentes.rename(columns={"telefono_normalizado": "clave"}),
+        existentes.rename(columns={"telefono_secundario_normalizado": "clave"})
+    ]).dropna(subset=["clave"])[["clave", "id", "estado", "nombre", "apellido", "correo_electronico", "fecha_registro"]]
+
+    previos = claves.rename_axis("fila").reset_index().merge(por_clave, on="clave")
+    return previos.drop(columns="clave").drop_duplicates(["fila", "id"]).sort_values(
+        ["fila", "fecha_registro"], ascending=[True, False]
+    )
+
+
+def _olas(df: pd.DataFrame) -> Iterator[pd.DataFrame]:
+    """
+    Separa las filas que repiten un teléfono de otra fila anterior del mismo bloque:
+    se insertan después, para que encuentren a esa fila como registro previo
+    """
+    pendientes = df
+    while not pendientes.empty:
+        vistas, en_ola = set(), []
+        for principal, secundario in zip(pendientes["telefono_normalizado"], pendientes["telefono_secundario_normalizado"]):
+            claves = {c for c in (principal, secundario) if c}
+            en_ola.append(not (claves & vistas))
+            vistas |= claves
+        ola = pendientes[en_ola]
+        yield ola
+        pendientes = pendientes[[not x for x in en_ola]]
+
+
+def _insertar(db, df: pd.DataFrame, contexto: ContextoImportacion, resultado: ResultadoImportacion):
+    P = models.Prospecto
+    previos = _registros_previos(db, df)
+    if not previos.empty:
+        principal = previos.groupby("fila").first()  # Primer valor no nulo, del más reciente al más antiguo
+        mas_reciente = previos.groupby("fila").head(1).set_index("fila")
+        df = df.join(principal[["nombre", "apellido", "correo_electronico"]].add_suffix("_previo"))
+        df["prospecto_original_id"] = mas_reciente["id"].reindex(df.index).astype("Int64")
+        df["estado_anterior"] = mas_reciente["estado"]
+        df["registros_previos"] = previos.groupby("fila")["id"].count()
+        for columna in ("nombre", "apellido", "correo_electronico"):
+            df[columna] = df[columna].where(df[columna].notna(), df[f"{columna}_previo"])
+    else:
+        df = df.assign(prospecto_original_id=None, estado_anterior=None, registros_previos=0)
+    df["registros_previos"] = df["registros_previos"].fillna(0).astype(int)
+    df["cliente_recurrente"] = df["registros_previos"] > 0
+
+    ahora = datetime.now()
+    # ✅ Códigos de cliente reservados en bloque: un solo UPSERT del contador del día
+    df["id_cliente"] = models.reservar_codigos(db.connection(), "CL", ahora.date(), len(df))
+    columnas = [
+        "id_cliente",
+        "nombre", "apellido", "correo_electronico", "telefono", "indicativo_telefono",
+        "telefono_secundario", "indicativo_telefono_secundario", "telefono_normalizado",
+        "telefono_secundario_normalizado", "ciudad_origen", "destino", "fecha_ida", "fecha_vuelta",
+        "pasajeros_adultos", "pasajeros_ninos", "pasajeros_infantes", "medio_ingreso_id",
+        "observaciones", "agente_asignado_id", "tiene_datos_completos", "cliente_recurrente",
+        "prospecto_original_id"
+    ]
+    registros = df[columnas].astype(object).where(df[columnas].notna(), None).to_dict("records")
+    for registro in registros:
+        registro["agente_asignado_id"] = registro["agente_asignado_id"] or None
+        registro["estado"] = EstadoProspecto.NUEVO.value
+        registro["fecha_registro"] = ahora
+
+    # ✅ INSERT masivo (en lotes de varias filas). render_nulls mantiene el mismo juego de
+    # columnas en todas las filas (si no, el ORM parte el lote cada vez que cambian los nulos).
+    # SQLite no garantiza el orden del RETURNING y pedirlo obliga a insertar fila por fila:
+    # los ids se emparejan por teléfono, que es único dentro de cada ola
+    insertados = dict(db.execute(
+        insert(P).execution_options(render_nulls=True).returning(P.telefono_normalizado, P.id),
+        registros
+    ).tuples().all())
+    df["prospecto_id"] = df["telefono_normalizado"].map(insertados)
+
+    recurrentes = df[df["cliente_recurrente"]]
+    if not recurrentes.empty:
+        db.execute(insert(models.Interaccion), [{
+            "prospecto_id": fila.prospecto_id,
+            "usuario_id": contexto.usuario.id,
+            "tipo_interaccion": "sistema",
+            "descripcion": f"Cliente recurrente registrado. Teléfono: {fila.telefono}. Registros previos: {fila.registros_previos}",
+            "estado_anterior": fila.estado_anterior,
+            "estado_nuevo": EstadoProspecto.NUEVO.value,
+            "fecha_creacion": ahora
+        } for fila in recurrentes.itertuples()])
+
+    estadisticas.marcar_dias_resumen(db, {ahora.date()})
+    resultado.creados += len(df)
+    resultado.recurrentes += len(recurrentes)
+    for fila in df.itertuples():
+        resultado.filas.append({
+            "fila": fila.Index,
+            "estado": "recurrente" if fila.cliente_recurrente else "creado",
+            "prospecto_id": fila.prospecto_id,
+            "id_cliente": fila.id_cliente,
+            "errores": []
+        })
+
+
+def crear_contexto(db, usuario: models.Usuario, medio: Optional[str] = None,
+                   agente_id: Optional[int] = None) -> ContextoImportacion:
+    """Carga una sola vez los medios de ingreso y agentes para validar los nombres del archivo"""
+    medios = {m.nombre.upper(): m.id for m in db.query(models.MedioIngreso)}
+    agentes = {
+        u.username.lower(): u.id
+        for u in db.query(models.Usuario).filter(models.Usuario.tipo_usuario == TipoUsuario.AGENTE.value)
+    }
+    # Igual que en el alta manual: solo agentes válidos, y un agente que importa se queda con los prospectos
+    if agente_id not in agentes.values():
+        agente_id = None
+    if not agente_id and usuario.tipo_usuario == TipoUsuario.AGENTE.value:
+        agente_id = usuario.id
+    return ContextoImportacion(usuario, medios, agentes, medio, agente_id)
+
+
+def importar_prospectos(db, archivo: IO, nombre_archivo: str, contexto: ContextoImportacion,
+                        solo_validar: bool = False) -> ResultadoImportacion:
+    """Importa el archivo bloque a bloque (un commit por bloque) y devuelve el reporte por fila"""
+    resultado = ResultadoImportacion()
+    for df in leer_bloques(archivo, nombre_archivo):
+        df = _validar(df, contexto)
+        resultado.total += len(df)
+
+        invalidas = df[df["errores"].map(bool)]
+        resultado.con_errores += len(invalidas)
+        resultado.filas.extend(
+            {"fila": fila, "estado": "error", "prospecto_id": None, "id_cliente": None, "errores": errores}
+            for fila, errores in invalidas["errores"].items()
+        )
+        validas = df[~df["errores"].map(bool)]
+        if solo_validar or validas.empty:
+            continue
+
+        try:
+            for ola in _olas(validas):
+                _insertar(db, ola, contexto, resultado)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+
+    if resultado.creados:
+        # Las inserciones masivas no pasan por los listeners del índice de destinos
+        destinos.indice_destinos.invalidar()
+    resultado.filas.sort(key=lambda f: f["fila"])
+    return resultado
+
+
+def escribir_reporte(resultado: ResultadoImportacion, ruta: str):
+    with open(ruta, "w", newline="", encoding="utf-8-sig") as salida:
+        escritor = csv.writer(salida)
+        escritor.writerow(["Fila", "Estado", "ID Prospecto", "ID Cliente", "Errores"])
+        for fila in resultado.filas:
+            escritor.writerow([
+                fila["fila"], fila["estado"], fila["prospecto_id"] or "",
+                fila["id_cliente"] or "", "; ".join(fila["errores"])
+            ])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Importación masiva de prospectos (CSV/XLSX)")
+    parser.add_argument("archivo")
+    parser.add_argument("--usuario", required=True, help="Usuario que registra la importación")
+    parser.add_argument("--medio", help="Medio de ingreso para las filas sin columna 'medio' (p. ej. REDES)")
+    parser.add_argument("--agente", help="Agente asignado para las filas sin columna 'agente'")
+    parser.add_argument("--reporte", help="Ruta del reporte CSV por fila")
+    parser.add_argument("--validar", action="store_true", help="Solo validar, sin insertar")
+    opciones = parser.parse_args()
+
+    database.check_and_migrate()
+    db = database.SessionLocal()
+    try:
+        usuario = db.query(models.Usuario).filter(models.Usuario.username == opciones.usuario).first()
+        if not usuario:
+            raise SystemExit(f"❌ Usuario no encontrado: {opciones.usuario}")
+        contexto = crear_contexto(db, usuario, opciones.medio)
+        if opciones.agente:
+            contexto.agente_defecto = contexto.agentes.get(opciones.agente.lower())
+            if not contexto.agente_defecto:
+                raise SystemExit(f"❌ Agente no encontrado: {opciones.agente}")
+
+        inicio = datetime.now()
+        with open(opciones.archivo, "rb") as archivo:
+            resultado = importar_prospectos(db, archivo, opciones.archivo, contexto, opciones.validar)
+        segundos = (datetime.now() - inicio).total_seconds()
+
+        print(f"✅ {resultado.total} filas en {segundos:.1f} s: {resultado.creados} creadas "
+              f"({resultado.recurrentes} recurrentes), {resultado.con_errores} con errores")
+        if opciones.reporte:
+            escribir_reporte(resultado, opciones.reporte)
+            print(f"📄 Reporte: {opciones.reporte}")
+    finally:
+        db.close()
@@ -0,0 +1,278 @@
+import re
+from typing import List, Optional
+from sqlalchemy import text, select, table, literal_column, or_, func
+import models
+
+# ✅ Índice de texto completo (SQLite FTS5) sincronizado con prospectos mediante triggers.
+# Es "contentless" (content=''): solo guarda el índice, los datos se leen de prospectos.
+# El tokenizador unicode61 con remove_diacritics 2 hace la búsqueda insensible a tildes.
+TABLA_FTS = "prospectos_fts"
+
+COLUMNAS_FTS = [
+    "nombre", "apellido", "telefonos", "correo_electronico",
+    "destino", "ciudad_origen", "observaciones"
+]
+
+# Columnas de prospectos cuyo cambio obliga a reindexar la fila
+COLUMNAS_ORIGEN = [
+    "nombre", "apellido", "telefono", "indicativo_telefono", "telefono_secundario",
+    "telefono_normalizado", "telefono_secundario_normalizado",
+    "correo_electronico", "destino", "ciudad_origen", "observaciones"
+]
+
+def _telefono_compacto(columna: str) -> str:
+    """Teléfono sin espacios ni guiones (expresión SQL)"""
+    return f"replace(replace(coalesce({columna}, ''), ' ', ''), '-', '')"
+
+# ✅ Sufijos de los teléfonos normalizados como tokens: un término de solo dígitos
+# ("2337207") usa el índice como prefijo de un sufijo en lugar de LIKE '%dígitos'
+LARGO_MAXIMO_TELEFONO = 15  # E.164
+LARGO_MINIMO_SUFIJO = 4
+
+def _sufijos_telefono(columna: str) -> str:
+    """Sufijos de LARGO_MINIMO_SUFIJO dígitos o más del teléfono normalizado, separados por espacios (expresión SQL)"""
+    digitos = f"ltrim(coalesce({columna}, ''), '+')"
+    return " || ' ' || ".join(
+        f"CASE WHEN length({digitos}) >= {inicio + LARGO_MINIMO_SUFIJO - 1} THEN substr({digitos}, {inicio}) ELSE '' END"
+        for inicio in range(2, LARGO_MAXIMO_TELEFONO - LARGO_MINIMO_SUFIJO + 2)
+    )
+
+def _valores_fts(fila: str) -> List[str]:
+    """Expresiones SQL indexadas para una fila (NEW/OLD en triggers o la tabla al poblar)"""
+    telefonos = " || ' ' || ".join([
+        f"coalesce({fila}.telefono, '')",
+        _telefono_compacto(f"{fila}.telefono"),
+        f"coalesce({fila}.indicativo_telefono, '') || {_telefono_compacto(f'{fila}.telefono')}",
+        f"coalesce({fila}.telefono_secundario, '')",
+        _telefono_compacto(f"{fila}.telefono_secundario"),
+        f"ltrim(coalesce({fila}.telefono_normalizado, ''), '+')",
+        f"ltrim(coalesce({fila}.telefono_secundario_normalizado, ''), '+')",
+        _sufijos_telefono(f"{fila}.telefono_normalizado"),
+        _sufijos_telefono(f"{fila}.telefono_secundario_normalizado"),
+    ])
+    return [
+        f"{fila}.nombre", f"{fila}.apellido", telefonos, f"{fila}.correo_electronico",
+        f"{fila}.destino", f"{fila}.ciudad_origen", f"{fila}.observaciones"
+    ]
+
+def _sql_insertar(fila: str) -> str:
+    return (
+        f"INSERT INTO {TABLA_FTS}(rowid, {', '.join(COLUMNAS_FTS)}) "
+        f"VALUES ({fila}.id, {', '.join(_valores_fts(fila))});"
+    )
+
+def _sql_eliminar(fila: str) -> str:
+    return (
+        f"INSERT INTO {TABLA_FTS}({TABLA_FTS}, rowid, {', '.join(COLUMNAS_FTS)}) "
+        f"VALUES ('delete', {fila}.id, {', '.join(_valores_fts(fila))});"
+    )
+
+TRIGGERS_FTS = {
+    "prospectos_fts_ai": f"CREATE TRIGGER prospectos_fts_ai AFTER INSERT ON prospectos BEGIN {_sql_insertar('new')} END",
+    "prospectos_fts_ad": f"CREATE TRIGGER prospectos_fts_ad AFTER DELETE ON prospectos BEGIN {_sql_eliminar('old')} END",
+    "prospectos_fts_au": f"CREATE TRIGGER prospectos_fts_au AFTER UPDATE OF {', '.join(COLUMNAS_ORIGEN)} ON prospectos BEGIN {_sql_eliminar('old')} {_sql_insertar('new')} END",
+}
+
+def fts_disponible(conn) -> bool:
+    """El índice FTS solo existe en SQLite"""
+    return conn.dialect.name == "sqlite"
+
+def crear_indice_busqueda(conn):
+    """Crea (o actualiza) la tabla FTS5 y sus triggers, y la puebla si cambió su definición"""
+    if not fts_disponible(conn):
+        return
+
+    existe = conn.execute(text(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name = :nombre"
+    ), {"nombre": TABLA_FTS}).first()
+    if not existe:
+        print(f"  ➕ Creando índice de búsqueda: {TABLA_FTS}")
+        conn.execute(text(
+            f"CREATE VIRTUAL TABLE {TABLA_FTS} USING fts5("
+            f"{', '.join(COLUMNAS_FTS)}, content='', "
+            f"tokenize='unicode61 remove_diacritics 2')"
+        ))
+
+    # Recrear los triggers solo si su definición cambió (o no existen)
+    actuales = dict(conn.execute(text(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'prospectos'"
+    )).all())
+    if existe and all(actuales.get(nombre) == sql for nombre, sql in TRIGGERS_FTS.items()):
+        return
+
+    for nombre, sql in TRIGGERS_FTS.items():
+        conn.execute(text(f"DROP TRIGGER IF EXISTS {nombre}"))
+        conn.execute(text(sql))
+    reconstruir_indice_busqueda(conn)
+
+def reconstruir_indice_busqueda(conn):
+    """Vuelve a indexar todos los prospectos"""
+    conn.execute(text(f"INSERT INTO {TABLA_FTS}({TABLA_FTS}) VALUES ('delete-all')"))
+    conn.execute(text(
+        f"INSERT INTO {TABLA_FTS}(rowid, {', '.join(COLUMNAS_FTS)}) "
+        f"SELECT p.id, {', '.join(_valores_fts('p'))} FROM prospectos p"
+    ))
+    print(f"  🔎 Índice de búsqueda reconstruido")
+
+# ✅ Índice de los documentos (nombre, descripción y texto extraído del PDF). Usa la tabla
+# documentos como contenido externo para poder mostrar fragmentos (snippet) del texto.
+TABLA_FTS_DOCUMENTOS = "documentos_fts"
+COLUMNAS_FTS_DOCUMENTOS = ["nombre_archivo", "descripcion", "texto_extraido"]
+
+def _sql_documento(fila: str, eliminar: bool = False) -> str:
+    columnas = ", ".join(COLUMNAS_FTS_DOCUMENTOS)
+    valores = ", ".join(f"{fila}.{columna}" for columna in COLUMNAS_FTS_DOCUMENTOS)
+    if eliminar:
+        return (f"INSERT INTO {TABLA_FTS_DOCUMENTOS}({TABLA_FTS_DOCUMENTOS}, rowid, {columnas}) "
+                f"VALUES ('delete', {fila}.id, {valores});")
+    return f"INSERT INTO {TABLA_FTS_DOCUMENTOS}(rowid, {columnas}) VALUES ({fila}.id, {valores});"
+
+TRIGGERS_FTS_DOCUMENTOS = {
+    "documentos_fts_ai": f"CREATE TRIGGER documentos_fts_ai AFTER INSERT ON documentos BEGIN {_sql_documento('new')} END",
+    "documentos_fts_ad": f"CREATE TRIGGER documentos_fts_ad AFTER DELETE ON documentos BEGIN {_sql_documento('old', True)} END",
+    "documentos_fts_au": f"CREATE TRIGGER documentos_fts_au AFTER UPDATE OF {', '.join(COLUMNAS_FTS_DOCUMENTOS)} ON documentos BEGIN {_sql_documento('old', True)} {_sql_documento('new')} END",
+}
+
+def crear_indice_documentos(conn):
+    """Crea la tabla FTS5 de documentos y sus triggers, y la puebla si cambió su definición"""
+    if not fts_disponible(conn):
+        return
+
+    existe = conn.execute(text(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name = :nombre"
+    ), {"nombre": TABLA_FTS_DOCUMENTOS}).first()
+    if not existe:
+        print(f"  ➕ Creando índice de búsqueda: {TABLA_FTS_DOCUMENTOS}")
+        conn.execute(text(
+            f"CREATE VIRTUAL TABLE {TABLA_FTS_DOCUMENTOS} USING fts5("
+            f"{', '.join(COLUMNAS_FTS_DOCUMENTOS)}, content='documentos', content_rowid='id', "
+            f"tokenize='unicode61 remove_diacritics 2')"
+        ))
+
+    actuales = dict(conn.execute(text(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'documentos'"
+    )).all())
+    if existe and all(actuales.get(nombre) == sql for nombre, sql in TRIGGERS_FTS_DOCUMENTOS.items()):
+        return
+
+    for nombre, sql in TRIGGERS_FTS_DOCUMENTOS.items():
+        conn.execute(text(f"DROP TRIGGER IF EXISTS {nombre}"))
+        conn.execute(text(sql))
+    conn.execute(text(f"INSERT INTO {TABLA_FTS_DOCUMENTOS}({TABLA_FTS_DOCUMENTOS}) VALUES ('rebuild')"))
+    print(f"  🔎 Índice de documentos reconstruido")
+
+def buscar_documentos(db, termino: str, limite: int = 20):
+    """
+    Documentos cuyo nombre, descripción o texto coincide, por relevancia.
+    Devuelve filas (documento_id, fragmento del texto con la coincidencia marcada).
+    """
+    consulta = construir_consulta_fts(termino)
+    if not consulta:
+        return []
+    if not fts_disponible(db.get_bind()):
+        term = f"%{termino}%"
+        D = models.Documento
+        return db.query(D.id, literal_column("NULL")).filter(or_(
+            D.nombre_archivo.ilike(term), D.descripcion.ilike(term), D.texto_extraido.ilike(term)
+        )).order_by(D.id.desc()).limit(limite).all()
+    return db.execute(text(
+        f"SELECT rowid, snippet({TABLA_FTS_DOCUMENTOS}, 2, '[', ']', '…', 16) FROM {TABLA_FTS_DOCUMENTOS} "
+        f"WHERE {TABLA_FTS_DOCUMENTOS} MATCH :consulta ORDER BY rank LIMIT :limite"
+    ), {"consulta": consulta, "limite": limite}).all()
+
+def construir_consulta_fts(termino: str, columnas: Optional[List[str]] = None) -> str:
+    """
+    Convierte el texto del usuario en una consulta FTS5: cada palabra como prefijo
+    ("ana"* "gom"*), todas requeridas y opcionalmente limitadas a ciertas columnas.
+    """
+    tokens = re.findall(r"\w+", (termino or "").lower())
+    if not tokens:
+        return ""
+    consulta = " ".join(f'"{token}"*' for token in tokens)
+    if columnas:
+        consulta = "{" + " ".join(columnas) + "} : (" + consulta + ")"
+    return consulta
+
+def aplicar_busqueda(query, termino: str, columnas: Optional[List[str]] = None):
+    """
+    Filtra una query de Prospecto por el término usando el índice FTS5.
+    Devuelve (query, rank); rank es la columna de relevancia (menor = más relevante),
+    o None si no hay FTS disponible y se usó el filtro ilike equivalente.
+    Sin columnas (búsqueda global) también coincide el texto de sus documentos.
+    Un término de solo dígitos también encuentra los teléfonos que terminan en él.
+    """
+    incluir_documentos = not columnas
+    columnas = columnas or COLUMNAS_FTS
+
+    if not fts_disponible(query.session.get_bind()):
+        return query.filter(_filtro_ilike(termino, columnas)), None
+
+    consulta = construir_consulta_fts(termino, columnas)
+    if not consulta:
+        return query, None
+    digitos = _digitos_telefono(termino) if "telefonos" in columnas else None
+    if digitos:
+        # Solo dígitos: también el final de un teléfono, con espacios o guiones ("2337 207")
+        consulta = f'({consulta}) OR {{telefonos}} : "{digitos}"*'
+
+    fts = select(
+        literal_column("rowid").label("prospecto_id"),
+        literal_column("rank").label("rank")
+    ).select_from(table(TABLA_FTS)).where(
+        literal_column(TABLA_FTS).op("MATCH")(consulta)
+    )
+    otras = []
+    if incluir_documentos:
+        # Búsqueda global: también los prospectos con un documento que coincide (texto del PDF)
+        D = models.Documento.__table__
+        otras.append(select(
+            D.c.prospecto_id, literal_column("rank")
+        ).select_from(table(TABLA_FTS_DOCUMENTOS)).join(
+            D, D.c.id == literal_column(f"{TABLA_FTS_DOCUMENTOS}.rowid")
+        ).where(
+            literal_column(TABLA_FTS_DOCUMENTOS).op("MATCH")(construir_consulta_fts(termino)),
+            D.c.prospecto_id != None
+        ))
+    if otras:
+        union = fts.union_all(*otras).subquery("coincidencias")
+        fts = select(
+            union.c.prospecto_id, func.min(union.c.rank).label("rank")
+        ).group_by(union.c.prospecto_id)
+    fts = fts.subquery("fts")
+
+    query = query.join(fts, fts.c.prospecto_id == models.Prospecto.id)
+    return query, fts.c.rank
+
+def _digitos_telefono(termino: str) -> Optional[str]:
+    """Los dígitos del término si solo tiene dígitos, espacios y guiones; si no, None"""
+    digitos = re.sub(r"[\s\-]", "", termino or "")
+    return digitos if re.fullmatch(r"[0-9]+", digitos) else None
+
+def _filtro_sufijo_telefono(termino: str):
+    """
+    Sin FTS: si el término son solo dígitos, los teléfonos normalizados que terminan
+    en ellos; si no, None.
+    """
+    digitos = _digitos_telefono(termino)
+    if digitos is None:
+        return None
+    sufijo = f"%{digitos}"
+    return or_(
+        models.Prospecto.telefono_normalizado.like(sufijo),
+        models.Prospecto.telefono_secundario_normalizado.like(sufijo)
+    )
+
+def _filtro_ilike(termino: str, columnas: List[str]):
+    """Filtro equivalente con ilike para motores sin FTS5"""
+    term = f"%{termino}%"
+    condiciones = []
+    for columna in columnas:
+        if columna == "telefonos":
+            condiciones.append(models.Prospecto.telefono.ilike(term))
+            condiciones.append(models.Prospecto.telefono_secundario.ilike(term))
+            sufijo = _filtro_sufijo_telefono(termino)
+            if sufijo is not None:
+                condiciones.append(sufijo)
+        else:
+            condiciones.append(getattr(models.Prospecto, columna).ilike(term))
+    return or_(*condiciones)
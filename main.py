@@ -1,50 +1,44 @@
 # Imports estándar de Python
 import os
-import io
-import shutil
-import secrets
+import asyncio
+import json
+import mimetypes
 from datetime import datetime, date, timedelta
-from typing import Optional
+from typing import List, Optional
 # Imports de librerías de terceros (pypi)
-from fastapi import FastAPI, Depends, HTTPException, Request, Form, Query, UploadFile, File
-from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, StreamingResponse
+from fastapi import FastAPI, Depends, HTTPException, Request, Form, Query, UploadFile, File, BackgroundTasks
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, StreamingResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from sqlalchemy.orm import Session
-import pandas as pd
+from sqlalchemy.orm import Session, joinedload, selectinload
+import anyio
 # Imports de módulos locales de la aplicación
 import models
 import database
 import auth
+import estadisticas
+import indice_busqueda
+import paginacion
+import exportacion
+import sesiones
+import correo
+import eventos
+import importacion
+import asignacion
+import documentos
+import procesamiento_documentos
+import destinos
+from planificador import planificador
 from models import TipoUsuario, EstadoProspecto
-from sqlalchemy import func, or_, and_
+from sqlalchemy import func, or_, and_, select, insert, literal, true
 from difflib import get_close_matches
-import smtplib
-from email.mime.text import MIMEText
+from collections import Counter
+from urllib.parse import quote
 import re
 
 
 
 
-def enviar_notificacion_email(destinatario: str, asunto: str, cuerpo: str):
-    """Envía una notificación por correo electrónico (Simulado por ahora)"""
-    try:
-        # En un entorno real, aquí se configurarían las credenciales SMTP
-        # server = smtplib.SMTP('smtp.gmail.com', 587)
-        # server.starttls()
-        # server.login("tu_correo@gmail.com", "tu_password")
-        # msg = MIMEText(cuerpo)
-        # msg['Subject'] = asunto
-        # msg['From'] = "sistema@prospectos.com"
-        # msg['To'] = destinatario
-        # server.send_message(msg)
-        # server.quit()
-        print(f"📧 [EMAIL SIMULADO] A: {destinatario} | Asunto: {asunto}")
-        return True
-    except Exception as e:
-        print(f"❌ Error enviando email: {e}")
-        return False
-
 def parsear_fecha(fecha_str: str) -> Optional[date]:
     """Helper para parsear fechas en formatos DD/MM/YYYY o YYYY-MM-DD"""
     if not fecha_str:
@@ -60,16 +54,67 @@ def parsear_fecha(fecha_str: str) -> Optional[date]:
 
 app = FastAPI(title="Sistema de Prospectos")
 
-# Configuración para upload de archivos
-UPLOAD_DIR = "uploads"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
-
+# ✅ Los documentos se sirven por /documentos/{id}/descargar (con permisos), no como estáticos
 app.mount("/static", StaticFiles(directory="static"), name="static")
-app.mount("/uploads", StaticFiles(directory=UPLOAD_DIR), name="uploads")
 templates = Jinja2Templates(directory="templates")
 
-# Almacenamiento simple de sesiones en memoria
-active_sessions = {}
+# ✅ Las sesiones se guardan en el almacén configurado (ver sesiones.py)
+
+# ✅ MODO DEPURACIÓN: avisar de peticiones con demasiadas consultas SQL (p. ej. N+1)
+@app.middleware("http")
+async def contar_consultas_sql(request: Request, call_next):
+    if not database.SQL_UMBRAL_CONSULTAS:
+        return await call_next(request)
+    
+    consultas, token = database.iniciar_conteo_consultas()
+    try:
+        response = await call_next(request)
+    finally:
+        database.finalizar_conteo_consultas(token)
+    
+    response.headers["X-SQL-Consultas"] = str(len(consultas))
+    if len(consultas) > database.SQL_UMBRAL_CONSULTAS:
+        consulta_repetida, repeticiones = Counter(consultas).most_common(1)[0]
+        print(f"⚠️ {request.method} {request.url.path}: {len(consultas)} consultas SQL "
+              f"(umbral {database.SQL_UMBRAL_CONSULTAS}). Más repetida ({repeticiones}x): "
+              f"{' '.join(consulta_repetida.split())[:200]}")
+    return response
+
+# ✅ Rechazar subidas de documentos demasiado grandes antes de recibir el cuerpo
+# (el formulario multipart se guarda entero en disco antes de llegar al handler)
+@app.middleware("http")
+async def limitar_tamano_subidas(request: Request, call_next):
+    longitud = request.headers.get("content-length")
+    if (request.method == "POST" and request.url.path.endswith("/documento")
+            and longitud and longitud.isdigit()
+            and int(longitud) > documentos.MAX_TAMANO_DOCUMENTO + 64 * 1024):  # Margen para el resto del formulario
+        error = documentos.ArchivoDemasiadoGrande(documentos.MAX_TAMANO_DOCUMENTO)
+        return RedirectResponse(
+            url=f"{request.url.path.rsplit('/', 1)[0]}/seguimiento?error={error}",
+            status_code=303
+        )
+    return await call_next(request)
+
+# ✅ Los handlers son síncronos (def): FastAPI los ejecuta en un pool de hilos acotado,
+# así las consultas a la BD no bloquean el event loop ni al resto de usuarios.
+# Por defecto tantos hilos como conexiones del pool de la BD menos una reserva: cada handler
+# tiene su sesión y a ratos una segunda conexión corta (almacén de sesiones, blobs), y los
+# workers en segundo plano también usan el pool. Con más hilos esperarían conexión (pool_timeout).
+CONEXIONES_RESERVADAS = int(os.getenv("CONEXIONES_RESERVADAS", "5"))
+
+def hilos_trabajo() -> int:
+    """HILOS_TRABAJO (o el pool de la BD menos la reserva), sin pasar del pool"""
+    capacidad = database.capacidad_pool()
+    maximo = max(capacidad - CONEXIONES_RESERVADAS, 1) if capacidad else None
+    hilos = int(os.getenv("HILOS_TRABAJO", maximo or 40))
+    if maximo and hilos > maximo:
+        print(f"⚠️ HILOS_TRABAJO={hilos} supera las conexiones del pool ({capacidad} - {CONEXIONES_RESERVADAS} reservadas): se usan {maximo}")
+        hilos = maximo
+    return hilos
+
+@app.on_event("startup")
+async def configurar_pool_hilos():
+    anyio.to_thread.current_default_thread_limiter().total_tokens = hilos_trabajo()
 
 # Crear tablas al inicio
 # Crear tablas al inicio
@@ -78,9 +123,16 @@ def startup():
     # Para desarrollo: resetear base de datos si es necesario
     # database.reset_database()
     
-    database.create_tables()
+    # Crear tablas y aplicar migraciones (columnas e índices) en bases existentes
+    database.check_and_migrate()
     db = next(database.get_db())
     try:
+        # ✅ Construir el resumen diario de estadísticas en bases de datos existentes
+        estadisticas.inicializar_resumen_diario(db)
+        
+        # ✅ Índice en memoria de destinos para el autocompletado
+        print(f"🧭 Índice de destinos: {destinos.indice_destinos.reconstruir(db)} destinos")
+        
         # Crear medios de ingreso por defecto
         medios = ["REDES", "TEL TRAVEL", "RECOMPRA", "REFERIDO", "FIDELIZACION"]
         for medio in medios:
@@ -119,40 +171,80 @@ def startup():
     finally:
         db.close()
 
+# ✅ Tareas periódicas en segundo plano (con lease en BD: solo un worker ejecuta cada una)
+INACTIVIDAD_MINUTOS = int(os.getenv("INACTIVIDAD_MINUTOS", "15"))
+
+@app.on_event("startup")
+async def iniciar_planificador():
+    if INACTIVIDAD_MINUTOS > 0:
+        planificador.agregar("inactividad", INACTIVIDAD_MINUTOS * 60, revisar_inactividad)
+    # Envío de los correos pendientes de la bandeja de salida
+    if correo.CORREO_INTERVALO_SEGUNDOS > 0:
+        planificador.agregar("correos", correo.CORREO_INTERVALO_SEGUNDOS, correo.enviar_pendientes)
+    # Mantenimiento de SQLite (PRAGMA optimize + checkpoint del WAL)
+    if database.SQLITE_MANTENIMIENTO_MINUTOS > 0:
+        planificador.agregar("mantenimiento_sqlite", database.SQLITE_MANTENIMIENTO_MINUTOS * 60, database.mantenimiento_sqlite)
+    # Texto y miniaturas de los documentos que quedaron pendientes (reintentos, reinicios)
+    if procesamiento_documentos.pypdf is None:
+        print("⚠️ pypdf no está instalado: los documentos no se procesarán (texto, páginas, miniatura)")
+    elif procesamiento_documentos.DOCUMENTOS_INTERVALO_SEGUNDOS > 0:
+        planificador.agregar("documentos", procesamiento_documentos.DOCUMENTOS_INTERVALO_SEGUNDOS,
+                             procesamiento_documentos.procesar_pendientes)
+    planificador.iniciar()
+
+@app.on_event("shutdown")
+async def detener_planificador():
+    planificador.detener()
+
 
 
 
 # Función simple para obtener usuario actual
-async def get_current_user(request: Request, db: Session = Depends(database.get_db)):
+def get_current_user(request: Request, db: Session = Depends(database.get_db)):
     try:
+        # ✅ Memoizado dentro de la petición (algunos handlers lo piden dos veces)
+        memo = getattr(request.state, "usuario_actual", None)
+        if memo is not None and memo[0] is db:
+            return memo[1]
+        
         session_token = request.cookies.get("session_token")
         
         if not session_token:
             return None
         
-        user_id = active_sessions.get(session_token)
+        # ✅ La sesión se comprueba siempre en el almacén (logout, caducidad o usuario
+        # eliminado en otro worker); la caché solo evita volver a leer la fila del usuario
+        user_id = sesiones.obtener_usuario_id(session_token)
         if not user_id:
             return None
         
-        user = db.query(models.Usuario).filter(models.Usuario.id == user_id).first()
+        user = sesiones.usuario_en_cache(session_token, user_id)
+        if user is not None:
+            user = db.merge(user, load=False)
+        else:
+            user = db.query(models.Usuario).filter(models.Usuario.id == user_id).first()
+            if user:
+                sesiones.guardar_usuario_en_cache(session_token, user)
+        
+        request.state.usuario_actual = (db, user)
         return user
     except Exception as e:
         print(f"❌ Error in get_current_user: {e}")
         return None
 
 # Verificar si usuario es admin
-async def require_admin(user: models.Usuario = Depends(get_current_user)):
+def require_admin(user: models.Usuario = Depends(get_current_user)):
     if not user or user.tipo_usuario != TipoUsuario.ADMINISTRADOR.value:
         raise HTTPException(status_code=403, detail="No tiene permisos de administrador")
     return user
 
 # Página de login
 @app.get("/", response_class=HTMLResponse)
-async def login_page(request: Request):
+def login_page(request: Request):
     return templates.TemplateResponse("login.html", {"request": request})
 
 @app.post("/login")
-async def login(
+def login(
     request: Request, 
     username: str = Form(...), 
     password: str = Form(...), 
@@ -171,15 +263,14 @@ async def login(
             "error": "Contraseña incorrecta"
         })
     
-    session_token = secrets.token_urlsafe(32)
-    active_sessions[session_token] = user.id
+    session_token = sesiones.crear_sesion(user.id)
     
     response = RedirectResponse(url="/dashboard", status_code=303)
     response.set_cookie(
         key="session_token",
         value=session_token,
         httponly=True,
-        max_age=1800,
+        max_age=sesiones.DURACION_SESION,
         path="/"
     )
     
@@ -187,10 +278,9 @@ async def login(
 
 # Logout
 @app.get("/logout")
-async def logout(request: Request):
+def logout(request: Request):
     session_token = request.cookies.get("session_token")
-    if session_token and session_token in active_sessions:
-        del active_sessions[session_token]
+    sesiones.cerrar_sesion(session_token)
     
     response = RedirectResponse(url="/", status_code=303)
     response.delete_cookie("session_token")
@@ -199,303 +289,43 @@ async def logout(request: Request):
 
 # Dashboard principal con filtros de fecha - VERSIÓN CORREGIDA
 @app.get("/dashboard", response_class=HTMLResponse)
-async def dashboard(
+def dashboard(
     request: Request,
     periodo: str = Query("mes"),  # dia, semana, mes, año, personalizado
     fecha_inicio: str = Query(None),
     fecha_fin: str = Query(None),
     db: Session = Depends(database.get_db)
 ):
-    user = await get_current_user(request, db)
+    user = get_current_user(request, db)
     
     if not user:
         return RedirectResponse(url="/", status_code=303)
     
     try:
         # Determinar el rango de fechas según el periodo seleccionado
-        fecha_inicio_obj, fecha_fin_obj = calcular_rango_fechas(periodo, fecha_inicio, fecha_fin)
+        fecha_inicio_dt, fecha_fin_dt = calcular_rango_fechas(periodo, fecha_inicio, fecha_fin)
+        fecha_inicio_obj = fecha_inicio_dt.date()
+        fecha_fin_obj = fecha_fin_dt.date()
         
         print(f"📊 Calculando estadísticas para periodo: {periodo}")
         print(f"📅 Rango: {fecha_inicio_obj} a {fecha_fin_obj}")
         
-        # Convertir a datetime para consultas
-        fecha_inicio_dt = datetime.combine(fecha_inicio_obj, datetime.min.time())
-        fecha_fin_dt = datetime.combine(fecha_fin_obj, datetime.max.time())
-        
-        # Inicializar todas las variables
-        total_prospectos = prospectos_con_datos = prospectos_sin_datos = 0
-        clientes_sin_asignar = clientes_asignados = destinos_count = ventas_count = 0
-        prospectos_nuevos = prospectos_seguimiento = prospectos_cotizados = prospectos_ganados = prospectos_perdidos = 0
-        destinos_populares = []
-        conversion_agentes = []
-        
-        # Estadísticas básicas
+        # ✅ Estadísticas calculadas con consultas agrupadas (una por tabla)
         if user.tipo_usuario in [TipoUsuario.ADMINISTRADOR.value, TipoUsuario.SUPERVISOR.value]:
             print("👨‍💼 Usuario es Admin/Supervisor - mostrando estadísticas generales")
-            
-            # ✅ CORREGIDO: Total de prospectos en el periodo (NO filtrado por estado)
-            total_prospectos = db.query(models.Prospecto).filter(
-                models.Prospecto.fecha_registro >= fecha_inicio_dt,
-                models.Prospecto.fecha_registro <= fecha_fin_dt
-            ).count()
-            print(f"📈 Total prospectos: {total_prospectos}")
-            
-            # ✅ NUEVO: Prospectos con datos completos
-            prospectos_con_datos = db.query(models.Prospecto).filter(
-                models.Prospecto.tiene_datos_completos == True,
-                models.Prospecto.fecha_registro >= fecha_inicio_dt,
-                models.Prospecto.fecha_registro <= fecha_fin_dt
-            ).count()
-            print(f"📝 Prospectos con datos: {prospectos_con_datos}")
-            
-            # ✅ NUEVO: Prospectos sin datos (solo teléfono)
-            prospectos_sin_datos = db.query(models.Prospecto).filter(
-                models.Prospecto.tiene_datos_completos == False,
-                models.Prospecto.fecha_registro >= fecha_inicio_dt,
-                models.Prospecto.fecha_registro <= fecha_fin_dt
-            ).count()
-            print(f"📱 Prospectos sin datos: {prospectos_sin_datos}")
-            
-            # Clientes nuevos sin asignar en el periodo
-            clientes_sin_asignar = db.query(models.Prospecto).filter(
-                models.Prospecto.estado == EstadoProspecto.NUEVO.value,
-                models.Prospecto.agente_asignado_id == None,
-                models.Prospecto.fecha_registro >= fecha_inicio_dt,
-                models.Prospecto.fecha_registro <= fecha_fin_dt
-            ).count()
-            print(f"🆕 Clientes sin asignar: {clientes_sin_asignar}")
-            
-            # Clientes asignados en el periodo (cualquier estado)
-            clientes_asignados = db.query(models.Prospecto).filter(
-                models.Prospecto.agente_asignado_id != None,
-                models.Prospecto.fecha_registro >= fecha_inicio_dt,
-                models.Prospecto.fecha_registro <= fecha_fin_dt
-            ).count()
-            print(f"📅 Clientes asignados: {clientes_asignados}")
-            
-            # Destinos registrados en el periodo
-            destinos_query = db.query(models.Prospecto.destino).filter(
-                models.Prospecto.fecha_registro >= fecha_inicio_dt,
-                models.Prospecto.fecha_registro <= fecha_fin_dt,
-                models.Prospecto.destino.isnot(None),
-                models.Prospecto.destino != ''
-            ).distinct().all()
-            destinos_count = len(destinos_query)
-            print(f"🌍 Destinos registrados: {destinos_count}")
-            
-            # Ventas registradas en el periodo
-            ventas_count = db.query(models.Prospecto).filter(
-                models.Prospecto.estado == EstadoProspecto.GANADO.value,
-                models.Prospecto.fecha_registro >= fecha_inicio_dt,
-                models.Prospecto.fecha_registro <= fecha_fin_dt
-            ).count()
-            print(f"💰 Ventas: {ventas_count}")
-            
-            # Destinos más solicitados en el periodo
-            destinos_populares = db.query(
-                models.Prospecto.destino,
-                func.count(models.Prospecto.id).label('count')
-            ).filter(
-                models.Prospecto.fecha_registro >= fecha_inicio_dt,
-                models.Prospecto.fecha_registro <= fecha_fin_dt,
-                models.Prospecto.destino.isnot(None),
-                models.Prospecto.destino != ''
-            ).group_by(models.Prospecto.destino).order_by(func.count(models.Prospecto.id).desc()).limit(5).all()
-            print(f"🏆 Destinos populares: {len(destinos_populares)}")
-            
-            # Estadísticas por estado en el periodo
-            prospectos_nuevos = db.query(models.Prospecto).filter(
-                models.Prospecto.estado == EstadoProspecto.NUEVO.value,
-                models.Prospecto.fecha_registro >= fecha_inicio_dt,
-                models.Prospecto.fecha_registro <= fecha_fin_dt
-            ).count()
-            prospectos_seguimiento = db.query(models.HistorialEstado).filter(
-                models.HistorialEstado.estado_nuevo == EstadoProspecto.EN_SEGUIMIENTO.value,
-                models.HistorialEstado.fecha_cambio >= fecha_inicio_dt,
-                models.HistorialEstado.fecha_cambio <= fecha_fin_dt
-            ).count()
-            
-            prospectos_cotizados = db.query(models.EstadisticaCotizacion).filter(
-                models.EstadisticaCotizacion.fecha_cotizacion >= fecha_inicio_obj,
-                models.EstadisticaCotizacion.fecha_cotizacion <= fecha_fin_obj
-            ).count()
-            
-            prospectos_ganados = db.query(models.HistorialEstado).filter(
-                models.HistorialEstado.estado_nuevo == EstadoProspecto.GANADO.value,
-                models.HistorialEstado.fecha_cambio >= fecha_inicio_dt,
-                models.HistorialEstado.fecha_cambio <= fecha_fin_dt
-            ).count()
-            
-            prospectos_perdidos = db.query(models.HistorialEstado).filter(
-                models.HistorialEstado.estado_nuevo == EstadoProspecto.CERRADO_PERDIDO.value,
-                models.HistorialEstado.fecha_cambio >= fecha_inicio_dt,
-                models.HistorialEstado.fecha_cambio <= fecha_fin_dt
-            ).count()
-            
-            print(f"📊 Estados - Nuevos: {prospectos_nuevos}, Seguimiento: {prospectos_seguimiento}, Cotizados: {prospectos_cotizados}, Ganados: {prospectos_ganados}, Perdidos: {prospectos_perdidos}")
-            
-            # Conversión por agente en el periodo
-            conversion_agentes = []
-            agentes_con_prospectos = db.query(
-                models.Usuario.id,
-                models.Usuario.username
-            ).filter(
-                models.Usuario.tipo_usuario == TipoUsuario.AGENTE.value
-            ).all()
-            
-            for agente in agentes_con_prospectos:
-                total_agente = db.query(models.Prospecto).filter(
-                    models.Prospecto.agente_asignado_id == agente.id,
-                    models.Prospecto.fecha_registro >= fecha_inicio_dt,
-                    models.Prospecto.fecha_registro <= fecha_fin_dt
-                ).count()
-                
-                ganados_agente = db.query(models.HistorialEstado).filter(
-                    models.HistorialEstado.usuario_id == agente.id,
-                    models.HistorialEstado.estado_nuevo == EstadoProspecto.GANADO.value,
-                    models.HistorialEstado.fecha_cambio >= fecha_inicio_dt,
-                    models.HistorialEstado.fecha_cambio <= fecha_fin_dt
-                ).count()
-                
-                cotizados_agente = db.query(models.EstadisticaCotizacion).filter(
-                    models.EstadisticaCotizacion.agente_id == agente.id,
-                    models.EstadisticaCotizacion.fecha_cotizacion >= fecha_inicio_obj,
-                    models.EstadisticaCotizacion.fecha_cotizacion <= fecha_fin_obj
-                ).count()
-
-                conversion_agentes.append({
-                    'id': agente.id,
-                    'username': agente.username,
-                    'total_prospectos': total_agente,
-                    'cotizados': cotizados_agente,
-                    'ganados': ganados_agente
-                })
-            
-            print(f"👥 Conversión agentes: {len(conversion_agentes)} agentes")
-            
+            stats = estadisticas.calcular_estadisticas_dashboard(db, fecha_inicio_obj, fecha_fin_obj)
         else:
             print("👤 Usuario es Agente - mostrando estadísticas personales")
-            
-            # Estadísticas para agente (solo sus datos) en el periodo
-            total_prospectos = db.query(models.Prospecto).filter(
-                models.Prospecto.agente_asignado_id == user.id,
-                models.Prospecto.fecha_registro >= fecha_inicio_dt,
-                models.Prospecto.fecha_registro <= fecha_fin_dt
-            ).count()
-            print(f"📈 Total prospectos agente: {total_prospectos}")
-            
-            # ✅ AGREGADO: Prospectos con datos completos para agente
-            prospectos_con_datos = db.query(models.Prospecto).filter(
-                models.Prospecto.agente_asignado_id == user.id,
-                models.Prospecto.tiene_datos_completos == True,
-                models.Prospecto.fecha_registro >= fecha_inicio_dt,
-                models.Prospecto.fecha_registro <= fecha_fin_dt
-            ).count()
-            print(f"📝 Prospectos con datos agente: {prospectos_con_datos}")
-            
-            # ✅ AGREGADO: Prospectos sin datos para agente
-            prospectos_sin_datos = db.query(models.Prospecto).filter(
-                models.Prospecto.agente_asignado_id == user.id,
-                models.Prospecto.tiene_datos_completos == False,
-                models.Prospecto.fecha_registro >= fecha_inicio_dt,
-                models.Prospecto.fecha_registro <= fecha_fin_dt
-            ).count()
-            print(f"📱 Prospectos sin datos agente: {prospectos_sin_datos}")
-            
-            # Clientes asignados al agente en el periodo
-            clientes_asignados = db.query(models.Prospecto).filter(
-                models.Prospecto.agente_asignado_id == user.id,
-                models.Prospecto.fecha_registro >= fecha_inicio_dt,
-                models.Prospecto.fecha_registro <= fecha_fin_dt
-            ).count()
-            print(f"📅 Clientes asignados agente: {clientes_asignados}")
-            
-            # Destinos registrados por el agente en el periodo
-            destinos_query = db.query(models.Prospecto.destino).filter(
-                models.Prospecto.agente_asignado_id == user.id,
-                models.Prospecto.fecha_registro >= fecha_inicio_dt,
-                models.Prospecto.fecha_registro <= fecha_fin_dt,
-                models.Prospecto.destino.isnot(None),
-                models.Prospecto.destino != ''
-            ).distinct().all()
-            destinos_count = len(destinos_query)
-            print(f"🌍 Destinos registrados agente: {destinos_count}")
-            
-            # Ventas del agente en el periodo
-            # Ventas del agente en el periodo (Basado en historial de cambios)
-            ventas_count = db.query(models.HistorialEstado).filter(
-                models.HistorialEstado.usuario_id == user.id,
-                models.HistorialEstado.estado_nuevo == EstadoProspecto.GANADO.value,
-                models.HistorialEstado.fecha_cambio >= fecha_inicio_dt,
-                models.HistorialEstado.fecha_cambio <= fecha_fin_dt
-            ).count()
-            print(f"💰 Ventas agente: {ventas_count}")
-            
-            # Destinos más solicitados por el agente en el periodo
-            destinos_populares = db.query(
-                models.Prospecto.destino,
-                func.count(models.Prospecto.id).label('count')
-            ).filter(
-                models.Prospecto.agente_asignado_id == user.id,
-                models.Prospecto.fecha_registro >= fecha_inicio_dt,
-                models.Prospecto.fecha_registro <= fecha_fin_dt,
-                models.Prospecto.destino.isnot(None),
-                models.Prospecto.destino != ''
-            ).group_by(models.Prospecto.destino).order_by(func.count(models.Prospecto.id).desc()).limit(5).all()
-            print(f"🏆 Destinos populares agente: {len(destinos_populares)}")
-            
-            # Para agente, no mostrar estos datos generales
-            clientes_sin_asignar = 0
-            
-            # Estadísticas por estado para agente en el periodo
-            prospectos_nuevos = db.query(models.Prospecto).filter(
-                models.Prospecto.agente_asignado_id == user.id,
-                models.Prospecto.estado == EstadoProspecto.NUEVO.value,
-                models.Prospecto.fecha_registro >= fecha_inicio_dt,
-                models.Prospecto.fecha_registro <= fecha_fin_dt
-            ).count()
-            prospectos_seguimiento = db.query(models.HistorialEstado).filter(
-                models.HistorialEstado.usuario_id == user.id,
-                models.HistorialEstado.estado_nuevo == EstadoProspecto.EN_SEGUIMIENTO.value,
-                models.HistorialEstado.fecha_cambio >= fecha_inicio_dt,
-                models.HistorialEstado.fecha_cambio <= fecha_fin_dt
-            ).count()
-            
-            # Nota: Cotizados ya usa EstadisticaCotizacion (correcto)
-            prospectos_cotizados = db.query(models.EstadisticaCotizacion).filter(
-                models.EstadisticaCotizacion.agente_id == user.id,
-                models.EstadisticaCotizacion.fecha_cotizacion >= fecha_inicio_obj,
-                models.EstadisticaCotizacion.fecha_cotizacion <= fecha_fin_obj
-            ).count()
-            
-            prospectos_ganados = db.query(models.HistorialEstado).filter(
-                models.HistorialEstado.usuario_id == user.id,
-                models.HistorialEstado.estado_nuevo == EstadoProspecto.GANADO.value,
-                models.HistorialEstado.fecha_cambio >= fecha_inicio_dt,
-                models.HistorialEstado.fecha_cambio <= fecha_fin_dt
-            ).count()
-            
-            prospectos_perdidos = db.query(models.HistorialEstado).filter(
-                models.HistorialEstado.usuario_id == user.id,
-                models.HistorialEstado.estado_nuevo == EstadoProspecto.CERRADO_PERDIDO.value,
-                models.HistorialEstado.fecha_cambio >= fecha_inicio_dt,
-                models.HistorialEstado.fecha_cambio <= fecha_fin_dt
-            ).count()
-            
-            print(f"📊 Estados agente - Nuevos: {prospectos_nuevos}, Seguimiento: {prospectos_seguimiento}, Cotizados: {prospectos_cotizados}, Ganados: {prospectos_ganados}, Perdidos: {prospectos_perdidos}")
-            
-            conversion_agentes = []
+            stats = estadisticas.calcular_estadisticas_dashboard(db, fecha_inicio_obj, fecha_fin_obj, agente_id=user.id)
+        
+        print(f"📊 Estados - Nuevos: {stats.prospectos_nuevos}, Seguimiento: {stats.prospectos_seguimiento}, Cotizados: {stats.prospectos_cotizados}, Ganados: {stats.prospectos_ganados}, Perdidos: {stats.prospectos_perdidos}")
         
     except Exception as e:
         print(f"❌ Error grave calculando estadísticas: {e}")
         import traceback
         traceback.print_exc()
         # Inicializar todas las variables con valores por defecto
-        total_prospectos = prospectos_con_datos = prospectos_sin_datos = 0
-        clientes_sin_asignar = clientes_asignados = destinos_count = ventas_count = 0
-        prospectos_nuevos = prospectos_seguimiento = prospectos_cotizados = prospectos_ganados = prospectos_perdidos = 0
-        destinos_populares = []
-        conversion_agentes = []
+        stats = estadisticas.EstadisticasDashboard()
         fecha_inicio_obj = date.today()
         fecha_fin_obj = date.today()
     
@@ -511,25 +341,8 @@ async def dashboard(
         "fecha_inicio_formateada": fecha_inicio_obj.strftime("%d/%m/%Y") if fecha_inicio_obj else "",
         "fecha_fin_formateada": fecha_fin_obj.strftime("%d/%m/%Y") if fecha_fin_obj else "",
         
-        # Estadísticas principales
-        "total_prospectos": total_prospectos,
-        "prospectos_con_datos": prospectos_con_datos,
-        "prospectos_sin_datos": prospectos_sin_datos,
-        "clientes_sin_asignar": clientes_sin_asignar,
-        "clientes_asignados": clientes_asignados,
-        "destinos_count": destinos_count,
-        "ventas_count": ventas_count,
-        
-        # Estadísticas por estado
-        "prospectos_nuevos": prospectos_nuevos,
-        "prospectos_seguimiento": prospectos_seguimiento,
-        "prospectos_cotizados": prospectos_cotizados,
-        "prospectos_ganados": prospectos_ganados,
-        "prospectos_perdidos": prospectos_perdidos,
-        
-        # Datos para gráficos
-        "destinos_populares": destinos_populares,
-        "conversion_agentes": conversion_agentes
+        # Estadísticas principales, por estado y datos para gráficos
+        **stats.como_contexto()
     })
 
 def calcular_rango_fechas(periodo: str, fecha_inicio: str = None, fecha_fin: str = None):
@@ -581,7 +394,7 @@ def calcular_rango_fechas(periodo: str, fecha_inicio: str = None, fecha_fin: str
 # ========== GESTIÓN DE PROSPECTOS (ACTUALIZADO) ==========
 
 @app.get("/prospectos", response_class=HTMLResponse)
-async def listar_prospectos(
+def listar_prospectos(
     request: Request,
     destino: str = Query(None),
     telefono: str = Query(None),
@@ -591,20 +404,24 @@ async def listar_prospectos(
     busqueda_global: str = Query(None),
     page: int = Query(1, ge=1),  # ✅ Paginación: Página actual
     limit: int = Query(10, ge=1, le=100),  # ✅ Paginación: Registros por página
+    cursor: str = Query(None),  # ✅ Paginación por cursor: token de la página siguiente/anterior
     db: Session = Depends(database.get_db)
 ):
-    user = await get_current_user(request, db)
+    user = get_current_user(request, db)
     
     if not user:
         return RedirectResponse(url="/", status_code=303)
     
     # ✅ CONSTRUIR QUERY BASE SEGÚN ROL (SIN FILTRO DE ESTADO INICIAL)
+    # Se cargan junto con la página las relaciones que usa la plantilla (agente y medio)
+    query = db.query(models.Prospecto).options(
+        joinedload(models.Prospecto.agente_asignado),
+        joinedload(models.Prospecto.medio_ingreso)
+    )
     if user.tipo_usuario == TipoUsuario.AGENTE.value:
-        query = db.query(models.Prospecto).filter(
+        query = query.filter(
             models.Prospecto.agente_asignado_id == user.id
         )
-    else:
-        query = db.query(models.Prospecto)
     
     # ✅ LÓGICA DE FILTROS POR DEFECTO Y EXPLÍCITOS
     filtros_aplicados = False
@@ -646,21 +463,10 @@ async def listar_prospectos(
             estado = EstadoProspecto.NUEVO.value
             agente_asignado_id = "sin_asignar"
 
-    # ✅ FILTRO DE BÚSQUEDA GLOBAL
+    # ✅ FILTRO DE BÚSQUEDA GLOBAL (índice de texto completo, resultados por relevancia)
+    rank_busqueda = None
     if busqueda_global:
-        search_term = f"%{busqueda_global}%"
-        query = query.filter(
-            or_(
-                models.Prospecto.nombre.ilike(search_term),
-                models.Prospecto.apellido.ilike(search_term),
-                models.Prospecto.telefono.ilike(search_term),
-                models.Prospecto.telefono_secundario.ilike(search_term),
-                models.Prospecto.correo_electronico.ilike(search_term),
-                models.Prospecto.destino.ilike(search_term),
-                models.Prospecto.ciudad_origen.ilike(search_term),
-                models.Prospecto.observaciones.ilike(search_term)
-            )
-        )
+        query, rank_busqueda = indice_busqueda.aplicar_busqueda(query, busqueda_global)
         print(f"🔍 Aplicando búsqueda global: {busqueda_global}")
     
     # ✅ FILTRO POR TELÉFONO
@@ -680,20 +486,25 @@ async def listar_prospectos(
     if medio_ingreso_id and medio_ingreso_id != "todos":
         query = query.filter(models.Prospecto.medio_ingreso_id == int(medio_ingreso_id))
     
-    # ✅ ORDENAMIENTO: Del más nuevo al más antiguo
-    # Se ordena después de todos los filtros y antes de la paginación
-    query = query.order_by(models.Prospecto.fecha_registro.desc())
-    
-    # ✅ PAGINACIÓN
-    total_registros = query.count()
+    # ✅ PAGINACIÓN: total aproximado (cacheado) y páginas por cursor sobre (fecha_registro, id)
+    total_registros = paginacion.contar_aproximado(query)
     total_pages = (total_registros + limit - 1) // limit
     
-    # Asegurar que la página solicitada sea válida
-    if page > total_pages and total_pages > 0:
-        page = total_pages
-    
-    offset = (page - 1) * limit
-    prospectos = query.offset(offset).limit(limit).all()
+    cursor_siguiente = cursor_anterior = None
+    modo_cursor = rank_busqueda is None and (bool(cursor) or page == 1)
+    if modo_cursor:
+        pagina_cursor = paginacion.paginar_por_cursor(query, limit, cursor)
+        prospectos = pagina_cursor.elementos
+        cursor_siguiente = pagina_cursor.cursor_siguiente
+        cursor_anterior = pagina_cursor.cursor_anterior
+    else:
+        # Búsqueda por relevancia o salto directo a una página: OFFSET clásico
+        if page > total_pages and total_pages > 0:
+            page = total_pages
+        if rank_busqueda is not None:
+            query = query.order_by(rank_busqueda)
+        query = query.order_by(models.Prospecto.fecha_registro.desc(), models.Prospecto.id.desc())
+        prospectos = query.offset((page - 1) * limit).limit(limit).all()
     
     # Obtener datos para filtros
     agentes = db.query(models.Usuario).filter(
@@ -721,11 +532,14 @@ async def listar_prospectos(
         "page": page,
         "limit": limit,
         "total_pages": total_pages,
-        "total_registros": total_registros
+        "total_registros": total_registros,
+        "modo_cursor": modo_cursor,
+        "cursor_siguiente": cursor_siguiente,
+        "cursor_anterior": cursor_anterior
     })
 
 @app.post("/prospectos")
-async def crear_prospecto(
+def crear_prospecto(
     request: Request,
     telefono: str = Form(...),
     indicativo_telefono: str = Form("57"),
@@ -747,7 +561,7 @@ async def crear_prospecto(
     agente_asignado_id: int = Form(None),
     db: Session = Depends(database.get_db)
 ):
-    user = await get_current_user(request, db)
+    user = get_current_user(request, db)
     if not user:
         return RedirectResponse(url="/", status_code=303)
     
@@ -760,42 +574,22 @@ async def crear_prospecto(
             return RedirectResponse(url="/prospectos?error=Indicativo secundario inválido. Solo números, máximo 4 dígitos", status_code=303)
 
         # ✅ DETECCIÓN MEJORADA: OBTENER TODOS LOS REGISTROS DEL CLIENTE
-        # Buscar por teléfono principal
-        clientes_existentes_principal = db.query(models.Prospecto).filter(
-            or_(
-                models.Prospecto.telefono == telefono,
-                models.Prospecto.telefono_secundario == telefono
-            )
-        ).all()
-
-        # Buscar por teléfono secundario (si existe)
-        clientes_existentes_secundario = []
-        if telefono_secundario:
-            clientes_existentes_secundario = db.query(models.Prospecto).filter(
+        # Una sola búsqueda indexada por teléfono normalizado (principal o secundario),
+        # sin importar espacios, guiones o si se escribió el indicativo
+        claves_telefono = {
+            clave for clave in [
+                models.normalizar_telefono(telefono, indicativo_telefono),
+                models.normalizar_telefono(telefono_secundario, indicativo_telefono_secundario)
+            ] if clave
+        }
+        todos_clientes_existentes = []
+        if claves_telefono:
+            todos_clientes_existentes = db.query(models.Prospecto).filter(
                 or_(
-                    models.Prospecto.telefono == telefono_secundario,
-                    models.Prospecto.telefono_secundario == telefono_secundario
+                    models.Prospecto.telefono_normalizado.in_(claves_telefono),
+                    models.Prospecto.telefono_secundario_normalizado.in_(claves_telefono)
                 )
-            ).all()
-
-        # Combinar resultados únicos
-        clientes_existentes_set = set()
-        todos_clientes_existentes = []
-
-        # Agregar de principal
-        for cliente in clientes_existentes_principal:
-            if cliente.id not in clientes_existentes_set:
-                clientes_existentes_set.add(cliente.id)
-                todos_clientes_existentes.append(cliente)
-
-        # Agregar de secundario
-        for cliente in clientes_existentes_secundario:
-            if cliente.id not in clientes_existentes_set:
-                clientes_existentes_set.add(cliente.id)
-                todos_clientes_existentes.append(cliente)
-
-        # ✅ ORDENAR POR fecha_registro (nombre correcto en tu modelo)
-        todos_clientes_existentes.sort(key=lambda x: x.fecha_registro, reverse=True)
+            ).order_by(models.Prospecto.fecha_registro.desc()).all()
 
         # Usar el más reciente como "cliente principal" para compatibilidad
         cliente_existente_principal = todos_clientes_existentes[0] if todos_clientes_existentes else None
@@ -927,12 +721,8 @@ async def crear_prospecto(
         # ✅ VERIFICAR Y ASIGNAR DATOS COMPLETOS
         prospecto.verificar_datos_completos()
         
+        # ✅ El ID de cliente único (CL-...) se asigna en el mismo INSERT
         db.add(prospecto)
-        db.flush()  # Para obtener el ID antes del commit
-        
-        # ✅ GENERAR ID DE CLIENTE ÚNICO
-        prospecto.generar_id_cliente()
-        
         db.commit()
         
         # Registrar interacción automática si es recurrente
@@ -958,13 +748,45 @@ async def crear_prospecto(
 
 
 
+# ✅ IMPORTACIÓN MASIVA DE PROSPECTOS (CSV/XLSX)
+@app.post("/api/prospectos/importar")
+def importar_prospectos_archivo(
+    request: Request,
+    archivo: UploadFile = File(...),
+    medio_ingreso: str = Form(None),  # Medio para las filas sin columna 'medio' (REDES, TEL TRAVEL...)
+    agente_asignado_id: int = Form(None),  # Agente para las filas sin columna 'agente'
+    solo_validar: bool = Form(False),
+    db: Session = Depends(database.get_db)
+):
+    user = get_current_user(request, db)
+    if not user:
+        raise HTTPException(status_code=401, detail="No autenticado")
+    
+    nombre_archivo = archivo.filename or ""
+    if not nombre_archivo.lower().endswith((".csv", ".xlsx", ".xlsm")):
+        raise HTTPException(status_code=400, detail="Formato no soportado: use CSV o XLSX")
+    
+    contexto = importacion.crear_contexto(db, user, medio_ingreso, agente_asignado_id)
+    try:
+        inicio = datetime.now()
+        resultado = importacion.importar_prospectos(db, archivo.file, nombre_archivo, contexto, solo_validar)
+        segundos = (datetime.now() - inicio).total_seconds()
+    except Exception as e:
+        print(f"❌ Error importando prospectos: {e}")
+        return JSONResponse(status_code=400, content={"status": "error", "message": str(e)})
+    
+    print(f"📥 Importación de {nombre_archivo} por {user.username}: {resultado.total} filas en {segundos:.1f} s, "
+          f"{resultado.creados} creadas, {resultado.con_errores} con errores")
+    return {"status": "ok", **resultado.resumen(), "filas": resultado.filas}
+
+
 @app.get("/prospectos/{prospecto_id}/editar")
-async def mostrar_editar_prospecto(
+def mostrar_editar_prospecto(
     request: Request,
     prospecto_id: int,
     db: Session = Depends(database.get_db)
 ):
-    user = await get_current_user(request, db)
+    user = get_current_user(request, db)
     if not user:
         return RedirectResponse(url="/", status_code=303)
     
@@ -990,7 +812,7 @@ async def mostrar_editar_prospecto(
 
 
 @app.post("/prospectos/{prospecto_id}/editar")
-async def editar_prospecto(
+def editar_prospecto(
     request: Request,
     prospecto_id: int,
     telefono: str = Form(...),
@@ -1011,7 +833,7 @@ async def editar_prospecto(
     indicativo_telefono_secundario: str = Form("57"),  # ✅ CORREGIDO: "57" sin +
     db: Session = Depends(database.get_db)
 ):
-    user = await get_current_user(request, db)
+    user = get_current_user(request, db)
     if not user:
         return RedirectResponse(url="/", status_code=303)
     
@@ -1065,12 +887,12 @@ async def editar_prospecto(
         return RedirectResponse(url="/prospectos?error=Error al actualizar prospecto", status_code=303)
 
 @app.post("/prospectos/{prospecto_id}/eliminar")
-async def eliminar_prospecto(
+def eliminar_prospecto(
     request: Request,
     prospecto_id: int,
     db: Session = Depends(database.get_db)
 ):
-    user = await get_current_user(request, db)
+    user = get_current_user(request, db)
     if not user:
         return RedirectResponse(url="/", status_code=303)
     
@@ -1097,7 +919,7 @@ async def eliminar_prospecto(
         return RedirectResponse(url="/prospectos?error=Error al eliminar prospecto", status_code=303)
 
 @app.post("/prospectos/{prospecto_id}/asignar")
-async def asignar_agente(
+def asignar_agente(
     request: Request,
     prospecto_id: int,
     agente_id: int = Form(None),  # ID del agente a asignar (0 para desasignar)
@@ -1117,7 +939,7 @@ async def asignar_agente(
     pagina: str = Form("1"),  # Para mantener paginación
     db: Session = Depends(database.get_db)
 ):
-    user = await get_current_user(request, db)
+    user = get_current_user(request, db)
     if not user or user.tipo_usuario not in [TipoUsuario.ADMINISTRADOR.value, TipoUsuario.SUPERVISOR.value]:
         raise HTTPException(status_code=403, detail="No tiene permisos para esta acción")
     
@@ -1152,15 +974,22 @@ async def asignar_agente(
             )
             db.add(notificacion)
             
-            # ✅ ENVIAR EMAIL AL AGENTE
+            # ✅ ENVIAR EMAIL AL AGENTE (queda en la bandeja de salida, lo envía el planificador)
             if agente.email:
                 asunto = "Nuevo Prospecto Asignado 🚀"
                 cuerpo = f"Hola {agente.username},\n\nSe te ha asignado el prospecto {prospecto.nombre} {prospecto.apellido}.\n\nIngresa al sistema para gestionarlo."
-                enviado = enviar_notificacion_email(agente.email, asunto, cuerpo)
-                notificacion.email_enviado = enviado
+                correo.encolar_correo(db, agente.email, asunto, cuerpo, notificacion)
         
         db.commit()
         
+        # ✅ AVISAR EN VIVO al agente y a admins/supervisores (listados abiertos)
+        eventos.publicar("asignacion", {
+            "prospecto_id": prospecto.id,
+            "nombre": f"{prospecto.nombre or ''} {prospecto.apellido or ''}".strip(),
+            "agente_id": prospecto.agente_asignado_id
+        }, usuarios=[prospecto.agente_asignado_id] if prospecto.agente_asignado_id else None,
+           roles=[TipoUsuario.ADMINISTRADOR.value, TipoUsuario.SUPERVISOR.value])
+        
         # ✅ DETERMINAR A DÓNDE REDIRIGIR
         redirect_url = "/prospectos"  # Por defecto
         
@@ -1214,15 +1043,65 @@ async def asignar_agente(
         print(f"❌ Error asignando agente: {e}")
         return RedirectResponse(url="/prospectos?error=Error al asignar agente", status_code=303)
 
+# ✅ ASIGNACIÓN MASIVA (lista de ids o filtros del listado + estrategia de reparto)
+@app.post("/api/prospectos/asignar-masivo")
+def asignar_agentes_masivo(
+    request: Request,
+    prospecto_ids: List[int] = Form(None),  # Si se envían, se ignoran los filtros
+    estrategia: str = Form("round_robin"),  # round_robin, menos_cargado, ponderado
+    agentes_ids: List[int] = Form(None),  # Agentes entre los que repartir (por defecto todos los activos)
+    estado: str = Form(None),
+    agente_asignado_id: str = Form(None),  # "sin_asignar", "todos" o un id
+    medio_ingreso_id: str = Form(None),
+    destino: str = Form(None),
+    busqueda_global: str = Form(None),
+    limite: int = Form(None),
+    simular: bool = Form(False),  # Solo calcula el reparto, no escribe nada
+    db: Session = Depends(database.get_db)
+):
+    user = get_current_user(request, db)
+    if not user or user.tipo_usuario not in [TipoUsuario.ADMINISTRADOR.value, TipoUsuario.SUPERVISOR.value]:
+        raise HTTPException(status_code=403, detail="No tiene permisos para esta acción")
+    
+    try:
+        agentes = asignacion.agentes_disponibles(db, agentes_ids)
+        prospectos = asignacion.consultar_prospectos(
+            db, prospecto_ids, estado, agente_asignado_id, medio_ingreso_id, destino, busqueda_global, limite
+        )
+        resultado, notificaciones = asignacion.asignar_en_bloque(db, prospectos, agentes, estrategia, simular)
+    except ValueError as e:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    if simular or not resultado["asignados"]:
+        return {"status": "ok", "simulado": simular, **resultado}
+    
+    try:
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"❌ Error en la asignación masiva: {e}")
+        raise HTTPException(status_code=500, detail="Error al asignar los prospectos")
+    
+    # ✅ AVISAR EN VIVO: cada agente recibe sus notificaciones; admins/supervisores, un resumen
+    eventos.publicar_notificaciones(notificaciones)
+    eventos.publicar("asignacion_masiva", {
+        "asignados": resultado["asignados"],
+        "agentes": sum(1 for a in resultado["por_agente"] if a["asignados"])
+    }, roles=[TipoUsuario.ADMINISTRADOR.value, TipoUsuario.SUPERVISOR.value])
+    
+    print(f"✅ Asignación masiva ({estrategia}) por {user.username}: {resultado['asignados']} prospectos")
+    return {"status": "ok", "simulado": False, **resultado}
+
 # ========== GESTIÓN DE INTERACCIONES ==========
 
 @app.get("/prospectos/{prospecto_id}/seguimiento")
-async def ver_seguimiento(
+def ver_seguimiento(
     request: Request,
     prospecto_id: int,
     db: Session = Depends(database.get_db)
 ):
-    user = await get_current_user(request, db)
+    user = get_current_user(request, db)
     if not user:
         return RedirectResponse(url="/", status_code=303)
     
@@ -1243,7 +1122,7 @@ async def ver_seguimiento(
     })
 
 @app.post("/prospectos/{prospecto_id}/interaccion")
-async def registrar_interaccion(
+def registrar_interaccion(
     request: Request,
     prospecto_id: int,
     descripcion: str = Form(...),
@@ -1252,7 +1131,7 @@ async def registrar_interaccion(
     fecha_proximo_contacto: str = Form(None),
     db: Session = Depends(database.get_db)
 ):
-    user = await get_current_user(request, db)
+    user = get_current_user(request, db)
     if not user:
         return RedirectResponse(url="/", status_code=303)
     
@@ -1338,10 +1217,12 @@ async def registrar_interaccion(
                 
                 # Feedback visual en el log/email
                 if user.email:
-                    enviar_notificacion_email(
+                    correo.encolar_correo(
+                        db,
                         user.email, 
                         "Recordatorio Programado 📅", 
-                        f"Has programado un seguimiento para el prospecto {prospecto.nombre} el {fecha_prog}."
+                        f"Has programado un seguimiento para el prospecto {prospecto.nombre} el {fecha_prog}.",
+                        notificacion
                     )
             except ValueError:
                 print(f"❌ Error formato fecha recordatorio: {fecha_proximo_contacto}")
@@ -1365,11 +1246,7 @@ async def registrar_interaccion(
                     prospecto_id=prospecto_id,
                     fecha_cotizacion=datetime.now().date()
                 )
-                db.add(estadistica)
-                
-                # ✅ GENERAR ID DE COTIZACIÓN ÚNICO
-                db.flush()
-                estadistica.generar_id_cotizacion()
+                db.add(estadistica)  # El ID de cotización (COT-...) se asigna al insertarla
         
         # Actualizar estado del prospecto si hay cambio
         if cambio_estado:
@@ -1394,15 +1271,16 @@ async def registrar_interaccion(
 # ========== GESTIÓN DE DOCUMENTOS ==========
 
 @app.post("/prospectos/{prospecto_id}/documento")
-async def subir_documento(
+def subir_documento(
     request: Request,
     prospecto_id: int,
+    background_tasks: BackgroundTasks,
     archivo: UploadFile = File(...),
     tipo_documento: str = Form("cotizacion"),
     descripcion: str = Form(None),
     db: Session = Depends(database.get_db)
 ):
-    user = await get_current_user(request, db)
+    user = get_current_user(request, db)
     if not user:
         return RedirectResponse(url="/", status_code=303)
     
@@ -1423,18 +1301,15 @@ async def subir_documento(
                 status_code=303
             )
         
-        # Crear directorio para el prospecto
-        prospecto_dir = os.path.join(UPLOAD_DIR, f"prospecto_{prospecto_id}")
-        os.makedirs(prospecto_dir, exist_ok=True)
-        
-        # Generar nombre único para el archivo
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        nombre_archivo = f"{timestamp}_{archivo.filename}"
-        ruta_archivo = os.path.join(prospecto_dir, nombre_archivo)
-        
-        # Guardar archivo
-        with open(ruta_archivo, "wb") as buffer:
-            shutil.copyfileobj(archivo.file, buffer)
+        # ✅ Guardar en el almacén por contenido: el mismo PDF se guarda una sola vez
+        # (por bloques, con SHA-256, tamaño máximo y renombrado atómico)
+        try:
+            ruta_archivo, hash_sha256, tamano_bytes = documentos.guardar_blob(db, archivo.file, archivo.filename)
+        except documentos.ArchivoDemasiadoGrande as e:
+            return RedirectResponse(
+                url=f"/prospectos/{prospecto_id}/seguimiento?error={e}",
+                status_code=303
+            )
         
         # ✅ REGISTRAR DOCUMENTO EN BD
         documento = models.Documento(
@@ -1443,14 +1318,12 @@ async def subir_documento(
             nombre_archivo=archivo.filename,
             tipo_documento=tipo_documento,
             ruta_archivo=ruta_archivo,
-            descripcion=descripcion
+            descripcion=descripcion,
+            hash_sha256=hash_sha256,
+            tamano_bytes=tamano_bytes
         )
         
-        db.add(documento)
-        db.flush()  # Para obtener el ID antes del commit
-        
-        # ✅ GENERAR ID DE DOCUMENTO ÚNICO
-        documento.generar_id_documento()
+        db.add(documento)  # El ID de documento (DOC-...) se asigna al insertarlo
         
         # ✅ CAMBIAR ESTADO A COTIZADO SI SE SUBE UNA COTIZACIÓN
         if tipo_documento == "cotizacion":
@@ -1472,11 +1345,7 @@ async def subir_documento(
                     prospecto_id=prospecto_id,
                     fecha_cotizacion=datetime.now().date()
                 )
-                db.add(estadistica)
-                db.flush()  # Para obtener el ID
-                
-                # ✅ GENERAR ID DE COTIZACIÓN ÚNICO
-                estadistica.generar_id_cotizacion()
+                db.add(estadistica)  # El ID de cotización (COT-...) se asigna al insertarla
             
             # Registrar interacción automática de cambio de estado
             interaccion = models.Interaccion(
@@ -1502,6 +1371,9 @@ async def subir_documento(
         
         db.commit()
         
+        # ✅ Texto, páginas y miniatura en segundo plano, después de enviar la respuesta
+        background_tasks.add_task(procesamiento_documentos.procesar_documento, documento.id)
+        
         return RedirectResponse(
             url=f"/prospectos/{prospecto_id}/seguimiento?success=Documento subido correctamente", 
             status_code=303
@@ -1513,20 +1385,213 @@ async def subir_documento(
         import traceback
         traceback.print_exc()
         return RedirectResponse(
-            url=f"/prospectos/{prospecto_id}/seguimiento?error=Error al subir documento", 
+            url=f"/prospectos/{prospecto_id}/seguimiento?error=Error al subir documento",
+            status_code=303
+        )
+
+def _documento_visible(request: Request, db: Session, documento_id: int) -> models.Documento:
+    """Documento si el usuario puede verlo (mismas reglas que al subir); si no, HTTPException"""
+    user = get_current_user(request, db)
+    if not user:
+        raise HTTPException(status_code=401, detail="No autenticado")
+
+    documento = db.query(models.Documento).options(joinedload(models.Documento.prospecto)).filter(
+        models.Documento.id == documento_id
+    ).first()
+    if not documento:
+        raise HTTPException(status_code=404, detail="Documento no encontrado")
+
+    if (user.tipo_usuario == TipoUsuario.AGENTE.value and
+        (not documento.prospecto or documento.prospecto.agente_asignado_id != user.id)):
+        raise HTTPException(status_code=403, detail="No tiene permisos para este documento")
+    return documento
+
+def _etag_coincide(request: Request, etag: str) -> bool:
+    """If-None-Match con el ETag actual (comparación débil): se responde 304"""
+    si_no_coincide = request.headers.get("if-none-match")
+    return bool(si_no_coincide) and (si_no_coincide.strip() == "*" or etag.removeprefix("W/") in
+                                     [e.strip().removeprefix("W/") for e in si_no_coincide.split(",")])
+
+def _leer_almacen(almacen, clave: str, inicio: Optional[int] = None, fin: Optional[int] = None):
+    """Abre el contenido antes de responder: si falta el archivo, 404 en vez de un 200 vacío"""
+    try:
+        return almacen.leer(clave, inicio, fin)
+    except FileNotFoundError:
+        print(f"⚠️ Archivo no encontrado en el almacenamiento: {clave}")
+        raise HTTPException(status_code=404, detail="Archivo no disponible")
+
+@app.get("/documentos/{documento_id}/descargar")
+def descargar_documento(
+    request: Request,
+    documento_id: int,
+    db: Session = Depends(database.get_db)
+):
+    documento = _documento_visible(request, db, documento_id)
+    contenido = documentos.contenido_documento(documento)
+    if not contenido:
+        raise HTTPException(status_code=404, detail="Archivo no disponible")
+    almacen, clave, tamano, etag = contenido
+
+    # ✅ ETag = SHA-256 del contenido: el navegador revalida (permisos incluidos) y recibe 304 sin el cuerpo
+    cabeceras = {
+        "ETag": etag,
+        "Cache-Control": "private, no-cache",
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": f"inline; filename*=UTF-8''{quote(documento.nombre_archivo or 'documento')}"
+    }
+    if _etag_coincide(request, etag):
+        return Response(status_code=304, headers=cabeceras)
+
+    tipo = mimetypes.guess_type(documento.nombre_archivo or "")[0] or "application/octet-stream"
+
+    # ✅ Peticiones Range (visor de PDF, descargas reanudadas): solo se lee el tramo pedido
+    rango = request.headers.get("range")
+    si_rango = request.headers.get("if-range")
+    if rango and (not si_rango or (si_rango == etag and not etag.startswith("W/"))):
+        try:
+            tramo = documentos.rango_solicitado(rango, tamano)
+        except ValueError:
+            return Response(status_code=416, headers={"Content-Range": f"bytes */{tamano}"})
+        if tramo:
+            inicio, fin = tramo
+            cabeceras["Content-Range"] = f"bytes {inicio}-{fin}/{tamano}"
+            cabeceras["Content-Length"] = str(fin - inicio + 1)
+            cuerpo = _leer_almacen(almacen, clave, inicio, fin)
+            return StreamingResponse(cuerpo, status_code=206, media_type=tipo, headers=cabeceras)
+
+    cuerpo = _leer_almacen(almacen, clave)
+    cabeceras["Content-Length"] = str(tamano)
+    return StreamingResponse(cuerpo, media_type=tipo, headers=cabeceras)
+
+@app.get("/documentos/{documento_id}/miniatura")
+def miniatura_documento(
+    request: Request,
+    documento_id: int,
+    db: Session = Depends(database.get_db)
+):
+    documento = _documento_visible(request, db, documento_id)
+    if not documento.tiene_miniatura:
+        raise HTTPException(status_code=404, detail="Miniatura no disponible")
+
+    cabeceras = {"ETag": f'"m-{documento.hash_sha256}"', "Cache-Control": "private, no-cache"}
+    if _etag_coincide(request, cabeceras["ETag"]):
+        return Response(status_code=304, headers=cabeceras)
+    return StreamingResponse(
+        _leer_almacen(documentos.almacen, documentos.clave_miniatura(documento.hash_sha256)),
+        media_type="image/png", headers=cabeceras
+    )
+
+@app.get("/api/documentos/buscar")
+def buscar_documentos(
+    request: Request,
+    q: str = Query("", min_length=2),
+    limite: int = Query(20, le=100),
+    db: Session = Depends(database.get_db)
+):
+    """Documentos por nombre, descripción o texto del PDF, con el fragmento que coincide"""
+    user = get_current_user(request, db)
+    if not user:
+        raise HTTPException(status_code=401, detail="No autenticado")
+
+    es_agente = user.tipo_usuario == TipoUsuario.AGENTE.value
+    # Los agentes solo ven los de sus prospectos: se piden más coincidencias y se filtran
+    coincidencias = indice_busqueda.buscar_documentos(db, q, limite * 5 if es_agente else limite)
+    fragmentos = dict(coincidencias)
+    encontrados = {
+        d.id: d for d in db.query(models.Documento).options(joinedload(models.Documento.prospecto)).filter(
+            models.Documento.id.in_(fragmentos)
+        )
+    }
+    resultados = []
+    for documento_id, _ in coincidencias:
+        documento = encontrados.get(documento_id)
+        if not documento or (es_agente and (not documento.prospecto or documento.prospecto.agente_asignado_id != user.id)):
+            continue
+        prospecto = documento.prospecto
+        resultados.append({
+            "documento_id": documento.id,
+            "id_documento": documento.id_documento,
+            "nombre_archivo": documento.nombre_archivo,
+            "tipo_documento": documento.tipo_documento,
+            "paginas": documento.paginas,
+            "fragmento": fragmentos[documento_id],
+            "prospecto_id": documento.prospecto_id,
+            "prospecto": " ".join(p for p in (prospecto.nombre, prospecto.apellido) if p) if prospecto else None,
+            "url": f"/documentos/{documento.id}/descargar"
+        })
+        if len(resultados) >= limite:
+            break
+    return JSONResponse(content={"resultados": resultados})
+
+@app.post("/prospectos/{prospecto_id}/documento/{documento_id}/eliminar")
+def eliminar_documento(
+    request: Request,
+    prospecto_id: int,
+    documento_id: int,
+    db: Session = Depends(database.get_db)
+):
+    user = get_current_user(request, db)
+    if not user:
+        return RedirectResponse(url="/", status_code=303)
+
+    try:
+        documento = db.query(models.Documento).filter(
+            models.Documento.id == documento_id,
+            models.Documento.prospecto_id == prospecto_id
+        ).first()
+        if not documento:
+            return RedirectResponse(url=f"/prospectos/{prospecto_id}/seguimiento?error=Documento no encontrado", status_code=303)
+
+        # Verificar permisos (igual que al subir)
+        if (user.tipo_usuario == TipoUsuario.AGENTE.value and
+            documento.prospecto.agente_asignado_id != user.id):
+            return RedirectResponse(url="/prospectos?error=No tiene permisos para este prospecto", status_code=303)
+
+        # ✅ El archivo es compartido: se resta la referencia y se borra cuando nadie lo usa
+        documentos.quitar_referencia(db, documento.hash_sha256)
+        db.add(models.Interaccion(
+            prospecto_id=prospecto_id,
+            usuario_id=user.id,
+            tipo_interaccion="documento",
+            descripcion=f"Documento eliminado: {documento.nombre_archivo} ({documento.tipo_documento})",
+            estado_anterior=documento.prospecto.estado,
+            estado_nuevo=documento.prospecto.estado
+        ))
+        ruta_anterior = None if documento.hash_sha256 else documento.ruta_archivo
+        db.delete(documento)
+        db.commit()
+
+        if ruta_anterior:
+            # Documento anterior al almacén por contenido: su copia era propia
+            ruta = documentos.ruta_local(ruta_anterior)
+            if os.path.isfile(ruta):
+                os.remove(ruta)
+        else:
+            documentos.purgar_blobs(db)
+
+        return RedirectResponse(
+            url=f"/prospectos/{prospecto_id}/seguimiento?success=Documento eliminado correctamente",
+            status_code=303
+        )
+
+    except Exception as e:
+        db.rollback()
+        print(f"❌ Error eliminando documento: {e}")
+        return RedirectResponse(
+            url=f"/prospectos/{prospecto_id}/seguimiento?error=Error al eliminar documento",
             status_code=303
         )
 
 
 # ✅ NUEVO ENDPOINT: Búsqueda por ID
 @app.get("/busqueda_ids", response_class=HTMLResponse)
-async def buscar_por_id(
+def buscar_por_id(
     request: Request,
     tipo_id: str = Query("cliente"),  # cliente, cotizacion, documento
     valor_id: str = Query(None),
     db: Session = Depends(database.get_db)
 ):
-    user = await get_current_user(request, db)
+    user = get_current_user(request, db)
     if not user:
         return RedirectResponse(url="/", status_code=303)
     
@@ -1586,7 +1651,7 @@ async def buscar_por_id(
 # ========== GESTIÓN DE USUARIOS (SOLO ADMIN) ==========
 
 @app.get("/usuarios", response_class=HTMLResponse)
-async def listar_usuarios(
+def listar_usuarios(
     request: Request,
     db: Session = Depends(database.get_db),
     user: models.Usuario = Depends(require_admin)
@@ -1600,7 +1665,7 @@ async def listar_usuarios(
     })
 
 @app.post("/usuarios")
-async def crear_usuario(
+def crear_usuario(
     request: Request,
     username: str = Form(...),
     email: str = Form(...),
@@ -1637,7 +1702,7 @@ async def crear_usuario(
         return RedirectResponse(url="/usuarios?error=Error al crear usuario", status_code=303)
 
 @app.post("/usuarios/{usuario_id}/editar")
-async def editar_usuario(
+def editar_usuario(
     request: Request,
     usuario_id: int,
     username: str = Form(...),
@@ -1670,6 +1735,7 @@ async def editar_usuario(
             usuario.hashed_password = auth.get_password_hash(password)
         
         db.commit()
+        sesiones.invalidar_usuario(usuario_id)
         
         return RedirectResponse(url="/usuarios?success=Usuario actualizado correctamente", status_code=303)
     
@@ -1679,7 +1745,7 @@ async def editar_usuario(
         return RedirectResponse(url="/usuarios?error=Error al actualizar usuario", status_code=303)
 
 @app.post("/usuarios/{usuario_id}/eliminar")
-async def eliminar_usuario(
+def eliminar_usuario(
     request: Request,
     usuario_id: int,
     db: Session = Depends(database.get_db),
@@ -1694,6 +1760,8 @@ async def eliminar_usuario(
         if not usuario:
             return RedirectResponse(url="/usuarios?error=Usuario no encontrado", status_code=303)
         
+        # ✅ Sus sesiones primero (sesiones.usuario_id es FK; en "bd", misma transacción)
+        sesiones.cerrar_sesiones_usuario(usuario_id, db)
         db.delete(usuario)
         db.commit()
         
@@ -1707,7 +1775,7 @@ async def eliminar_usuario(
 # ========== HISTORIAL DE PROSPECTOS CERRADOS ==========
 
 @app.get("/prospectos/cerrados", response_class=HTMLResponse)
-async def listar_prospectos_cerrados(
+def listar_prospectos_cerrados(
     request: Request,
     fecha_registro_desde: str = Query(None),
     fecha_registro_hasta: str = Query(None),
@@ -1717,15 +1785,20 @@ async def listar_prospectos_cerrados(
     agente_asignado_id: str = Query(None),
     page: int = Query(1, ge=1),
     limit: int = Query(10, ge=1, le=100),
+    cursor: str = Query(None),
     db: Session = Depends(database.get_db)
 ):
-    user = await get_current_user(request, db)
+    user = get_current_user(request, db)
     
     if not user:
         return RedirectResponse(url="/", status_code=303)
     
     # Construir query para prospectos cerrados/ganados
-    query = db.query(models.Prospecto).filter(
+    # (la plantilla muestra el agente y la última interacción de cada fila)
+    query = db.query(models.Prospecto).options(
+        joinedload(models.Prospecto.agente_asignado),
+        selectinload(models.Prospecto.interacciones)
+    ).filter(
         models.Prospecto.estado.in_([EstadoProspecto.CERRADO_PERDIDO.value, EstadoProspecto.GANADO.value])
     )
     
@@ -1771,34 +1844,34 @@ async def listar_prospectos_cerrados(
         query = query.filter(models.Prospecto.id.in_(subquery))
     
     # Otros filtros
+    rank_busqueda = None
     if destino:
         # ✅ BÚSQUEDA GENERAL EN CERRADOS (Nombre, Email, Teléfono, Destino)
-        search_term = f"%{destino}%"
-        query = query.filter(or_(
-            models.Prospecto.destino.ilike(search_term),
-            models.Prospecto.nombre.ilike(search_term),
-            models.Prospecto.apellido.ilike(search_term),
-            models.Prospecto.correo_electronico.ilike(search_term),
-            models.Prospecto.telefono.ilike(search_term)
-        ))
+        query, rank_busqueda = indice_busqueda.aplicar_busqueda(
+            query, destino, ["destino", "nombre", "apellido", "correo_electronico", "telefonos"]
+        )
     
     if agente_asignado_id and agente_asignado_id != "todos" and user.tipo_usuario in [TipoUsuario.ADMINISTRADOR.value, TipoUsuario.SUPERVISOR.value]:
         query = query.filter(models.Prospecto.agente_asignado_id == int(agente_asignado_id))
     
-    # ✅ PAGINACIÓN
-    query = query.order_by(models.Prospecto.fecha_registro.desc())
-    
-    total_registros = query.count()
+    # ✅ PAGINACIÓN (por cursor salvo búsqueda por relevancia o salto directo a una página)
+    total_registros = paginacion.contar_aproximado(query)
     total_pages = (total_registros + limit - 1) // limit
     
-    # Asegurar que la página solicitada sea válida
-    if page > total_pages and total_pages > 0:
-        page = total_pages
-    if page < 1:
-        page = 1
-        
-    offset = (page - 1) * limit
-    prospectos_cerrados = query.offset(offset).limit(limit).all()
+    cursor_siguiente = cursor_anterior = None
+    modo_cursor = rank_busqueda is None and (bool(cursor) or page == 1)
+    if modo_cursor:
+        pagina_cursor = paginacion.paginar_por_cursor(query, limit, cursor)
+        prospectos_cerrados = pagina_cursor.elementos
+        cursor_siguiente = pagina_cursor.cursor_siguiente
+        cursor_anterior = pagina_cursor.cursor_anterior
+    else:
+        if page > total_pages and total_pages > 0:
+            page = total_pages
+        if rank_busqueda is not None:
+            query = query.order_by(rank_busqueda)
+        query = query.order_by(models.Prospecto.fecha_registro.desc(), models.Prospecto.id.desc())
+        prospectos_cerrados = query.offset((page - 1) * limit).limit(limit).all()
     
     # Obtener datos para filtros
     agentes = db.query(models.Usuario).filter(
@@ -1822,16 +1895,19 @@ async def listar_prospectos_cerrados(
         "page": page,
         "limit": limit,
         "total_pages": total_pages,
-        "total_registros": total_registros
+        "total_registros": total_registros,
+        "modo_cursor": modo_cursor,
+        "cursor_siguiente": cursor_siguiente,
+        "cursor_anterior": cursor_anterior
     })
 
 @app.post("/prospectos/{prospecto_id}/reactivar")
-async def reactivar_prospecto(
+def reactivar_prospecto(
     request: Request,
     prospecto_id: int,
     db: Session = Depends(database.get_db)
 ):
-    user = await get_current_user(request, db)
+    user = get_current_user(request, db)
     if not user:
         return RedirectResponse(url="/", status_code=303)
     
@@ -1872,63 +1948,45 @@ async def reactivar_prospecto(
 
 # Endpoint para verificar autenticación
 @app.get("/check-auth")
-async def check_auth(request: Request, db: Session = Depends(database.get_db)):
-    user = await get_current_user(request, db)
+def check_auth(request: Request, db: Session = Depends(database.get_db)):
+    user = get_current_user(request, db)
     if user:
         return {
             "authenticated": True, 
             "user": user.username,
             "user_type": user.tipo_usuario,
-            "active_sessions": len(active_sessions)
+            "active_sessions": sesiones.contar_sesiones(),
+            "live_connections": eventos.bus.contar()
         }
     else:
         return {
             "authenticated": False, 
-            "active_sessions": len(active_sessions)
+            "active_sessions": sesiones.contar_sesiones(),
+            "live_connections": eventos.bus.contar()
         }
 
 #Exportar a Excel
 @app.get("/prospectos/exportar/excel")
-async def exportar_prospectos_excel(
+def exportar_prospectos_excel(
     request: Request,
+    formato: str = Query("xlsx"),  # ✅ "xlsx" o "csv"
     db: Session = Depends(database.get_db),
     user: models.Usuario = Depends(get_current_user)
 ):
     try:
         # Obtener prospectos según permisos
-        if user.tipo_usuario == TipoUsuario.AGENTE.value:
-            prospectos = db.query(models.Prospecto).filter(
-                models.Prospecto.agente_asignado_id == user.id
-            ).all()
-        else:
-            prospectos = db.query(models.Prospecto).all()
-        
-        # Convertir a DataFrame
-        data = []
-        for p in prospectos:
-            data.append({
-                'ID': p.id,
-                'Nombre': f"{p.nombre or ''} {p.apellido or ''}",
-                'Email': p.correo_electronico or '',
-                'Teléfono': p.telefono or '',
-                'Destino': p.destino or '',
-                'Estado': p.estado,
-                'Agente': p.agente_asignado.username if p.agente_asignado else 'Sin asignar',
-                'Fecha Registro': p.fecha_registro.strftime('%d/%m/%Y'),
-                'Medio Ingreso': p.medio_ingreso.nombre
-            })
-        
-        df = pd.DataFrame(data)
-        
-        # Crear Excel en memoria
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, sheet_name='Prospectos', index=False)
-        
-        output.seek(0)
+        agente_id = user.id if user.tipo_usuario == TipoUsuario.AGENTE.value else None
+        
+        # ✅ Exportación por streaming: lectura por bloques y escritura incremental
+        if formato == "csv":
+            return StreamingResponse(
+                exportacion.generar_csv(agente_id),
+                media_type="text/csv",
+                headers={"Content-Disposition": "attachment; filename=prospectos.csv"}
+            )
         
         return StreamingResponse(
-            output,
+            exportacion.generar_excel(agente_id),
             media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
             headers={"Content-Disposition": "attachment; filename=prospectos.xlsx"}
         )
@@ -1938,39 +1996,42 @@ async def exportar_prospectos_excel(
 
 # ✅ PANEL DE HISTORIAL DE CLIENTE MEJORADO
 @app.get("/clientes/historial", response_class=HTMLResponse)
-async def historial_cliente(
+def historial_cliente(
     request: Request,
     busqueda: str = Query(None),
     telefono: str = Query(None),
+    indicativo: str = Query(None),  # ✅ Indicativo del teléfono (los enlaces lo envían; por defecto 57)
     fecha_busqueda: str = Query(None),
     db: Session = Depends(database.get_db)
 ):
-    user = await get_current_user(request, db)
+    user = get_current_user(request, db)
     if not user:
         return RedirectResponse(url="/", status_code=303)
     
     cliente_principal = None
     prospectos = []
     
-    query = db.query(models.Prospecto)
+    query = db.query(models.Prospecto).options(joinedload(models.Prospecto.agente_asignado))
     
     # ✅ LÓGICA DE BÚSQUEDA AVANZADA
     filtros = []
     
-    # 1. Búsqueda por término (Teléfono, Email, Nombre)
-    if busqueda:
-        term = f"%{busqueda}%"
-        filtros.append(or_(
-            models.Prospecto.telefono.ilike(term),
-            models.Prospecto.telefono_secundario.ilike(term),
-            models.Prospecto.correo_electronico.ilike(term),
-            models.Prospecto.nombre.ilike(term),
-            models.Prospecto.apellido.ilike(term)
-        ))
+    # 1. Búsqueda por término (Teléfono, Email, Nombre) con el índice de texto completo
+    rank_busqueda = None
+    busqueda_aplicada = bool(busqueda and indice_busqueda.construir_consulta_fts(busqueda))
+    if busqueda_aplicada:
+        # Sin FTS5 (PostgreSQL) filtra con ilike y no hay rank
+        query, rank_busqueda = indice_busqueda.aplicar_busqueda(
+            query, busqueda, ["telefonos", "correo_electronico", "nombre", "apellido"]
+        )
     
-    # 2. Búsqueda por teléfono específico (compatibilidad anterior)
+    # 2. Búsqueda por teléfono específico (compatibilidad anterior), por clave normalizada
+    #    con el indicativo del enlace y, como antes, por el texto exacto del teléfono
     if telefono:
+        clave_telefono = models.normalizar_telefono(telefono, indicativo or "57")
         filtros.append(or_(
+            models.Prospecto.telefono_normalizado == clave_telefono,
+            models.Prospecto.telefono_secundario_normalizado == clave_telefono,
             models.Prospecto.telefono == telefono,
             models.Prospecto.telefono_secundario == telefono
         ))
@@ -1989,8 +2050,11 @@ async def historial_cliente(
         except ValueError:
             pass
 
-    if filtros:
-        query = query.filter(and_(*filtros))
+    if filtros or busqueda_aplicada:
+        if filtros:
+            query = query.filter(and_(*filtros))
+        if rank_busqueda is not None:
+            query = query.order_by(rank_busqueda)
         prospectos = query.order_by(models.Prospecto.fecha_registro.desc()).all()
         
         if prospectos:
@@ -2008,7 +2072,7 @@ async def historial_cliente(
 
 # ✅ ACTUALIZAR INFORMACIÓN DE VIAJE
 @app.post("/prospectos/{prospecto_id}/actualizar-viaje")
-async def actualizar_viaje(
+def actualizar_viaje(
     request: Request,
     prospecto_id: int,
     nombre: str = Form(None),  
@@ -2027,7 +2091,7 @@ async def actualizar_viaje(
     telefono_secundario: str = Form(None),
     db: Session = Depends(database.get_db)
 ):
-    user = await get_current_user(request, db)
+    user = get_current_user(request, db)
     if not user:
         return RedirectResponse(url="/", status_code=303)
     
@@ -2096,7 +2160,7 @@ async def actualizar_viaje(
 
 # Endpoint de salud
 @app.get("/health")
-async def health_check(db: Session = Depends(database.get_db)):
+def health_check(db: Session = Depends(database.get_db)):
     try:
         user_count = db.query(models.Usuario).count()
         prospecto_count = db.query(models.Prospecto).count()
@@ -2105,7 +2169,8 @@ async def health_check(db: Session = Depends(database.get_db)):
             "database": "connected", 
             "users_count": user_count,
             "prospectos_count": prospecto_count,
-            "active_sessions": len(active_sessions)
+            "active_sessions": sesiones.contar_sesiones(),
+            "live_connections": eventos.bus.contar()
         }
     except Exception as e:
         return {
@@ -2116,7 +2181,7 @@ async def health_check(db: Session = Depends(database.get_db)):
 # ========== FILTROS DESDE DASHBOARD ==========
 # ✅ NUEVO: FILTRO POR DATOS COMPLETOS/SIN DATOS
 @app.get("/prospectos/filtro", response_class=HTMLResponse)
-async def prospectos_filtro_dashboard(
+def prospectos_filtro_dashboard(
     request: Request,
     tipo_filtro: str = Query(...),  # estado, asignacion, destino, ventas, datos, total
     valor_filtro: str = Query(...),  # valor del filtro
@@ -2124,17 +2189,17 @@ async def prospectos_filtro_dashboard(
     fecha_inicio: str = Query(None),
     fecha_fin: str = Query(None),
     periodo: str = Query("mes"),
-    pagina: int = Query(1),
+    pagina: int = Query(1, ge=1),
+    cursor: str = Query(None),  # ✅ Paginación por cursor para Anterior/Siguiente
     agente_asignado_id: str = Query(None), # ✅ Nuevo filtro por agente
     db: Session = Depends(database.get_db)
 ):
-    user = await get_current_user(request, db)
+    user = get_current_user(request, db)
     if not user:
         return RedirectResponse(url="/", status_code=303)
     
     # Configurar paginación
     registros_por_pagina = 50
-    offset = (pagina - 1) * registros_por_pagina
     
     # ✅ CALCULAR RANGO DE FECHAS (Ya devuelve datetimes con hora min/max)
     fecha_inicio_dt, fecha_fin_dt = calcular_rango_fechas(periodo, fecha_inicio, fecha_fin)
@@ -2235,9 +2300,38 @@ async def prospectos_filtro_dashboard(
     elif tipo_filtro == "total":
         titulo_filtro = "Todos los prospectos registrados"
     
+    # Cargar con la página las relaciones que usa la plantilla (agente y medio)
+    query = query.options(
+        joinedload(models.Prospecto.agente_asignado),
+        joinedload(models.Prospecto.medio_ingreso)
+    )
+    
     # Obtener total y prospectos paginados
-    total_prospectos = query.count()
-    prospectos = query.offset(offset).limit(registros_por_pagina).all()
+    # ✅ El total sale del resumen diario cuando el filtro lo permite (un solo agente como máximo)
+    agentes_filtro = set()
+    if user.tipo_usuario == TipoUsuario.AGENTE.value:
+        agentes_filtro.add(user.id)
+    if agente_asignado_id and agente_asignado_id != "todos" and agente_asignado_id.isdigit():
+        agentes_filtro.add(int(agente_asignado_id))
+    total_prospectos = None
+    if len(agentes_filtro) <= 1:
+        total_prospectos = estadisticas.contar_filtro_dashboard(
+            db, fecha_inicio_date, fecha_fin_date, tipo_filtro, valor_filtro,
+            agente_id=next(iter(agentes_filtro), None)
+        )
+    if total_prospectos is None:
+        total_prospectos = paginacion.contar_aproximado(query)
+    
+    cursor_siguiente = cursor_anterior = None
+    if cursor or pagina == 1:
+        pagina_cursor = paginacion.paginar_por_cursor(query, registros_por_pagina, cursor)
+        prospectos = pagina_cursor.elementos
+        cursor_siguiente = pagina_cursor.cursor_siguiente
+        cursor_anterior = pagina_cursor.cursor_anterior
+    else:
+        # Salto directo a un número de página
+        query = query.order_by(models.Prospecto.fecha_registro.desc(), models.Prospecto.id.desc())
+        prospectos = query.offset((pagina - 1) * registros_por_pagina).limit(registros_por_pagina).all()
     
     # Calcular total de páginas
     total_paginas = (total_prospectos + registros_por_pagina - 1) // registros_por_pagina
@@ -2262,6 +2356,8 @@ async def prospectos_filtro_dashboard(
         "total_paginas": total_paginas,
         "total_prospectos": total_prospectos,
         "registros_por_pagina": registros_por_pagina,
+        "cursor_siguiente": cursor_siguiente,
+        "cursor_anterior": cursor_anterior,
         # ✅ PASAR DATOS DE FECHA
         "fecha_inicio_activa": fecha_inicio,
         "fecha_fin_activa": fecha_fin,
@@ -2273,9 +2369,9 @@ async def prospectos_filtro_dashboard(
 
 # ✅ ENDPOINT PARA AUTOCOMPLETADO DE DESTINOS
 @app.get("/api/destinos/sugerencias")
-async def sugerencias_destinos(
+def sugerencias_destinos(
     q: str = Query("", min_length=2),
-    limit: int = Query(10),
+    limit: int = Query(10, ge=1, le=50),
     db: Session = Depends(database.get_db)
 ):
     """Devuelve sugerencias de destinos existentes"""
@@ -2283,23 +2379,9 @@ async def sugerencias_destinos(
         return JSONResponse(content={"sugerencias": []})
     
     try:
-        # Buscar destinos que contengan el texto (case-insensitive)
-        destinos = db.query(models.Prospecto.destino).filter(
-            models.Prospecto.destino.isnot(None),
-            models.Prospecto.destino != '',
-            models.Prospecto.destino.ilike(f"%{q}%")
-        ).distinct().limit(limit).all()
-        
-        # Extraer solo los strings
-        sugerencias = [destino[0] for destino in destinos if destino[0]]
-        
-        # Ordenar por relevancia (los que empiezan con la búsqueda primero)
-        sugerencias.sort(key=lambda x: 
-            0 if x.lower().startswith(q.lower()) else 
-            1 if q.lower() in x.lower() else 2
-        )
-        
-        return JSONResponse(content={"sugerencias": sugerencias[:limit]})
+        # ✅ Índice en memoria: prefijo/palabra/subcadena sin tildes, ordenado por popularidad
+        sugerencias = destinos.indice_destinos.sugerir(db, q, limit)
+        return JSONResponse(content={"sugerencias": sugerencias})
         
     except Exception as e:
         print(f"Error en sugerencias_destinos: {e}")
@@ -2307,7 +2389,7 @@ async def sugerencias_destinos(
 
 # ✅ ENDPOINT PARA NORMALIZAR DESTINOS EXISTENTES
 @app.post("/api/destinos/normalizar")
-async def normalizar_destinos(
+def normalizar_destinos(
     destino_original: str = Form(...),
     destino_normalizado: str = Form(...),
     aplicar_a_todos: bool = Form(False),
@@ -2367,7 +2449,7 @@ async def normalizar_destinos(
 # ========== ESTADÍSTICAS AVANZADAS ==========
 
 @app.get("/estadisticas/cotizaciones", response_class=HTMLResponse)
-async def estadisticas_cotizaciones(
+def estadisticas_cotizaciones(
     request: Request,
     periodo: str = Query("mes"),  # dia, semana, mes, año, personalizado
     fecha_inicio: str = Query(None),
@@ -2375,7 +2457,7 @@ async def estadisticas_cotizaciones(
     agente_id: str = Query(None),
     db: Session = Depends(database.get_db)
 ):
-    user = await get_current_user(request, db)
+    user = get_current_user(request, db)
     if not user:
         return RedirectResponse(url="/", status_code=303)
     
@@ -2405,7 +2487,7 @@ async def estadisticas_cotizaciones(
         
         # Agrupar por agente y fecha
         # ✅ CAMBIO: Obtener lista detallada de cotizaciones individualmente
-        estadisticas = query.add_columns(
+        cotizaciones = query.add_columns(
             models.Prospecto.id.label('prospecto_id'),
             models.Prospecto.nombre,
             models.Prospecto.apellido,
@@ -2417,23 +2499,12 @@ async def estadisticas_cotizaciones(
             models.Usuario.username
         ).all()
         
-        # Estadísticas resumidas por agente
-        resumen_agentes = db.query(
-            models.Usuario.id,
-            models.Usuario.username,
-            func.count(models.EstadisticaCotizacion.id).label('total')
-        ).join(
-            models.EstadisticaCotizacion, models.EstadisticaCotizacion.agente_id == models.Usuario.id
-        ).filter(
-            models.EstadisticaCotizacion.fecha_cotizacion >= fecha_inicio_obj,
-            models.EstadisticaCotizacion.fecha_cotizacion <= fecha_fin_obj
+        # Estadísticas resumidas por agente (desde el resumen diario)
+        resumen_agentes = estadisticas.resumen_cotizaciones_por_agente(
+            db, fecha_inicio_obj, fecha_fin_obj,
+            agente_id=user.id if user.tipo_usuario == TipoUsuario.AGENTE.value else None
         )
         
-        if user.tipo_usuario == TipoUsuario.AGENTE.value:
-            resumen_agentes = resumen_agentes.filter(models.EstadisticaCotizacion.agente_id == user.id)
-        
-        resumen_agentes = resumen_agentes.group_by(models.Usuario.username).all()
-        
         # Obtener lista de agentes para filtro
         agentes = db.query(models.Usuario).filter(
             models.Usuario.tipo_usuario == TipoUsuario.AGENTE.value
@@ -2442,7 +2513,7 @@ async def estadisticas_cotizaciones(
         return templates.TemplateResponse("estadisticas_cotizaciones.html", {
             "request": request,
             "current_user": user,
-            "estadisticas": estadisticas,
+            "estadisticas": cotizaciones,
             "resumen_agentes": resumen_agentes,
             "agentes": agentes,
             "periodo_activo": periodo,
@@ -2461,75 +2532,88 @@ async def estadisticas_cotizaciones(
 # ========== SISTEMA DE NOTIFICACIONES ==========
 
 def check_inactivity(db: Session):
-    """Verifica prospectos nuevos sin gestión por más de 4 horas"""
-    limite = datetime.now() - timedelta(hours=4)
-    
-    # Prospectos nuevos creados antes del limite
-    prospectos_inactivos = db.query(models.Prospecto).filter(
-        models.Prospecto.estado == EstadoProspecto.NUEVO.value,
-        models.Prospecto.fecha_registro <= limite
-    ).all()
-    
-    count = 0
-    for p in prospectos_inactivos:
-        # Verificar si ya tiene alerta de inactividad reciente (últimas 24h)
-        existe_alerta = db.query(models.Notificacion).filter(
-            models.Notificacion.prospecto_id == p.id,
-            models.Notificacion.tipo == "inactividad",
-            models.Notificacion.fecha_creacion >= datetime.now() - timedelta(hours=24)
-        ).first()
-        
-        if not existe_alerta:
-            # Buscar supervisor/admin para notificar (o al agente si está asignado, aunque nuevos suelen estar sin asignar)
-            # Si tiene agente, notificamos al agente. Si no, a todos los admins/supervisores.
-            destinatarios = []
-            if p.agente_asignado_id:
-                destinatarios.append(p.agente_asignado_id)
-            else:
-                # Notificar a admins/supervisores
-                admins = db.query(models.Usuario).filter(
-                    models.Usuario.tipo_usuario.in_([TipoUsuario.ADMINISTRADOR.value, TipoUsuario.SUPERVISOR.value])
-                ).all()
-                destinatarios = [u.id for u in admins]
-            
-            for uid in destinatarios:
-                notificacion = models.Notificacion(
-                    usuario_id=uid,
-                    prospecto_id=p.id,
-                    tipo="inactividad",
-                    mensaje=f"⚠️ Prospecto inactivo > 4h: {p.nombre} {p.apellido or ''}",
-                    email_enviado=False
-                )
-                db.add(notificacion)
-                count += 1
+    """Verifica prospectos nuevos sin gestión por más de 4 horas y devuelve los conteos"""
+    ahora = datetime.now()
+    limite = ahora - timedelta(hours=4)
+    P, N, U = models.Prospecto, models.Notificacion, models.Usuario
+    
+    # ✅ Prospectos nuevos vencidos sin alerta de inactividad en las últimas 24h
+    # (anti-join con NOT EXISTS, resuelto con el índice prospecto/tipo/fecha)
+    alerta_reciente = select(N.id).where(
+        N.prospecto_id == P.id,
+        N.tipo == "inactividad",
+        N.fecha_creacion >= ahora - timedelta(hours=24)
+    ).exists()
+    vencidos = and_(
+        P.estado == EstadoProspecto.NUEVO.value,
+        P.fecha_registro <= limite,
+        ~alerta_reciente
+    )
+    mensaje = "⚠️ Prospecto inactivo > 4h: " + func.coalesce(P.nombre, "") + " " + func.coalesce(P.apellido, "")
+    columnas = ["usuario_id", "prospecto_id", "tipo", "mensaje", "fecha_creacion", "leida", "email_enviado"]
+    
+    def insertar_alertas(destinatario, *condiciones, unir=None):
+        # ✅ Inserción masiva con INSERT ... SELECT: las filas no pasan por Python
+        consulta = select(
+            destinatario, P.id, literal("inactividad"), mensaje, literal(ahora), literal(False), literal(False)
+        ).select_from(P).where(vencidos, *condiciones)
+        if unir is not None:
+            consulta = consulta.join(unir, true())
+        return db.connection().execute(
+            insert(N).from_select(columnas, consulta).returning(N.prospecto_id, N.usuario_id, N.mensaje)
+        ).all()
     
+    # Con agente asignado: se notifica al agente
+    con_agente = insertar_alertas(P.agente_asignado_id, P.agente_asignado_id.isnot(None))
+    # Sin agente: a todos los admins/supervisores (unidos a la consulta, no uno por prospecto)
+    sin_agente = insertar_alertas(
+        U.id,
+        P.agente_asignado_id.is_(None),
+        U.tipo_usuario.in_([TipoUsuario.ADMINISTRADOR.value, TipoUsuario.SUPERVISOR.value]),
+        unir=U
+    )
     db.commit()
-    return count
+    eventos.publicar_notificaciones((f.usuario_id, "inactividad", f.mensaje) for f in con_agente + sin_agente)
+    
+    return {
+        "prospectos_inactivos": len(con_agente) + len({f.prospecto_id for f in sin_agente}),
+        "alertas_agentes": len(con_agente),
+        "alertas_supervisores": len(sin_agente),
+        "alertas_generadas": len(con_agente) + len(sin_agente)
+    }
+
+def revisar_inactividad():
+    """Tarea programada: barrido de inactividad con una sesión propia"""
+    db = database.SessionLocal()
+    try:
+        resultado = check_inactivity(db)
+        if resultado["alertas_generadas"]:
+            print(f"⚠️ Alertas de inactividad: {resultado['alertas_generadas']} "
+                  f"({resultado['prospectos_inactivos']} prospectos)")
+    finally:
+        db.close()
 
 @app.get("/api/notificaciones/check-inactivity")
-async def api_check_inactivity(
+def api_check_inactivity(
     db: Session = Depends(database.get_db)
 ):
     """Endpoint para activar la verificación manual o por cron"""
     try:
-        count = check_inactivity(db)
-        return {"status": "ok", "alertas_generadas": count}
+        resultado = check_inactivity(db)
+        return {"status": "ok", **resultado}
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
 @app.get("/notificaciones", response_class=HTMLResponse)
-async def ver_notificaciones(
+def ver_notificaciones(
     request: Request,
     filtro_agente_id: str = Query(None),
     db: Session = Depends(database.get_db)
 ):
-    user = await get_current_user(request, db)
+    user = get_current_user(request, db)
     if not user:
         return RedirectResponse(url="/", status_code=303)
     
-    # Trigger inactividad check al cargar (para asegurar alertas frescas)
-    check_inactivity(db)
-    
     query = db.query(models.Notificacion).filter(
         models.Notificacion.leida == False
     )
@@ -2579,7 +2663,7 @@ async def ver_notificaciones(
     })
 
 @app.post("/notificaciones/{notificacion_id}/leer")
-async def marcar_notificacion_leida(
+def marcar_notificacion_leida(
     notificacion_id: int,
     db: Session = Depends(database.get_db),
     request: Request = None 
@@ -2591,6 +2675,82 @@ async def marcar_notificacion_leida(
     
     return RedirectResponse(url="/notificaciones", status_code=303)
 
+# ========== EVENTOS EN VIVO (SSE) ==========
+# ✅ Las páginas abiertas reciben notificaciones, asignaciones y contadores del
+# dashboard por Server-Sent Events en lugar de recargar páginas pesadas
+EVENTOS_PING_SEGUNDOS = 15
+
+def _usuario_eventos(request: Request):
+    db = database.SessionLocal()
+    try:
+        user = get_current_user(request, db)
+        return (user.id, user.tipo_usuario) if user else None
+    finally:
+        db.close()
+
+def _contadores_dashboard(usuario_id: int, tipo_usuario: str, inicio: date, fin: date) -> dict:
+    """Contadores numéricos del dashboard (salen del resumen diario, es barato)"""
+    db = database.SessionLocal()
+    try:
+        es_general = tipo_usuario in [TipoUsuario.ADMINISTRADOR.value, TipoUsuario.SUPERVISOR.value]
+        stats = estadisticas.calcular_estadisticas_dashboard(db, inicio, fin, agente_id=None if es_general else usuario_id)
+        return {clave: valor for clave, valor in stats.como_contexto().items() if isinstance(valor, int)}
+    finally:
+        db.close()
+
+def _mensaje_sse(tipo: str, datos: dict) -> str:
+    return f"event: {tipo}\ndata: {json.dumps(datos, ensure_ascii=False)}\n\n"
+
+@app.get("/eventos")
+async def eventos_en_vivo(
+    request: Request,
+    periodo: str = Query(None),  # Si se indica, se envían los contadores del dashboard de ese periodo
+    fecha_inicio: str = Query(None),
+    fecha_fin: str = Query(None)
+):
+    usuario = await anyio.to_thread.run_sync(_usuario_eventos, request)
+    if not usuario:
+        raise HTTPException(status_code=401, detail="No autenticado")
+    usuario_id, tipo_usuario = usuario
+
+    rango = None
+    if periodo:
+        inicio_dt, fin_dt = calcular_rango_fechas(periodo, fecha_inicio, fecha_fin)
+        rango = (inicio_dt.date(), fin_dt.date())
+
+    suscripcion = eventos.bus.suscribir()
+
+    async def emitir():
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    evento = await asyncio.wait_for(suscripcion.cola.get(), EVENTOS_PING_SEGUNDOS)
+                except asyncio.TimeoutError:
+                    # Comentario SSE para mantener viva la conexión a través de proxies
+                    yield ": ping\n\n"
+                    continue
+
+                if not evento.es_para(usuario_id, tipo_usuario):
+                    continue
+                if evento.tipo == "dashboard":
+                    dias = [date.fromisoformat(d) for d in evento.datos["dias"]]
+                    if not rango or not any(rango[0] <= d <= rango[1] for d in dias):
+                        continue
+                    contadores = await anyio.to_thread.run_sync(
+                        _contadores_dashboard, usuario_id, tipo_usuario, rango[0], rango[1]
+                    )
+                    yield _mensaje_sse("contadores", contadores)
+                else:
+                    yield _mensaje_sse(evento.tipo, evento.datos)
+        finally:
+            eventos.bus.cancelar(suscripcion)
+
+    return StreamingResponse(emitir(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"  # Sin buffer en nginx
+    })
+
 
 if __name__ == "__main__":
     import uvicorn
@@ -1,8 +1,11 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Date, Boolean
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Date, Boolean, Index, event, select
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship
-from datetime import datetime
+from sqlalchemy.orm import column_property, relationship
+from datetime import date, datetime
 import enum
+import re
 
 Base = declarative_base()
 
@@ -18,6 +21,30 @@ class EstadoProspecto(enum.Enum):
     CERRADO_PERDIDO = "cerrado_perdido"
     GANADO = "ganado"
 
+def normalizar_telefono(telefono, indicativo="57"):
+    """
+    Clave normalizada estilo E.164 (+<indicativo><número>) para comparar teléfonos
+    sin importar espacios, guiones, paréntesis o si se escribió el indicativo.
+    """
+    if not telefono:
+        return None
+    texto = str(telefono).strip()
+    digitos = re.sub(r"\D", "", texto)
+    if not digitos:
+        return None
+    indicativo = re.sub(r"\D", "", str(indicativo or "")) or "57"
+    
+    if texto.startswith("+"):
+        return f"+{digitos}"
+    if digitos.startswith("00"):
+        return f"+{digitos[2:]}"
+    # Número que ya incluye el indicativo (p. ej. 573001234567)
+    if digitos.startswith(indicativo) and len(digitos) > 10:
+        return f"+{digitos}"
+    # Prefijo troncal nacional (0)
+    digitos = digitos.lstrip("0") or digitos
+    return f"+{indicativo}{digitos}"
+
 class MedioIngreso(Base):
     __tablename__ = "medios_ingreso"
     
@@ -38,6 +65,16 @@ class Usuario(Base):
 
 class Prospecto(Base):
     __tablename__ = "prospectos"
+    __table_args__ = (
+        # ✅ Índices según los patrones de consulta (dashboard, listados, duplicados)
+        Index("ix_prospectos_fecha_registro", "fecha_registro"),
+        Index("ix_prospectos_agente_fecha", "agente_asignado_id", "fecha_registro"),
+        Index("ix_prospectos_estado_agente_fecha", "estado", "agente_asignado_id", "fecha_registro"),
+        Index("ix_prospectos_telefono", "telefono"),
+        Index("ix_prospectos_telefono_secundario", "telefono_secundario"),
+        Index("ix_prospectos_telefono_normalizado", "telefono_normalizado"),
+        Index("ix_prospectos_telefono_secundario_normalizado", "telefono_secundario_normalizado"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     # ✅ NUEVO: ID de cliente único
@@ -49,8 +86,13 @@ class Prospecto(Base):
     indicativo_telefono = Column(String(5), default="57")
     telefono_secundario = Column(String(20), nullable=True)
     indicativo_telefono_secundario = Column(String(5), default="57")
+    # ✅ NUEVO: Teléfonos normalizados (+<indicativo><número>) para detectar clientes recurrentes
+    telefono_normalizado = Column(String(20), nullable=True)
+    telefono_secundario_normalizado = Column(String(20), nullable=True)
     ciudad_origen = Column(String(100))
-    destino = Column(String(100))
+    # ✅ active_history: al cambiarlo se carga el valor anterior aunque el objeto esté expirado
+    # (el índice de destinos y el resumen diario descuentan el destino viejo)
+    destino = column_property(Column(String(100)), active_history=True)
     fecha_ida = Column(Date)
     fecha_vuelta = Column(Date)
     pasajeros_adultos = Column(Integer, default=1)
@@ -80,13 +122,6 @@ class Prospecto(Base):
         backref="prospecto_original"
     )
     
-    # ✅ MÉTODO: Generar ID de cliente único
-    def generar_id_cliente(self):
-        if not self.id_cliente:
-            timestamp = datetime.now().strftime("%Y%m%d")
-            self.id_cliente = f"CL-{timestamp}-{self.id:04d}"
-        return self.id_cliente
-    
     # ✅ MÉTODO: Determinar si tiene datos completos
     def verificar_datos_completos(self):
         """Verifica si el prospecto tiene datos completos (email, fechas o pasajeros)"""
@@ -99,6 +134,15 @@ class Prospecto(Base):
         self.tiene_datos_completos = tiene_email or tiene_fechas or tiene_pasajeros or tiene_destino or tiene_origen
         return self.tiene_datos_completos
     
+    # ✅ MÉTODO: Actualizar teléfonos normalizados
+    def normalizar_telefonos(self):
+        """Recalcula las claves normalizadas de ambos teléfonos"""
+        self.telefono_normalizado = normalizar_telefono(self.telefono, self.indicativo_telefono)
+        self.telefono_secundario_normalizado = normalizar_telefono(
+            self.telefono_secundario, self.indicativo_telefono_secundario
+        )
+        return self.telefono_normalizado
+    
     def get_telefono_whatsapp(self, telefono_principal=True):
         """Obtiene el teléfono completo para WhatsApp"""
         if telefono_principal:
@@ -119,8 +163,17 @@ class Prospecto(Base):
             return f"https://wa.me/{telefono_completo}"
         return "#"
 
+@event.listens_for(Prospecto, "before_insert")
+@event.listens_for(Prospecto, "before_update")
+def _normalizar_telefonos_prospecto(mapper, connection, prospecto):
+    """Mantiene los teléfonos normalizados en cualquier escritura del prospecto"""
+    prospecto.normalizar_telefonos()
+
 class Interaccion(Base):
     __tablename__ = "interacciones"
+    __table_args__ = (
+        Index("ix_interacciones_prospecto_fecha", "prospecto_id", "fecha_creacion"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     prospecto_id = Column(Integer, ForeignKey("prospectos.id"))
@@ -137,6 +190,10 @@ class Interaccion(Base):
 
 class Documento(Base):
     __tablename__ = "documentos"
+    __table_args__ = (
+        Index("ix_documentos_prospecto", "prospecto_id"),
+        Index("ix_documentos_procesamiento", "estado_procesamiento", "proximo_procesamiento"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     # ✅ NUEVO: ID de documento único
@@ -148,20 +205,38 @@ class Documento(Base):
     ruta_archivo = Column(String(500), nullable=False)
     fecha_subida = Column(DateTime, default=datetime.now)
     descripcion = Column(Text)
+    # ✅ Huella y tamaño calculados al guardar el archivo
+    hash_sha256 = Column(String(64), nullable=True, index=True)
+    tamano_bytes = Column(Integer, nullable=True)
+    # ✅ Procesamiento en segundo plano: texto, páginas y miniatura (ver procesamiento_documentos.py)
+    estado_procesamiento = Column(String(20), default="pendiente")  # pendiente, procesando, procesado, fallido
+    intentos_procesamiento = Column(Integer, default=0)
+    proximo_procesamiento = Column(DateTime, default=datetime.now)
+    error_procesamiento = Column(Text, nullable=True)
+    paginas = Column(Integer, nullable=True)
+    texto_extraido = Column(Text, nullable=True)
+    tiene_miniatura = Column(Boolean, default=False)
     
     # Relaciones
     prospecto = relationship("Prospecto", back_populates="documentos")
     usuario = relationship("Usuario")
+
+class ArchivoBlob(Base):
+    """Contenido de documento guardado una sola vez por hash (ver documentos.py)"""
+    __tablename__ = "archivos_blob"
     
-    # ✅ MÉTODO: Generar ID de documento único
-    def generar_id_documento(self):
-        if not self.id_documento:
-            timestamp = datetime.now().strftime("%Y%m%d")
-            self.id_documento = f"DOC-{timestamp}-{self.id:04d}"
-        return self.id_documento
+    hash_sha256 = Column(String(64), primary_key=True)
+    ruta = Column(String(500), nullable=False)
+    tamano_bytes = Column(Integer, nullable=False)
+    referencias = Column(Integer, nullable=False, default=0)  # Documentos que lo usan
+    fecha_creacion = Column(DateTime, default=datetime.now)
 
 class EstadisticaCotizacion(Base):
     __tablename__ = "estadisticas_cotizacion"
+    __table_args__ = (
+        Index("ix_estadisticas_cotizacion_fecha_agente", "fecha_cotizacion", "agente_id"),
+        Index("ix_estadisticas_cotizacion_prospecto", "prospecto_id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     # ✅ NUEVO: ID de cotización único
@@ -174,16 +249,13 @@ class EstadisticaCotizacion(Base):
     # Relaciones
     agente = relationship("Usuario")
     prospecto = relationship("Prospecto")
-    
-    # ✅ MÉTODO: Generar ID de cotización único
-    def generar_id_cotizacion(self):
-        if not self.id_cotizacion:
-            timestamp = datetime.now().strftime("%Y%m%d")
-            self.id_cotizacion = f"COT-{timestamp}-{self.id:04d}"
-        return self.id_cotizacion
 
 class HistorialEstado(Base):
     __tablename__ = "historial_estados"
+    __table_args__ = (
+        Index("ix_historial_estados_estado_fecha_usuario", "estado_nuevo", "fecha_cambio", "usuario_id"),
+        Index("ix_historial_estados_prospecto", "prospecto_id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     prospecto_id = Column(Integer, ForeignKey("prospectos.id"))
@@ -199,6 +271,11 @@ class HistorialEstado(Base):
 
 class Notificacion(Base):
     __tablename__ = "notificaciones"
+    __table_args__ = (
+        Index("ix_notificaciones_usuario_leida", "usuario_id", "leida", "fecha_creacion"),
+        Index("ix_notificaciones_leida_fecha", "leida", "fecha_creacion"),
+        Index("ix_notificaciones_prospecto_tipo", "prospecto_id", "tipo", "fecha_creacion"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     usuario_id = Column(Integer, ForeignKey("usuarios.id"))
@@ -213,3 +290,122 @@ class Notificacion(Base):
     # Relaciones
     usuario = relationship("Usuario")
     prospecto = relationship("Prospecto")
+
+class ResumenDiario(Base):
+    """Resumen materializado por día × agente × estado × medio de ingreso × destino"""
+    __tablename__ = "resumen_diario"
+    __table_args__ = (
+        Index("ix_resumen_diario_fecha_agente", "fecha", "agente_id"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    fecha = Column(Date, nullable=False)
+    agente_id = Column(Integer, ForeignKey("usuarios.id"), nullable=True)
+    estado = Column(String(20))
+    medio_ingreso_id = Column(Integer, ForeignKey("medios_ingreso.id"), nullable=True)
+    destino = Column(String(100), nullable=True)
+    # Prospectos registrados ese día (agente = asignado, estado = estado actual)
+    registrados = Column(Integer, default=0)
+    con_datos = Column(Integer, default=0)
+    sin_datos = Column(Integer, default=0)
+    # Cambios de estado ese día (agente = usuario que hizo el cambio, estado = estado nuevo)
+    cambios_estado = Column(Integer, default=0)
+    # Cotizaciones ese día (agente = agente de la cotización, estado = cotizado)
+    cotizaciones = Column(Integer, default=0)
+
+class Sesion(Base):
+    """Sesión de usuario persistida (compartida entre procesos/workers)"""
+    __tablename__ = "sesiones"
+    __table_args__ = (
+        Index("ix_sesiones_expira", "expira"),
+    )
+    
+    token = Column(String(64), primary_key=True)
+    usuario_id = Column(Integer, ForeignKey("usuarios.id"), nullable=False)
+    fecha_creacion = Column(DateTime, default=datetime.now)
+    expira = Column(DateTime, nullable=False)
+
+class TareaProgramada(Base):
+    """Lease de las tareas periódicas: solo el worker que lo tiene vigente ejecuta la tarea"""
+    __tablename__ = "tareas_programadas"
+    
+    nombre = Column(String(50), primary_key=True)
+    propietario = Column(String(100))
+    lease_hasta = Column(DateTime)
+    ultima_ejecucion = Column(DateTime, nullable=True)
+
+class CorreoPendiente(Base):
+    """Bandeja de salida de correos: se guarda en la misma transacción y la envía el planificador"""
+    __tablename__ = "correos_pendientes"
+    __table_args__ = (
+        Index("ix_correos_pendientes_estado_intento", "estado", "proximo_intento"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    destinatario = Column(String(100), nullable=False)
+    asunto = Column(String(200), nullable=False)
+    cuerpo = Column(Text, nullable=False)
+    notificacion_id = Column(Integer, ForeignKey("notificaciones.id"), nullable=True)
+    estado = Column(String(20), default="pendiente")  # pendiente, enviando, enviado, fallido
+    intentos = Column(Integer, default=0)
+    proximo_intento = Column(DateTime, default=datetime.now)  # En "enviando": vence el reclamo
+    ultimo_error = Column(Text, nullable=True)
+    fecha_creacion = Column(DateTime, default=datetime.now)
+    fecha_envio = Column(DateTime, nullable=True)
+    
+    # Relaciones
+    notificacion = relationship("Notificacion")
+
+class ContadorCodigo(Base):
+    """Último número usado por prefijo y día en los códigos legibles (CL-, DOC-, COT-)"""
+    __tablename__ = "contadores_codigo"
+    
+    prefijo = Column(String(10), primary_key=True)
+    fecha = Column(Date, primary_key=True)
+    ultimo = Column(Integer, nullable=False, default=0)
+
+# ========== CÓDIGOS LEGIBLES (CL-, DOC-, COT-) ==========
+# El número sale de un contador por prefijo y día (el día del registro, no el de la
+# generación) que se reserva con un UPSERT atómico en la misma transacción: el código
+# viaja en el propio INSERT y dos workers nunca obtienen el mismo número.
+
+def reservar_codigos(connection, prefijo: str, dia: date, cantidad: int = 1) -> list:
+    """Reserva `cantidad` números consecutivos del día y devuelve sus códigos"""
+    tabla = ContadorCodigo.__table__
+    if connection.dialect.name in ("sqlite", "postgresql"):
+        insertar = sqlite_insert if connection.dialect.name == "sqlite" else postgresql_insert
+        sentencia = insertar(tabla).values(prefijo=prefijo, fecha=dia, ultimo=cantidad)
+        ultimo = connection.execute(sentencia.on_conflict_do_update(
+            index_elements=[tabla.c.prefijo, tabla.c.fecha],
+            set_={"ultimo": tabla.c.ultimo + sentencia.excluded.ultimo}
+        ).returning(tabla.c.ultimo)).scalar_one()
+    else:
+        # Motores sin UPSERT ... RETURNING: el UPDATE bloquea la fila hasta el commit
+        condicion = (tabla.c.prefijo == prefijo) & (tabla.c.fecha == dia)
+        if connection.execute(tabla.update().where(condicion).values(ultimo=tabla.c.ultimo + cantidad)).rowcount == 0:
+            connection.execute(tabla.insert().values(prefijo=prefijo, fecha=dia, ultimo=cantidad))
+        ultimo = connection.execute(select(tabla.c.ultimo).where(condicion)).scalar_one()
+    return [f"{prefijo}-{dia:%Y%m%d}-{numero:04d}" for numero in range(ultimo - cantidad + 1, ultimo + 1)]
+
+# Clase -> (columna del código, prefijo, columna con la fecha del registro)
+CODIGOS = {
+    Prospecto: ("id_cliente", "CL", "fecha_registro"),
+    Documento: ("id_documento", "DOC", "fecha_subida"),
+    EstadisticaCotizacion: ("id_cotizacion", "COT", "fecha_cotizacion"),
+}
+
+@event.listens_for(Prospecto, "before_insert")
+@event.listens_for(Documento, "before_insert")
+@event.listens_for(EstadisticaCotizacion, "before_insert")
+def _asignar_codigo(mapper, connection, objeto):
+    """Asigna el código legible antes del INSERT (sin flush + UPDATE posterior)"""
+    columna, prefijo, columna_fecha = CODIGOS[type(objeto)]
+    if getattr(objeto, columna):
+        return
+    fecha = getattr(objeto, columna_fecha)
+    if fecha is None:
+        # Misma fecha que pondría el default de la columna
+        fecha = datetime.now()
+        setattr(objeto, columna_fecha, fecha)
+    dia = fecha.date() if isinstance(fecha, datetime) else fecha
+    setattr(objeto, columna, reservar_codigos(connection, prefijo, dia)[0])
@@ -0,0 +1,284 @@
+"""
+Cliente mínimo de almacenamiento de objetos compatible con S3 y servidor local de reemplazo.
+
+El cliente firma las peticiones con AWS Signature V4 (URLs estilo ruta:
+http://host:9000/<bucket>/<clave>) y sirve contra S3, MinIO, Ceph, R2 o
+cualquier servicio compatible. Para desarrollo, sin MinIO instalado, se puede
+levantar el servidor de reemplazo (guarda los objetos en una carpeta y verifica
+la firma con las mismas credenciales):
+
+    python objetos_s3.py --puerto 9000 --datos s3_datos
+"""
+import argparse
+import hashlib
+import hmac
+import http.client
+import os
+import re
+import tempfile
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import BinaryIO, Dict, Iterator, Optional, Tuple
+from urllib.parse import quote, unquote, urlparse
+
+HASH_VACIO = hashlib.sha256(b"").hexdigest()
+TAMANO_BLOQUE = 1024 * 1024
+
+
+class ErrorS3(Exception):
+    """Error devuelto por el servicio (código S3 y estado HTTP)"""
+
+    def __init__(self, estado: int, codigo: str):
+        super().__init__(f"{estado} {codigo}")
+        self.estado = estado
+        self.codigo = codigo
+
+
+def _hmac(clave: bytes, texto: str) -> bytes:
+    return hmac.new(clave, texto.encode("utf-8"), hashlib.sha256).digest()
+
+
+def firma_v4(metodo: str, ruta: str, cabeceras: Dict[str, str], hash_cuerpo: str,
+             secret_key: str, region: str, fecha_amz: str) -> Tuple[str, str]:
+    """Devuelve (cabeceras firmadas, firma) de AWS Signature V4 para una petición sin query string"""
+    firmadas = sorted(cabeceras)
+    peticion_canonica = "\n".join([
+        metodo,
+        quote(ruta, safe="/-_.~"),
+        "",
+        "".join(f"{nombre}:{cabeceras[nombre].strip()}\n" for nombre in firmadas),
+        ";".join(firmadas),
+        hash_cuerpo
+    ])
+    ambito = f"{fecha_amz[:8]}/{region}/s3/aws4_request"
+    texto_a_firmar = "\n".join([
+        "AWS4-HMAC-SHA256", fecha_amz, ambito, hashlib.sha256(peticion_canonica.encode("utf-8")).hexdigest()
+    ])
+    clave = _hmac(("AWS4" + secret_key).encode("utf-8"), fecha_amz[:8])
+    for parte in (region, "s3", "aws4_request"):
+        clave = _hmac(clave, parte)
+    return ";".join(firmadas), hmac.new(clave, texto_a_firmar.encode("utf-8"), hashlib.sha256).hexdigest()
+
+
+# ========== CLIENTE ==========
+
+class ClienteS3:
+    """Cliente síncrono; abre una conexión por petición (seguro entre hilos)"""
+
+    def __init__(self, endpoint: str, bucket: str, access_key: str, secret_key: str,
+                 region: str = "us-east-1", timeout: float = 30.0):
+        datos = urlparse(endpoint)
+        self.https = datos.scheme == "https"
+        self.host = datos.netloc
+        self.bucket = bucket
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region
+        self.timeout = timeout
+
+    def _peticion(self, metodo: str, clave: str, cuerpo: Optional[BinaryIO] = None, tamano: int = 0,
+                  hash_cuerpo: str = HASH_VACIO, extra: Optional[Dict[str, str]] = None):
+        ruta = f"/{self.bucket}/{clave}"
+        fecha_amz = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        cabeceras = {"host": self.host, "x-amz-content-sha256": hash_cuerpo, "x-amz-date": fecha_amz}
+        firmadas, firma = firma_v4(metodo, ruta, cabeceras, hash_cuerpo, self.secret_key, self.region, fecha_amz)
+        cabeceras["authorization"] = (
+            f"AWS4-HMAC-SHA256 Credential={self.access_key}/{fecha_amz[:8]}/{self.region}/s3/aws4_request, "
+            f"SignedHeaders={firmadas}, Signature={firma}"
+        )
+        if cuerpo is not None:
+            cabeceras["content-length"] = str(tamano)
+        cabeceras.update(extra or {})
+
+        clase = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+        conexion = clase(self.host, timeout=self.timeout, blocksize=TAMANO_BLOQUE)
+        conexion.request(metodo, quote(ruta, safe="/-_.~"), body=cuerpo, headers=cabeceras)
+        respuesta = conexion.getresponse()
+        if respuesta.status >= 300:
+            contenido = respuesta.read().decode("utf-8", "replace")
+            conexion.close()
+            codigo = re.search(r"<Code>(.*?)</Code>", contenido)
+            raise ErrorS3(respuesta.status, codigo.group(1) if codigo else respuesta.reason)
+        return conexion, respuesta
+
+    def put_object(self, clave: str, archivo: BinaryIO, tamano: int, sha256_hex: str):
+        """Sube el archivo en streaming; el servicio verifica el SHA-256 del contenido"""
+        conexion, respuesta = self._peticion("PUT", clave, archivo, tamano, sha256_hex)
+        respuesta.read()
+        conexion.close()
+
+    def head_object(self, clave: str) -> Optional[Dict[str, str]]:
+        try:
+            conexion, respuesta = self._peticion("HEAD", clave)
+        except ErrorS3 as e:
+            if e.estado == 404:
+                return None
+            raise
+        cabeceras = {nombre.lower(): valor for nombre, valor in respuesta.getheaders()}
+        conexion.close()
+        return cabeceras
+
+    def get_object(self, clave: str, inicio: Optional[int] = None, fin: Optional[int] = None) -> Iterator[bytes]:
+        """
+        Contenido del objeto (o del rango de bytes inicio-fin, ambos incluidos) por bloques.
+        La petición se envía al llamar (ErrorS3 inmediato si no existe); el cuerpo se lee al iterar.
+        """
+        extra = {"range": f"bytes={inicio}-{fin}"} if inicio is not None else None
+        conexion, respuesta = self._peticion("GET", clave, extra=extra)
+        return self._cuerpo(conexion, respuesta)
+
+    @staticmethod
+    def _cuerpo(conexion, respuesta) -> Iterator[bytes]:
+        try:
+            while True:
+                bloque = respuesta.read(TAMANO_BLOQUE)
+                if not bloque:
+                    break
+                yield bloque
+        finally:
+            conexion.close()
+
+    def delete_object(self, clave: str):
+        conexion, respuesta = self._peticion("DELETE", clave)
+        respuesta.read()
+        conexion.close()
+
+
+# ========== SERVIDOR DE REEMPLAZO ==========
+
+class ServidorS3(ThreadingHTTPServer):
+    """PUT/GET (con Range)/HEAD/DELETE de objetos guardados como archivos en `directorio`"""
+
+    daemon_threads = True
+
+    def __init__(self, direccion: tuple, directorio: str, access_key: str, secret_key: str, region: str = "us-east-1"):
+        super().__init__(direccion, ManejadorS3)
+        self.directorio = os.path.abspath(directorio)
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region
+        os.makedirs(self.directorio, exist_ok=True)
+
+
+class ManejadorS3(BaseHTTPRequestHandler):
+    server: ServidorS3
+
+    def log_message(self, formato, *args):
+        pass
+
+    def _error(self, estado: int, codigo: str):
+        cuerpo = f"<?xml version=\"1.0\"?><Error><Code>{codigo}</Code></Error>".encode("utf-8")
+        self.send_response(estado)
+        self.send_header("Content-Type", "application/xml")
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(cuerpo)
+
+    def _ruta_objeto(self) -> Optional[str]:
+        """Verifica la firma y devuelve la ruta del archivo del objeto (None si ya se respondió error)"""
+        autorizacion = self.headers.get("authorization", "")
+        datos = re.match(r"AWS4-HMAC-SHA256 Credential=([^/]+)/[^,]+, SignedHeaders=([^,]+), Signature=(\w+)", autorizacion)
+        if not datos or datos.group(1) != self.server.access_key:
+            self._error(403, "InvalidAccessKeyId")
+            return None
+        ruta = unquote(self.path.split("?", 1)[0])
+        cabeceras = {nombre: self.headers.get(nombre, "") for nombre in datos.group(2).split(";")}
+        _, firma = firma_v4(self.command, ruta, cabeceras, self.headers.get("x-amz-content-sha256", ""),
+                            self.server.secret_key, self.server.region, self.headers.get("x-amz-date", ""))
+        if not hmac.compare_digest(firma, datos.group(3)):
+            self._error(403, "SignatureDoesNotMatch")
+            return None
+        partes = ruta.lstrip("/").split("/", 1)
+        if len(partes) < 2 or not partes[1] or ".." in partes[1].split("/"):
+            self._error(400, "InvalidRequest")
+            return None
+        return os.path.join(self.server.directorio, partes[0], *partes[1].split("/"))
+
+    def do_PUT(self):
+        ruta = self._ruta_objeto()
+        if not ruta:
+            return
+        restante = int(self.headers.get("content-length", 0))
+        esperado = self.headers.get("x-amz-content-sha256", "")
+        sha256 = hashlib.sha256()
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        descriptor, temporal = tempfile.mkstemp(dir=os.path.dirname(ruta), suffix=".part")
+        with os.fdopen(descriptor, "wb") as destino:
+            while restante:
+                bloque = self.rfile.read(min(restante, TAMANO_BLOQUE))
+                if not bloque:
+                    break
+                restante -= len(bloque)
+                sha256.update(bloque)
+                destino.write(bloque)
+        if restante or (esperado != "UNSIGNED-PAYLOAD" and sha256.hexdigest() != esperado):
+            os.remove(temporal)
+            return self._error(400, "BadDigest")
+        os.replace(temporal, ruta)
+        self.send_response(200)
+        self.send_header("ETag", f'"{sha256.hexdigest()}"')
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_GET(self):
+        ruta = self._ruta_objeto()
+        if not ruta:
+            return
+        if not os.path.isfile(ruta):
+            return self._error(404, "NoSuchKey")
+        tamano = os.path.getsize(ruta)
+        inicio, fin = 0, tamano - 1
+        rango = re.match(r"bytes=(\d*)-(\d*)$", self.headers.get("range", ""))
+        if rango and (rango.group(1) or rango.group(2)):
+            if rango.group(1):
+                inicio, fin = int(rango.group(1)), min(int(rango.group(2) or fin), fin)
+            else:
+                inicio = max(tamano - int(rango.group(2)), 0)
+            if inicio > fin:
+                return self._error(416, "InvalidRange")
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {inicio}-{fin}/{tamano}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(fin - inicio + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+        if self.command == "HEAD":
+            return
+        with open(ruta, "rb") as archivo:
+            archivo.seek(inicio)
+            restante = fin - inicio + 1
+            while restante:
+                bloque = archivo.read(min(restante, TAMANO_BLOQUE))
+                if not bloque:
+                    break
+                restante -= len(bloque)
+                self.wfile.write(bloque)
+
+    do_HEAD = do_GET
+
+    def do_DELETE(self):
+        ruta = self._ruta_objeto()
+        if not ruta:
+            return
+        try:
+            os.remove(ruta)
+        except FileNotFoundError:
+            pass
+        self.send_response(204)
+        self.end_headers()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Servidor S3 local de reemplazo (desarrollo)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--puerto", type=int, default=9000)
+    parser.add_argument("--datos", default="s3_datos", help="Carpeta donde se guardan los objetos")
+    parser.add_argument("--access-key", default=os.getenv("S3_ACCESS_KEY", "minioadmin"))
+    parser.add_argument("--secret-key", default=os.getenv("S3_SECRET_KEY", "minioadmin"))
+    opciones = parser.parse_args()
+
+    servidor = ServidorS3((opciones.host, opciones.puerto), opciones.datos, opciones.access_key, opciones.secret_key)
+    print(f"✅ Servidor S3 escuchando en {opciones.host}:{opciones.puerto} (objetos en {servidor.directorio})")
+    servidor.serve_forever()
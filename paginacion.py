@@ -0,0 +1,118 @@
+"""
+Paginación por cursor (keyset) para los listados de prospectos.
+
+En lugar de OFFSET, cada página continúa a partir de la última fila vista
+ordenando por (fecha_registro, id), de modo que las páginas profundas cuestan
+lo mismo que la primera. Los totales salen de un conteo cacheado por unos
+segundos, que es suficiente para mostrar "Página X de Y".
+"""
+import base64
+import json
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, List, Optional
+
+from sqlalchemy import and_, or_
+
+import models
+
+# Tiempo (segundos) que se reutiliza un conteo antes de volver a calcularlo
+TTL_CONTEO = 60
+MAX_CONTEOS_CACHEADOS = 256
+
+_conteos: dict = {}
+_lock_conteos = threading.Lock()
+
+
+@dataclass
+class Pagina:
+    """Resultado de una página por cursor"""
+    elementos: List[Any] = field(default_factory=list)
+    cursor_siguiente: Optional[str] = None
+    cursor_anterior: Optional[str] = None
+
+
+def codificar_cursor(prospecto, direccion: str) -> str:
+    """Genera el token opaco que apunta a un prospecto ('sig' o 'ant')"""
+    datos = [direccion, prospecto.fecha_registro.isoformat(), prospecto.id]
+    return base64.urlsafe_b64encode(json.dumps(datos).encode()).decode().rstrip("=")
+
+
+def decodificar_cursor(token: Optional[str]):
+    """Devuelve (direccion, fecha_registro, id) o None si el token no es válido"""
+    if not token:
+        return None
+    try:
+        relleno = "=" * (-len(token) % 4)
+        direccion, fecha, prospecto_id = json.loads(base64.urlsafe_b64decode(token + relleno))
+        if direccion not in ("sig", "ant"):
+            return None
+        return direccion, datetime.fromisoformat(fecha), int(prospecto_id)
+    except (ValueError, TypeError):
+        return None
+
+
+def paginar_por_cursor(query, limite: int, cursor: Optional[str] = None) -> Pagina:
+    """Obtiene una página de prospectos ordenados del más nuevo al más antiguo"""
+    fecha = models.Prospecto.fecha_registro
+    prospecto_id = models.Prospecto.id
+    query = query.order_by(None)
+
+    posicion = decodificar_cursor(cursor)
+    hacia_atras = posicion is not None and posicion[0] == "ant"
+
+    if posicion:
+        _, fecha_cursor, id_cursor = posicion
+        if hacia_atras:
+            query = query.filter(fecha >= fecha_cursor, or_(
+                fecha > fecha_cursor, and_(fecha == fecha_cursor, prospecto_id > id_cursor)
+            )).order_by(fecha.asc(), prospecto_id.asc())
+        else:
+            query = query.filter(fecha <= fecha_cursor, or_(
+                fecha < fecha_cursor, and_(fecha == fecha_cursor, prospecto_id < id_cursor)
+            )).order_by(fecha.desc(), prospecto_id.desc())
+    else:
+        query = query.order_by(fecha.desc(), prospecto_id.desc())
+
+    # Se pide una fila extra para saber si hay más en esa dirección
+    filas = query.limit(limite + 1).all()
+    hay_mas = len(filas) > limite
+    filas = filas[:limite]
+    if hacia_atras:
+        filas.reverse()
+
+    pagina = Pagina(elementos=filas)
+    if filas:
+        if hacia_atras:
+            hay_siguiente, hay_anterior = True, hay_mas
+        else:
+            hay_siguiente, hay_anterior = hay_mas, posicion is not None
+        if hay_siguiente:
+            pagina.cursor_siguiente = codificar_cursor(filas[-1], "sig")
+        if hay_anterior:
+            pagina.cursor_anterior = codificar_cursor(filas[0], "ant")
+    return pagina
+
+
+def contar_aproximado(query) -> int:
+    """Cuenta las filas de la consulta reutilizando el resultado durante TTL_CONTEO segundos"""
+    query = query.order_by(None)
+    compilada = query.statement.compile()
+    clave = (str(compilada), tuple(sorted((k, repr(v)) for k, v in compilada.params.items())))
+
+    ahora = time.monotonic()
+    with _lock_conteos:
+        cacheado = _conteos.get(clave)
+        if cacheado and ahora - cacheado[1] < TTL_CONTEO:
+            return cacheado[0]
+
+    total = query.count()
+
+    with _lock_conteos:
+        if len(_conteos) >= MAX_CONTEOS_CACHEADOS:
+            # Descartar el conteo más antiguo
+            _conteos.pop(min(_conteos, key=lambda k: _conteos[k][1]))
+        _conteos[clave] = (total, ahora)
+    return total
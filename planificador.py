@@ -0,0 +1,93 @@
+"""
+Planificador de tareas periódicas dentro del proceso.
+
+Cada tarea corre en un bucle asyncio y se ejecuta en el pool de hilos. Antes de
+cada ejecución se toma un lease en la tabla `tareas_programadas`, así que con
+varios workers de uvicorn solo uno ejecuta la tarea en cada intervalo; si ese
+worker muere, otro toma el lease cuando caduca.
+"""
+import asyncio
+import os
+import socket
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List
+
+import anyio
+from sqlalchemy import insert, or_, update
+from sqlalchemy.exc import IntegrityError
+
+import database
+import models
+
+# Identificador de este proceso como propietario de leases
+PROPIETARIO = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+@dataclass
+class Tarea:
+    nombre: str
+    intervalo: int  # segundos
+    funcion: Callable[[], None]
+
+
+def adquirir_lease(nombre: str, duracion: int) -> bool:
+    """Toma (o renueva) el lease de la tarea si está libre o ya es nuestro"""
+    ahora = datetime.now()
+    hasta = ahora + timedelta(seconds=duracion)
+    T = models.TareaProgramada
+    with database.engine.begin() as conn:
+        tomado = conn.execute(
+            update(T)
+            .where(T.nombre == nombre, or_(T.lease_hasta <= ahora, T.propietario == PROPIETARIO))
+            .values(propietario=PROPIETARIO, lease_hasta=hasta, ultima_ejecucion=ahora)
+        ).rowcount
+    if tomado:
+        return True
+
+    # Primera vez que se ejecuta la tarea: crear su fila (si otro worker se adelanta, falla)
+    try:
+        with database.engine.begin() as conn:
+            conn.execute(insert(T).values(
+                nombre=nombre, propietario=PROPIETARIO, lease_hasta=hasta, ultima_ejecucion=ahora
+            ))
+        return True
+    except IntegrityError:
+        return False
+
+
+class Planificador:
+    def __init__(self):
+        self.tareas: Dict[str, Tarea] = {}
+        self._en_curso: List[asyncio.Task] = []
+
+    def agregar(self, nombre: str, intervalo: int, funcion: Callable[[], None]):
+        self.tareas[nombre] = Tarea(nombre, intervalo, funcion)
+
+    def _ejecutar(self, tarea: Tarea):
+        # El lease dura un intervalo (menos un margen para que el mismo worker lo renueve)
+        if not adquirir_lease(tarea.nombre, max(tarea.intervalo - 5, 1)):
+            return
+        tarea.funcion()
+
+    async def _ciclo(self, tarea: Tarea):
+        while True:
+            try:
+                await anyio.to_thread.run_sync(self._ejecutar, tarea)
+            except Exception as e:
+                print(f"❌ Error en tarea programada '{tarea.nombre}': {e}")
+            await asyncio.sleep(tarea.intervalo)
+
+    def iniciar(self):
+        for tarea in self.tareas.values():
+            self._en_curso.append(asyncio.create_task(self._ciclo(tarea)))
+            print(f"⏱️ Tarea programada '{tarea.nombre}' cada {tarea.intervalo} s")
+
+    def detener(self):
+        for tarea in self._en_curso:
+            tarea.cancel()
+        self._en_curso.clear()
+
+
+planificador = Planificador()
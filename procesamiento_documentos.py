@@ -0,0 +1,227 @@
+"""
+Procesamiento de documentos en segundo plano: texto, número de páginas y miniatura.
+
+Un documento nuevo queda con estado_procesamiento "pendiente". Después del
+commit, `subir_documento` encola `procesar_documento` como tarea de fondo (corre
+cuando la respuesta ya se envió) y el planificador llama a `procesar_pendientes`,
+que recoge los que quedaron sin procesar (reinicio del servidor, fallo temporal
+del almacenamiento) con espera exponencial entre intentos. Cada documento se
+reclama con un UPDATE condicional antes de procesarlo, así la tarea de fondo, el
+planificador y otros workers nunca procesan el mismo a la vez.
+
+- Texto y páginas con pypdf (Python puro). El texto queda en
+  documentos.texto_extraido y lo indexa documentos_fts: la búsqueda global
+  encuentra al prospecto por el contenido de sus PDF.
+- Miniatura de la primera página con pypdfium2 + Pillow (opcionales). Se guarda
+  en el almacenamiento como miniaturas/<ab>/<sha256>.png, compartida por los
+  documentos con el mismo contenido.
+"""
+import hashlib
+import io
+import os
+import re
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import or_, update
+
+import database
+import models
+from almacenamiento import almacen
+from documentos import clave_miniatura
+
+try:
+    import pypdf
+except ImportError:
+    pypdf = None
+
+try:
+    import pypdfium2
+    from PIL import Image  # pypdfium2 entrega la página renderizada como imagen de Pillow
+except ImportError:
+    pypdfium2 = None
+
+DOCUMENTOS_INTERVALO_SEGUNDOS = int(os.getenv("DOCUMENTOS_INTERVALO_SEGUNDOS", "60"))
+DOCUMENTOS_LOTE = 20
+DOCUMENTOS_MAX_INTENTOS = 5
+DOCUMENTOS_REINTENTO_BASE = 60  # segundos; se duplica en cada intento (máximo 1 hora)
+DOCUMENTOS_LEASE = 300  # Si el proceso muere a mitad, otro lo reintenta pasado este tiempo
+MAX_CARACTERES_TEXTO = 200_000
+ANCHO_MINIATURA = 320
+
+
+def _reclamar(db, documento_id: int) -> bool:
+    """Marca el documento como "procesando" si nadie más lo tiene; confirma enseguida"""
+    D = models.Documento
+    ahora = datetime.now()
+    tomado = db.execute(
+        update(D)
+        .where(
+            D.id == documento_id,
+            D.hash_sha256 != None,
+            D.estado_procesamiento.in_(["pendiente", "procesando"]),
+            or_(D.proximo_procesamiento == None, D.proximo_procesamiento <= ahora)
+        )
+        .values(
+            estado_procesamiento="procesando",
+            proximo_procesamiento=ahora + timedelta(seconds=DOCUMENTOS_LEASE),
+            intentos_procesamiento=D.intentos_procesamiento + 1
+        )
+    ).rowcount
+    db.commit()
+    return tomado == 1
+
+
+def _descargar(clave: str) -> str:
+    """Copia el archivo del almacenamiento a un temporal local (pypdf necesita poder hacer seek)"""
+    descriptor, ruta = tempfile.mkstemp(suffix=".pdf")
+    with os.fdopen(descriptor, "wb") as destino:
+        for bloque in almacen.leer(clave):
+            destino.write(bloque)
+    return ruta
+
+
+def extraer_texto(ruta_pdf: str) -> tuple:
+    """(páginas, texto) del PDF; el texto se corta en MAX_CARACTERES_TEXTO"""
+    lector = pypdf.PdfReader(ruta_pdf)
+    partes, total = [], 0
+    for pagina in lector.pages:
+        texto = re.sub(r"\s+", " ", pagina.extract_text() or "").strip()
+        if texto:
+            partes.append(texto)
+            total += len(texto)
+        if total >= MAX_CARACTERES_TEXTO:
+            break
+    return len(lector.pages), "\n".join(partes)[:MAX_CARACTERES_TEXTO]
+
+
+def renderizar_miniatura(ruta_pdf: str) -> Optional[bytes]:
+    """PNG de la primera página con ANCHO_MINIATURA píxeles de ancho (None sin pypdfium2)"""
+    if pypdfium2 is None:
+        return None
+    pdf = pypdfium2.PdfDocument(ruta_pdf)
+    try:
+        pagina = pdf[0]
+        escala = ANCHO_MINIATURA / pagina.get_width()
+        imagen = pagina.render(scale=escala).to_pil()
+        salida = io.BytesIO()
+        imagen.convert("RGB").save(salida, format="PNG", optimize=True)
+        return salida.getvalue()
+    finally:
+        pdf.close()
+
+
+def _guardar_miniatura(hash_sha256: str, png: bytes):
+    descriptor, ruta = tempfile.mkstemp(dir=almacen.directorio_temporal, suffix=".png.part")
+    with os.fdopen(descriptor, "wb") as destino:
+        destino.write(png)
+    almacen.subir(clave_miniatura(hash_sha256), ruta, hashlib.sha256(png).hexdigest(), mover=True)
+
+
+def _registrar_fallo(db, documento_id: int, error: Exception, definitivo: bool = False):
+    db.rollback()
+    documento = db.get(models.Documento, documento_id)
+    documento.error_procesamiento = str(error)[:500]
+    if definitivo or (documento.intentos_procesamiento or 0) >= DOCUMENTOS_MAX_INTENTOS:
+        documento.estado_procesamiento = "fallido"
+        print(f"❌ Documento {documento_id} no se pudo procesar: {error}")
+    else:
+        espera = min(DOCUMENTOS_REINTENTO_BASE * 2 ** ((documento.intentos_procesamiento or 1) - 1), 3600)
+        documento.estado_procesamiento = "pendiente"
+        documento.proximo_procesamiento = datetime.now() + timedelta(seconds=espera)
+        print(f"⚠️ Documento {documento_id}: reintento en {espera} s ({error})")
+    db.commit()
+
+
+def procesar_documento(documento_id: int) -> bool:
+    """Extrae texto, páginas y miniatura de un documento; False si otro lo tiene o no toca aún"""
+    if pypdf is None:
+        return False
+    db = database.SessionLocal()
+    try:
+        if not _reclamar(db, documento_id):
+            return False
+        D = models.Documento
+        documento = db.get(D, documento_id)
+        try:
+            # Mismo contenido ya procesado en otro documento: se reutiliza el resultado
+            previo = db.query(D).filter(
+                D.hash_sha256 == documento.hash_sha256,
+                D.estado_procesamiento == "procesado",
+                D.id != documento.id
+            ).first()
+            if previo:
+                paginas, texto, miniatura = previo.paginas, previo.texto_extraido, previo.tiene_miniatura
+            else:
+                ruta = _descargar(documento.ruta_archivo)
+                try:
+                    paginas, texto = extraer_texto(ruta)
+                    miniatura = False
+                    try:
+                        png = renderizar_miniatura(ruta)
+                        if png:
+                            _guardar_miniatura(documento.hash_sha256, png)
+                            miniatura = True
+                    except Exception as e:
+                        # Sin miniatura el documento sigue siendo útil: no se reintenta por esto
+                        print(f"⚠️ Documento {documento_id}: sin miniatura ({e})")
+                finally:
+                    os.remove(ruta)
+        except pypdf.errors.PyPdfError as e:
+            # PDF dañado o cifrado: reintentar no cambia nada
+            _registrar_fallo(db, documento_id, e, definitivo=True)
+            return False
+        except Exception as e:
+            _registrar_fallo(db, documento_id, e)
+            return False
+
+        documento.paginas = paginas
+        documento.texto_extraido = texto
+        documento.tiene_miniatura = miniatura
+        documento.estado_procesamiento = "procesado"
+        documento.error_procesamiento = None
+        db.commit()
+        return True
+    finally:
+        db.close()
+
+
+def procesar_pendientes(duracion_maxima: Optional[float] = None) -> dict:
+    """Procesa los documentos pendientes vencidos por lotes; devuelve los conteos"""
+    if pypdf is None:
+        return {"procesados": 0, "con_error": 0}
+    if duracion_maxima is None:
+        # Sin pasarse del lease del planificador
+        duracion_maxima = max(DOCUMENTOS_INTERVALO_SEGUNDOS - 10, 5)
+    inicio = time.monotonic()
+    procesados = con_error = 0
+    D = models.Documento
+    db = database.SessionLocal()
+    try:
+        while time.monotonic() - inicio < duracion_maxima:
+            ahora = datetime.now()
+            ids = [documento_id for (documento_id,) in db.query(D.id).filter(
+                D.hash_sha256 != None,
+                D.estado_procesamiento.in_(["pendiente", "procesando"]),
+                or_(D.proximo_procesamiento == None, D.proximo_procesamiento <= ahora)
+            ).order_by(D.id).limit(DOCUMENTOS_LOTE)]
+            db.rollback()
+            if not ids:
+                break
+            for documento_id in ids:
+                if procesar_documento(documento_id):
+                    procesados += 1
+                else:
+                    con_error += 1
+                if time.monotonic() - inicio >= duracion_maxima:
+                    break
+            if len(ids) < DOCUMENTOS_LOTE:
+                break
+    finally:
+        db.close()
+
+    if procesados or con_error:
+        print(f"📄 Documentos procesados: {procesados}, sin procesar: {con_error}")
+    return {"procesados": procesados, "con_error": con_error}
@@ -0,0 +1,271 @@
+"""
+Cliente mínimo del protocolo de Redis (RESP) y servidor local de reemplazo.
+
+El cliente sirve contra Redis, Valkey o cualquier servidor compatible. Para
+desarrollo, sin Redis instalado, se puede levantar el servidor de reemplazo:
+
+    python redis_resp.py --puerto 6379
+"""
+import argparse
+import asyncio
+import fnmatch
+import socket
+import threading
+import time
+from typing import Optional
+from urllib.parse import urlparse
+
+
+class ErrorResp(Exception):
+    """Error devuelto por el servidor RESP"""
+
+
+# ========== CLIENTE ==========
+
+class ClienteResp:
+    """Cliente síncrono con una conexión reutilizable (segura entre hilos)"""
+
+    def __init__(self, url: str = "redis://localhost:6379/0", timeout: float = 5.0):
+        self.url = url
+        datos = urlparse(url)
+        self.host = datos.hostname or "localhost"
+        self.puerto = datos.port or 6379
+        self.password = datos.password
+        self.base = int(datos.path.strip("/") or 0)
+        self.timeout = timeout
+        self._socket = None
+        self._lector = None
+        self._lock = threading.Lock()
+
+    def _conectar(self):
+        self._socket = socket.create_connection((self.host, self.puerto), timeout=self.timeout)
+        self._lector = self._socket.makefile("rb")
+        if self.password:
+            self._enviar_y_leer("AUTH", self.password)
+        if self.base:
+            self._enviar_y_leer("SELECT", self.base)
+
+    def cerrar(self):
+        with self._lock:
+            if self._socket:
+                try:
+                    self._socket.close()
+                finally:
+                    self._socket = None
+                    self._lector = None
+
+    @staticmethod
+    def _codificar(*partes) -> bytes:
+        salida = [b"*%d\r\n" % len(partes)]
+        for parte in partes:
+            if not isinstance(parte, bytes):
+                parte = str(parte).encode("utf-8")
+            salida.append(b"$%d\r\n%s\r\n" % (len(parte), parte))
+        return b"".join(salida)
+
+    def _leer_respuesta(self):
+        linea = self._lector.readline()
+        if not linea:
+            raise ConnectionError("Conexión RESP cerrada")
+        tipo, contenido = linea[:1], linea[1:-2]
+        if tipo == b"+":
+            return contenido.decode("utf-8")
+        if tipo == b"-":
+            raise ErrorResp(contenido.decode("utf-8"))
+        if tipo == b":":
+            return int(contenido)
+        if tipo == b"$":
+            largo = int(contenido)
+            if largo < 0:
+                return None
+            datos = self._lector.read(largo + 2)
+            return datos[:-2].decode("utf-8")
+        if tipo == b"*":
+            largo = int(contenido)
+            if largo < 0:
+                return None
+            return [self._leer_respuesta() for _ in range(largo)]
+        raise ErrorResp(f"Respuesta RESP desconocida: {linea!r}")
+
+    def _enviar_y_leer(self, *partes):
+        self._socket.sendall(self._codificar(*partes))
+        return self._leer_respuesta()
+
+    def ejecutar(self, *partes):
+        """Ejecuta un comando y devuelve la respuesta (reintenta una vez si se cayó la conexión)"""
+        with self._lock:
+            for intento in range(2):
+                try:
+                    if self._socket is None:
+                        self._conectar()
+                    return self._enviar_y_leer(*partes)
+                except (ConnectionError, OSError):
+                    self._socket = None
+                    self._lector = None
+                    if intento:
+                        raise
+
+    # Atajos de los comandos usados por la aplicación
+    def get(self, clave: str) -> Optional[str]:
+        return self.ejecutar("GET", clave)
+
+    def set(self, clave: str, valor, ex: Optional[int] = None):
+        if ex:
+            return self.ejecutar("SET", clave, valor, "EX", ex)
+        return self.ejecutar("SET", clave, valor)
+
+    def delete(self, *claves) -> int:
+        return self.ejecutar("DEL", *claves)
+
+    def scan_iter(self, patron: str, cantidad: int = 500):
+        cursor = "0"
+        while True:
+            cursor, claves = self.ejecutar("SCAN", cursor, "MATCH", patron, "COUNT", cantidad)
+            yield from claves
+            if cursor == "0":
+                break
+
+    def ping(self) -> bool:
+        return self.ejecutar("PING") == "PONG"
+
+    def publish(self, canal: str, mensaje) -> int:
+        return self.ejecutar("PUBLISH", canal, mensaje)
+
+    def escuchar(self, canal: str):
+        """Se suscribe al canal con una conexión propia y devuelve los mensajes a medida que llegan"""
+        suscriptor = ClienteResp(self.url, self.timeout)
+        suscriptor._conectar()
+        suscriptor._socket.settimeout(None)  # Bloquear hasta que llegue un mensaje
+        try:
+            suscriptor._enviar_y_leer("SUBSCRIBE", canal)
+            while True:
+                respuesta = suscriptor._leer_respuesta()
+                if isinstance(respuesta, list) and respuesta[0] == "message":
+                    yield respuesta[2]
+        finally:
+            suscriptor.cerrar()
+
+
+# ========== SERVIDOR LOCAL DE REEMPLAZO ==========
+
+class ServidorResp:
+    """Servidor RESP en memoria con los comandos que usa la aplicación (solo desarrollo)"""
+
+    def __init__(self):
+        self.datos = {}
+        self.expiraciones = {}
+        self.suscriptores = {}  # canal -> conjunto de escritores suscritos
+
+    def _vigente(self, clave) -> bool:
+        expira = self.expiraciones.get(clave)
+        if expira is not None and expira <= time.monotonic():
+            self.datos.pop(clave, None)
+            self.expiraciones.pop(clave, None)
+        return clave in self.datos
+
+    def procesar(self, comando: list):
+        nombre = comando[0].upper()
+        args = comando[1:]
+
+        if nombre == "PING":
+            return ("+", "PONG")
+        if nombre in ("AUTH", "SELECT"):
+            return ("+", "OK")
+        if nombre == "GET":
+            return self.datos[args[0]] if self._vigente(args[0]) else None
+        if nombre == "SET":
+            clave, valor = args[0], args[1]
+            self.datos[clave] = valor
+            self.expiraciones.pop(clave, None)
+            opciones = [a.upper() for a in args[2:]]
+            if "EX" in opciones:
+                segundos = int(args[2 + opciones.index("EX") + 1])
+                self.expiraciones[clave] = time.monotonic() + segundos
+            return ("+", "OK")
+        if nombre == "DEL":
+            borradas = 0
+            for clave in args:
+                if self._vigente(clave):
+                    del self.datos[clave]
+                    self.expiraciones.pop(clave, None)
+                    borradas += 1
+            return borradas
+        if nombre == "EXPIRE":
+            if not self._vigente(args[0]):
+                return 0
+            self.expiraciones[args[0]] = time.monotonic() + int(args[1])
+            return 1
+        if nombre == "SCAN":
+            patron = "*"
+            if "MATCH" in [a.upper() for a in args]:
+                patron = args[[a.upper() for a in args].index("MATCH") + 1]
+            claves = [c for c in list(self.datos) if self._vigente(c) and fnmatch.fnmatchcase(c, patron)]
+            return ["0", claves]
+        if nombre == "DBSIZE":
+            return len([c for c in list(self.datos) if self._vigente(c)])
+        return ErrorResp(f"ERR comando no soportado '{nombre}'")
+
+    @staticmethod
+    def codificar(valor) -> bytes:
+        if isinstance(valor, tuple):
+            return f"+{valor[1]}\r\n".encode("utf-8")
+        if isinstance(valor, ErrorResp):
+            return f"-{valor}\r\n".encode("utf-8")
+        if valor is None:
+            return b"$-1\r\n"
+        if isinstance(valor, int):
+            return b":%d\r\n" % valor
+        if isinstance(valor, list):
+            return b"*%d\r\n" % len(valor) + b"".join(ServidorResp.codificar(v) for v in valor)
+        datos = str(valor).encode("utf-8")
+        return b"$%d\r\n%s\r\n" % (len(datos), datos)
+
+    async def atender(self, lector: asyncio.StreamReader, escritor: asyncio.StreamWriter):
+        try:
+            while True:
+                linea = await lector.readline()
+                if not linea:
+                    break
+                if not linea.startswith(b"*"):
+                    continue
+                comando = []
+                for _ in range(int(linea[1:-2])):
+                    largo = int((await lector.readline())[1:-2])
+                    comando.append((await lector.readexactly(largo + 2))[:-2].decode("utf-8"))
+                nombre = comando[0].upper()
+                if nombre == "SUBSCRIBE":
+                    for canal in comando[1:]:
+                        self.suscriptores.setdefault(canal, set()).add(escritor)
+                        escritor.write(self.codificar(["subscribe", canal, len(comando) - 1]))
+                elif nombre == "PUBLISH":
+                    receptores = list(self.suscriptores.get(comando[1], ()))
+                    for receptor in receptores:
+                        receptor.write(self.codificar(["message", comando[1], comando[2]]))
+                    escritor.write(self.codificar(len(receptores)))
+                else:
+                    escritor.write(self.codificar(self.procesar(comando)))
+                await escritor.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            for escritores in self.suscriptores.values():
+                escritores.discard(escritor)
+            escritor.close()
+
+    async def iniciar(self, host: str = "127.0.0.1", puerto: int = 6379):
+        return await asyncio.start_server(self.atender, host, puerto)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Servidor RESP local de reemplazo (desarrollo)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--puerto", type=int, default=6379)
+    opciones = parser.parse_args()
+
+    async def principal():
+        servidor = await ServidorResp().iniciar(opciones.host, opciones.puerto)
+        print(f"✅ Servidor RESP escuchando en {opciones.host}:{opciones.puerto}")
+        async with servidor:
+            await servidor.serve_forever()
+
+    asyncio.run(principal())
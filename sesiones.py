@@ -0,0 +1,240 @@
+"""
+Almacén de sesiones de usuario con backends intercambiables.
+
+SESIONES_BACKEND elige dónde se guardan las sesiones:
+- "bd" (por defecto): tabla `sesiones` de la base de datos, sobrevive a
+  reinicios y la comparten todos los workers.
+- "redis": cualquier servidor compatible con el protocolo de Redis
+  (SESIONES_REDIS_URL), o el servidor local de `redis_resp.py`.
+- "memoria": diccionario LRU del proceso; solo para un único worker.
+
+Todas las sesiones caducan a los DURACION_SESION segundos, igual que la cookie.
+"""
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.orm import make_transient_to_detached
+
+import database
+import models
+from redis_resp import ClienteResp
+
+DURACION_SESION = 1800  # segundos (igual que max_age de la cookie)
+# Segundos que se reutiliza la fila del usuario de un token sin volver a leerla
+# (la sesión en sí se comprueba en el almacén en cada petición)
+TTL_CACHE_USUARIOS = int(os.getenv("TTL_CACHE_USUARIOS", "30"))
+
+
+class AlmacenMemoria:
+    """Sesiones en memoria del proceso, con expiración y tope LRU"""
+
+    def __init__(self, max_sesiones: int = 10000):
+        self.max_sesiones = max_sesiones
+        self._sesiones = OrderedDict()  # token -> (usuario_id, expira)
+        self._lock = threading.Lock()
+
+    def guardar(self, token: str, usuario_id: int, duracion: int):
+        with self._lock:
+            self._sesiones[token] = (usuario_id, time.monotonic() + duracion)
+            self._sesiones.move_to_end(token)
+            while len(self._sesiones) > self.max_sesiones:
+                self._sesiones.popitem(last=False)
+
+    def obtener(self, token: str) -> Optional[int]:
+        with self._lock:
+            sesion = self._sesiones.get(token)
+            if not sesion:
+                return None
+            if sesion[1] <= time.monotonic():
+                del self._sesiones[token]
+                return None
+            self._sesiones.move_to_end(token)
+            return sesion[0]
+
+    def eliminar(self, token: str):
+        with self._lock:
+            self._sesiones.pop(token, None)
+
+    def eliminar_de_usuario(self, usuario_id: int, db=None):
+        with self._lock:
+            for token in [t for t, (u, _) in self._sesiones.items() if u == usuario_id]:
+                del self._sesiones[token]
+
+    def contar(self) -> int:
+        ahora = time.monotonic()
+        with self._lock:
+            return sum(1 for _, expira in self._sesiones.values() if expira > ahora)
+
+
+class AlmacenBaseDatos:
+    """Sesiones en la tabla `sesiones` (compartidas entre workers)"""
+
+    def guardar(self, token: str, usuario_id: int, duracion: int):
+        ahora = datetime.now()
+        with database.engine.begin() as conn:
+            # Aprovechar el login para purgar las sesiones caducadas
+            conn.execute(delete(models.Sesion).where(models.Sesion.expira <= ahora))
+            conn.execute(insert(models.Sesion).values(
+                token=token,
+                usuario_id=usuario_id,
+                fecha_creacion=ahora,
+                expira=ahora + timedelta(seconds=duracion)
+            ))
+
+    def obtener(self, token: str) -> Optional[int]:
+        with database.engine.connect() as conn:
+            return conn.execute(
+                select(models.Sesion.usuario_id).where(
+                    models.Sesion.token == token,
+                    models.Sesion.expira > datetime.now()
+                )
+            ).scalar()
+
+    def eliminar(self, token: str):
+        with database.engine.begin() as conn:
+            conn.execute(delete(models.Sesion).where(models.Sesion.token == token))
+
+    def eliminar_de_usuario(self, usuario_id: int, db=None):
+        """Con `db`, dentro de su transacción (p. ej. junto con el DELETE del usuario)"""
+        sentencia = delete(models.Sesion).where(models.Sesion.usuario_id == usuario_id)
+        if db is not None:
+            db.execute(sentencia)
+            return
+        with database.engine.begin() as conn:
+            conn.execute(sentencia)
+
+    def contar(self) -> int:
+        with database.engine.connect() as conn:
+            return conn.execute(
+                select(func.count()).select_from(models.Sesion).where(models.Sesion.expira > datetime.now())
+            ).scalar()
+
+
+class AlmacenRedis:
+    """Sesiones en un servidor compatible con Redis (la expiración la hace el servidor)"""
+
+    PREFIJO = "sesion:"
+
+    def __init__(self, url: str):
+        self.cliente = ClienteResp(url)
+
+    def guardar(self, token: str, usuario_id: int, duracion: int):
+        self.cliente.set(self.PREFIJO + token, usuario_id, ex=duracion)
+
+    def obtener(self, token: str) -> Optional[int]:
+        valor = self.cliente.get(self.PREFIJO + token)
+        return int(valor) if valor is not None else None
+
+    def eliminar(self, token: str):
+        self.cliente.delete(self.PREFIJO + token)
+
+    def eliminar_de_usuario(self, usuario_id: int, db=None):
+        # Sin índice por usuario: recorre las sesiones (solo al eliminar usuarios)
+        claves = [c for c in self.cliente.scan_iter(self.PREFIJO + "*") if self.cliente.get(c) == str(usuario_id)]
+        if claves:
+            self.cliente.delete(*claves)
+
+    def contar(self) -> int:
+        return sum(1 for _ in self.cliente.scan_iter(self.PREFIJO + "*"))
+
+
+def _crear_almacen():
+    backend = os.getenv("SESIONES_BACKEND", "bd").lower()
+    if backend == "memoria":
+        return AlmacenMemoria()
+    if backend == "redis":
+        return AlmacenRedis(os.getenv("SESIONES_REDIS_URL", "redis://localhost:6379/0"))
+    return AlmacenBaseDatos()
+
+
+almacen = _crear_almacen()
+
+
+def crear_sesion(usuario_id: int) -> str:
+    """Crea una sesión para el usuario y devuelve su token"""
+    token = secrets.token_urlsafe(32)
+    almacen.guardar(token, usuario_id, DURACION_SESION)
+    return token
+
+
+def obtener_usuario_id(token: Optional[str]) -> Optional[int]:
+    """Devuelve el id del usuario de la sesión, o None si no existe o caducó"""
+    if not token:
+        return None
+    return almacen.obtener(token)
+
+
+def cerrar_sesion(token: Optional[str]):
+    if token:
+        almacen.eliminar(token)
+        with _lock_usuarios:
+            _usuarios_cache.pop(token, None)
+
+
+def cerrar_sesiones_usuario(usuario_id: int, db=None):
+    """
+    Cierra todas las sesiones de un usuario (antes de eliminarlo). Con el backend
+    "bd" y `db`, el borrado va en la transacción de `db`.
+    """
+    almacen.eliminar_de_usuario(usuario_id, db)
+    invalidar_usuario(usuario_id)
+
+
+def contar_sesiones() -> int:
+    """Número de sesiones activas (para /check-auth y /health)"""
+    return almacen.contar()
+
+
+# ========== CACHÉ DE USUARIOS AUTENTICADOS ==========
+# Copias desligadas de la sesión de BD (solo columnas), por token. Solo sustituyen
+# la lectura de la fila: quien llama ya validó el token en el almacén, así que un
+# logout, una sesión caducada o un usuario eliminado (sus sesiones se borran) se
+# notan en la siguiente petición en cualquier worker. Es por proceso: una edición
+# del usuario hecha en otro worker se ve al caducar la entrada (TTL_CACHE_USUARIOS).
+
+_usuarios_cache = {}  # token -> (copia del usuario, instante)
+_lock_usuarios = threading.Lock()
+
+
+def usuario_en_cache(token: Optional[str], usuario_id: int) -> Optional[models.Usuario]:
+    """Copia del usuario del token si está en caché, vigente y es el usuario de la sesión"""
+    if not token or TTL_CACHE_USUARIOS <= 0:
+        return None
+    with _lock_usuarios:
+        entrada = _usuarios_cache.get(token)
+        if not entrada:
+            return None
+        if time.monotonic() - entrada[1] >= TTL_CACHE_USUARIOS or entrada[0].id != usuario_id:
+            del _usuarios_cache[token]
+            return None
+        return entrada[0]
+
+
+def guardar_usuario_en_cache(token: str, usuario: models.Usuario):
+    """Guarda una copia desligada del usuario (la original sigue en la sesión de la petición)"""
+    if TTL_CACHE_USUARIOS <= 0:
+        return
+    copia = models.Usuario(**{
+        columna.key: getattr(usuario, columna.key)
+        for columna in models.Usuario.__mapper__.column_attrs
+    })
+    make_transient_to_detached(copia)
+    ahora = time.monotonic()
+    with _lock_usuarios:
+        # Purgar entradas caducadas para que la caché no crezca sin límite
+        for clave in [c for c, (_, instante) in _usuarios_cache.items() if ahora - instante >= TTL_CACHE_USUARIOS]:
+            del _usuarios_cache[clave]
+        _usuarios_cache[token] = (copia, ahora)
+
+
+def invalidar_usuario(usuario_id: int):
+    """Descarta las copias en caché de un usuario (tras editarlo o eliminarlo)"""
+    with _lock_usuarios:
+        for clave in [c for c, (u, _) in _usuarios_cache.items() if u.id == usuario_id]:
+            del _usuarios_cache[clave]
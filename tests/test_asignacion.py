@@ -0,0 +1,127 @@
+"""
+Asignación masiva: las tres estrategias de reparto y los prospectos que ya
+tienen al agente elegido. Todo en una transacción que se descarta al final.
+"""
+from datetime import date, datetime, timedelta
+
+import pytest
+
+import asignacion
+import auth
+import database
+import models
+from models import EstadoProspecto, TipoUsuario
+
+
+@pytest.fixture
+def equipo(datos):
+    """Sesión sin commit con tres agentes nuevos (sin historia); devuelve (db, [c, d, e])"""
+    db = database.SessionLocal()
+    try:
+        agentes = []
+        for nombre in ("agente_c", "agente_d", "agente_e"):
+            agente = models.Usuario(
+                username=nombre, email=f"{nombre}@prueba.com",
+                hashed_password=auth.get_password_hash("clave123"), tipo_usuario=TipoUsuario.AGENTE.value
+            )
+            db.add(agente)
+            db.flush()  # Ids en orden de creación: deciden la rotación sin historia
+            agentes.append(agente)
+        yield db, agentes
+    finally:
+        db.rollback()
+        db.close()
+
+
+def _prospectos(db, cantidad: int, agente=None, estado=EstadoProspecto.NUEVO.value) -> list:
+    prospectos = [
+        models.Prospecto(
+            nombre=f"Reparto{i}", apellido="Prueba", telefono=f"31255500{i:02d}",
+            agente_asignado_id=agente.id if agente else None, estado=estado,
+            fecha_registro=datetime.now() - timedelta(minutes=cantidad - i)
+        )
+        for i in range(cantidad)
+    ]
+    db.add_all(prospectos)
+    db.flush()
+    return prospectos
+
+
+def _filas(db, prospectos) -> list:
+    return asignacion.consultar_prospectos(db, prospecto_ids=[p.id for p in prospectos])
+
+
+def test_round_robin_sigue_la_rotacion(equipo):
+    db, (c, d, e) = equipo
+    elegidos, _ = asignacion.repartir(db, 5, [c, d, e], "round_robin")
+    assert elegidos == [c.id, d.id, e.id, c.id, d.id]
+
+    # Empieza por el que lleva más tiempo sin recibir una asignación
+    ahora = datetime.now()
+    db.add_all([
+        models.Notificacion(usuario_id=c.id, tipo="asignacion", mensaje="-", fecha_creacion=ahora - timedelta(hours=1)),
+        models.Notificacion(usuario_id=d.id, tipo="asignacion", mensaje="-", fecha_creacion=ahora - timedelta(hours=2)),
+    ])
+    db.flush()
+    elegidos, _ = asignacion.repartir(db, 4, [c, d, e], "round_robin")
+    assert elegidos == [e.id, d.id, c.id, e.id]
+
+
+def test_menos_cargado_cuenta_los_que_va_asignando(equipo):
+    db, (c, d, e) = equipo
+    _prospectos(db, 2, c)
+    _prospectos(db, 1, e, EstadoProspecto.COTIZADO.value)
+    _prospectos(db, 3, d, EstadoProspecto.GANADO.value)  # Cerrados: no cuentan
+
+    elegidos, cargas = asignacion.repartir(db, 4, [c, d, e], "menos_cargado")
+    assert cargas == {c.id: 2, d.id: 0, e.id: 1}
+    # d (0) dos veces, luego e (1 -> 2) y a igual carga decide la rotación: c
+    assert elegidos == [d.id, d.id, e.id, c.id]
+
+
+def test_ponderado_por_tasa_de_conversion(equipo):
+    db, (c, d, e) = equipo
+    hoy = date.today()
+    db.add_all([
+        models.ResumenDiario(fecha=hoy, agente_id=c.id, estado=EstadoProspecto.GANADO.value, cambios_estado=4),
+        models.ResumenDiario(fecha=hoy, agente_id=c.id, estado=EstadoProspecto.COTIZADO.value, cotizaciones=4),
+        models.ResumenDiario(fecha=hoy, agente_id=d.id, estado=EstadoProspecto.COTIZADO.value, cotizaciones=4),
+        # Fuera de los DIAS_CONVERSION: no cuenta
+        models.ResumenDiario(fecha=hoy - timedelta(days=asignacion.DIAS_CONVERSION + 1), agente_id=d.id,
+                             estado=EstadoProspecto.GANADO.value, cambios_estado=10),
+    ])
+    db.flush()
+
+    elegidos, pesos = asignacion.repartir(db, 6, [c, d, e], "ponderado")
+    # Media del equipo 4/8; cada agente suma COTIZACIONES_PREVIAS cotizaciones con esa tasa
+    assert pesos[c.id] == pytest.approx((4 + 5 * 0.5) / (4 + 5))
+    assert pesos[d.id] == pytest.approx((0 + 5 * 0.5) / (4 + 5))
+    assert pesos[e.id] == pytest.approx(0.5)  # Sin historia: la media
+    assert elegidos == [c.id, e.id, d.id, c.id, e.id, c.id]
+
+    # Sin ventas en el periodo todos pesan lo mismo (queda el round robin)
+    assert asignacion.tasas_conversion(db, [e.id]) == {e.id: 1.0}
+
+
+def test_asignar_en_bloque_no_toca_los_que_ya_tienen_al_agente(equipo):
+    db, (c, d, e) = equipo
+    ya_de_c, otro, ya_de_e = _prospectos(db, 3)
+    ya_de_c.agente_asignado_id, ya_de_e.agente_asignado_id = c.id, e.id
+    db.flush()
+    notificaciones_antes = db.query(models.Notificacion).count()
+
+    resultado, notificaciones = asignacion.asignar_en_bloque(
+        db, _filas(db, [ya_de_c, otro, ya_de_e]), [c, d, e], "round_robin"
+    )
+    assert (resultado["total"], resultado["asignados"], resultado["sin_cambios"]) == (3, 1, 2)
+    assert resultado["asignaciones"] == [{"prospecto_id": otro.id, "agente_id": d.id}]
+    assert notificaciones == [(d.id, "asignacion", "Te han asignado un nuevo prospecto: Reparto1 Prueba")]
+    assert db.query(models.Notificacion).count() == notificaciones_antes + 1
+    db.expire_all()
+    assert [p.agente_asignado_id for p in (ya_de_c, otro, ya_de_e)] == [c.id, d.id, e.id]
+
+    # Todos con el agente que les toca: nada que escribir
+    correos_antes = db.query(models.CorreoPendiente).count()
+    resultado, notificaciones = asignacion.asignar_en_bloque(db, _filas(db, [ya_de_c]), [c], "round_robin")
+    assert resultado["asignados"] == 0 and resultado["sin_cambios"] == 1 and notificaciones == []
+    assert db.query(models.CorreoPendiente).count() == correos_antes
@@ -0,0 +1,143 @@
+"""
+Códigos legibles (CL-, DOC-, COT-): sin repetidos con inserciones simultáneas,
+reservas en bloque y contadores que siguen a los códigos del esquema anterior.
+"""
+import threading
+from datetime import date, datetime
+
+from sqlalchemy import text
+
+import database
+import models
+from models import EstadoProspecto
+
+DIA = date(2031, 3, 14)  # Un día sin otros registros en las pruebas
+
+
+def _en_hilos(cantidad: int, funcion) -> list:
+    """Ejecuta `funcion(i)` en `cantidad` hilos a la vez; devuelve sus resultados"""
+    resultados, errores = [], []
+    barrera = threading.Barrier(cantidad)
+
+    def ejecutar(i):
+        try:
+            barrera.wait()
+            resultados.append(funcion(i))
+        except Exception as e:  # Se informa en el assert
+            errores.append(e)
+
+    hilos = [threading.Thread(target=ejecutar, args=(i,)) for i in range(cantidad)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    assert not errores, errores
+    return resultados
+
+
+def _numeros(codigos, prefijo: str) -> list:
+    assert all(c.startswith(f"{prefijo}-{DIA:%Y%m%d}-") for c in codigos), codigos
+    return sorted(int(c.rsplit("-", 1)[1]) for c in codigos)
+
+
+def test_inserciones_simultaneas_sin_codigos_repetidos(datos):
+    agente_id = datos["agentes"][0][0]
+
+    def registrar(i):
+        """Un prospecto con su documento y su cotización por sesión, en una transacción"""
+        db = database.SessionLocal()
+        try:
+            prospecto = models.Prospecto(
+                nombre=f"Codigo{i}", apellido="Concurrente", telefono=f"31055500{i:02d}",
+                fecha_registro=datetime.combine(DIA, datetime.min.time()),
+                estado=EstadoProspecto.COTIZADO.value, agente_asignado_id=agente_id
+            )
+            db.add(prospecto)
+            db.flush()
+            documento = models.Documento(
+                prospecto_id=prospecto.id, usuario_id=agente_id, nombre_archivo="cotizacion.pdf",
+                tipo_documento="cotizacion", ruta_archivo="blobs/00/concurrente.pdf",
+                fecha_subida=datetime.combine(DIA, datetime.min.time())
+            )
+            cotizacion = models.EstadisticaCotizacion(
+                agente_id=agente_id, prospecto_id=prospecto.id, fecha_cotizacion=DIA
+            )
+            db.add_all([documento, cotizacion])
+            db.commit()
+            return prospecto.id, prospecto.id_cliente, documento.id_documento, cotizacion.id_cotizacion
+        finally:
+            db.close()
+
+    hilos = 8
+    filas = _en_hilos(hilos, registrar)
+    try:
+        esperados = list(range(1, hilos + 1))
+        assert _numeros([f[1] for f in filas], "CL") == esperados
+        assert _numeros([f[2] for f in filas], "DOC") == esperados
+        assert _numeros([f[3] for f in filas], "COT") == esperados
+    finally:
+        # Borrado por ORM: los listeners mantienen el resumen diario
+        db = database.SessionLocal()
+        try:
+            ids = [f[0] for f in filas]
+            for modelo in (models.Documento, models.EstadisticaCotizacion):
+                for fila in db.query(modelo).filter(modelo.prospecto_id.in_(ids)):
+                    db.delete(fila)
+            for prospecto in db.query(models.Prospecto).filter(models.Prospecto.id.in_(ids)):
+                db.delete(prospecto)
+            db.commit()
+        finally:
+            db.close()
+
+
+def test_reservas_en_bloque_simultaneas(url_bd):
+    def reservar(i):
+        with database.engine.begin() as conn:
+            return models.reservar_codigos(conn, "LOTE", DIA, 25)
+
+    bloques = _en_hilos(6, reservar)
+    for bloque in bloques:
+        # Cada bloque es consecutivo y ningún número se repite entre bloques
+        numeros = _numeros(bloque, "LOTE")
+        assert numeros == list(range(numeros[0], numeros[0] + 25))
+    assert _numeros([c for bloque in bloques for c in bloque], "LOTE") == list(range(1, 151))
+
+    # Una reserva suelta después sigue al último bloque
+    with database.engine.begin() as conn:
+        assert models.reservar_codigos(conn, "LOTE", DIA) == [f"LOTE-{DIA:%Y%m%d}-0151"]
+        conn.execute(models.ContadorCodigo.__table__.delete().where(models.ContadorCodigo.prefijo == "LOTE"))
+
+
+def test_contadores_siguen_a_los_codigos_anteriores(url_bd):
+    """Con la tabla de contadores vacía arranca después del mayor número de cada prefijo y día"""
+    prospectos = models.Prospecto.__table__
+    with database.engine.connect() as conn:
+        transaccion = conn.begin()
+        try:
+            conn.execute(text("DELETE FROM contadores_codigo"))
+            # Códigos del esquema anterior, insertados sin los listeners del ORM
+            for numero, telefono in ((42, "3105550901"), (7, "3105550902")):
+                conn.execute(prospectos.insert().values(
+                    nombre="Anterior", telefono=telefono, id_cliente=f"CL-{DIA:%Y%m%d}-{numero:04d}",
+                    fecha_registro=datetime.combine(DIA, datetime.min.time()),
+                    estado=EstadoProspecto.NUEVO.value
+                ))
+            prospecto_id = conn.execute(prospectos.insert().values(
+                nombre="Anterior", telefono="3105550903", id_cliente="CL-20310313-0003",
+                estado=EstadoProspecto.NUEVO.value
+            ).returning(prospectos.c.id)).scalar_one()
+            conn.execute(models.Documento.__table__.insert().values(
+                prospecto_id=prospecto_id, nombre_archivo="anterior.pdf", ruta_archivo="uploads/anterior.pdf",
+                id_documento=f"DOC-{DIA:%Y%m%d}-0009"
+            ))
+
+            database.inicializar_contadores_codigo(conn)
+
+            assert models.reservar_codigos(conn, "CL", DIA) == [f"CL-{DIA:%Y%m%d}-0043"]
+            assert models.reservar_codigos(conn, "CL", date(2031, 3, 13), 2) == [
+                "CL-20310313-0004", "CL-20310313-0005"
+            ]
+            assert models.reservar_codigos(conn, "DOC", DIA) == [f"DOC-{DIA:%Y%m%d}-0010"]
+            assert models.reservar_codigos(conn, "COT", DIA) == [f"COT-{DIA:%Y%m%d}-0001"]
+        finally:
+            transaccion.rollback()
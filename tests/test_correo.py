@@ -0,0 +1,108 @@
+"""
+Bandeja de salida de correos contra el servidor SMTP de depuración (ServidorSmtpPrueba).
+"""
+import asyncio
+import threading
+from collections import Counter
+
+import pytest
+
+import correo
+import database
+import models
+
+
+@pytest.fixture
+def servidor_smtp(url_bd, monkeypatch):
+    """ServidorSmtpPrueba en un puerto libre; el worker de correos apunta a él"""
+    servidor = correo.ServidorSmtpPrueba()
+    bucle = asyncio.new_event_loop()
+    escucha = bucle.run_until_complete(servidor.iniciar("127.0.0.1", 0))
+    hilo = threading.Thread(target=bucle.run_forever, daemon=True)
+    hilo.start()
+    monkeypatch.setattr(correo, "SMTP_HOST", "127.0.0.1")
+    monkeypatch.setattr(correo, "SMTP_PUERTO", escucha.sockets[0].getsockname()[1])
+    yield servidor
+    bucle.call_soon_threadsafe(bucle.stop)
+    hilo.join()
+    escucha.close()
+    # Sin dejar correos de las pruebas en la cola
+    db = database.SessionLocal()
+    try:
+        db.query(models.CorreoPendiente).filter(models.CorreoPendiente.asunto.like("Prueba %")).delete(
+            synchronize_session=False
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+def _encolar(cantidad: int, etiqueta: str) -> list:
+    db = database.SessionLocal()
+    try:
+        correos = [
+            correo.encolar_correo(db, f"agente{i}@prueba.com", f"Prueba {etiqueta} {i}", "Cuerpo")
+            for i in range(cantidad)
+        ]
+        db.commit()
+        return [c.id for c in correos]
+    finally:
+        db.close()
+
+
+def _estados(ids) -> Counter:
+    db = database.SessionLocal()
+    try:
+        return Counter(e for (e,) in db.query(models.CorreoPendiente.estado).filter(
+            models.CorreoPendiente.id.in_(ids)
+        ))
+    finally:
+        db.close()
+
+
+def test_dos_workers_envian_cada_correo_una_vez(servidor_smtp):
+    ids = _encolar(30, "concurrente")
+    resultados = []
+    hilos = [threading.Thread(target=lambda: resultados.append(correo.enviar_pendientes(duracion_maxima=30)))
+             for _ in range(2)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+
+    asuntos = Counter(m["Subject"] for _, _, m in servidor_smtp.mensajes if m["Subject"].startswith("Prueba concurrente"))
+    assert len(asuntos) == 30 and set(asuntos.values()) == {1}
+    assert sum(r["enviados"] for r in resultados) == 30
+    assert _estados(ids) == Counter({"enviado": 30})
+    # Otra pasada no reenvía nada
+    correo.enviar_pendientes(duracion_maxima=5)
+    assert len([m for _, _, m in servidor_smtp.mensajes if m["Subject"].startswith("Prueba concurrente")]) == 30
+
+
+def test_error_a_mitad_de_lote_no_reenvia_los_enviados(servidor_smtp, monkeypatch):
+    ids = _encolar(5, "error")
+    construir = correo._construir_mensaje
+
+    def fallar_en_el_tercero(c):
+        if c.id == ids[2]:
+            raise ValueError("cabecera inválida")
+        return construir(c)
+
+    monkeypatch.setattr(correo, "_construir_mensaje", fallar_en_el_tercero)
+    assert correo.enviar_pendientes(duracion_maxima=30) == {"enviados": 4, "reintentos": 1}
+    assert _estados(ids) == Counter({"enviado": 4, "pendiente": 1})
+    correo.enviar_pendientes(duracion_maxima=5)  # El fallido espera su reintento
+    asuntos = [m["Subject"] for _, _, m in servidor_smtp.mensajes if m["Subject"].startswith("Prueba error")]
+    assert sorted(asuntos) == sorted(f"Prueba error {i}" for i in (0, 1, 3, 4))
+
+
+def test_correo_reclamado_no_lo_toma_otro_worker(url_bd):
+    (correo_id,) = _encolar(1, "reclamo")
+    db = database.SessionLocal()
+    try:
+        assert correo.reclamar_correo(db, correo_id)
+        assert not correo.reclamar_correo(db, correo_id)
+        db.query(models.CorreoPendiente).filter(models.CorreoPendiente.id == correo_id).delete()
+        db.commit()
+    finally:
+        db.close()
@@ -0,0 +1,136 @@
+"""
+Documentos: subida al almacén, descarga y archivos que faltan en el almacenamiento.
+"""
+import hashlib
+import os
+import threading
+
+import pytest
+
+import database
+import documentos
+import models
+from almacenamiento import AlmacenS3
+from conftest import iniciar_sesion
+from objetos_s3 import ClienteS3, ServidorS3
+
+PDF = b"%PDF-1.4 prueba de documento " + os.urandom(4096)
+
+
+def _subir(cliente, prospecto_id: int, contenido: bytes) -> models.Documento:
+    respuesta = cliente.post(
+        f"/prospectos/{prospecto_id}/documento",
+        files={"archivo": ("cotizacion.pdf", contenido, "application/pdf")},
+        data={"tipo_documento": "cotizacion"}, follow_redirects=False
+    )
+    assert respuesta.status_code in (200, 303)
+    db = database.SessionLocal()
+    try:
+        return db.query(models.Documento).order_by(models.Documento.id.desc()).first()
+    finally:
+        db.close()
+
+
+def test_descarga_y_rango(cliente, datos):
+    iniciar_sesion(cliente, "admin", "admin123")
+    documento = _subir(cliente, datos["prospectos"][3], PDF)
+    respuesta = cliente.get(f"/documentos/{documento.id}/descargar")
+    assert respuesta.status_code == 200 and respuesta.content == PDF
+    respuesta = cliente.get(f"/documentos/{documento.id}/descargar", headers={"Range": "bytes=10-19"})
+    assert respuesta.status_code == 206 and respuesta.content == PDF[10:20]
+
+
+def test_blob_faltante_responde_404(cliente, datos):
+    iniciar_sesion(cliente, "admin", "admin123")
+    documento = _subir(cliente, datos["prospectos"][4], PDF + b"faltante")
+    documentos.almacen.borrar(documento.ruta_archivo)
+    respuesta = cliente.get(f"/documentos/{documento.id}/descargar")
+    assert respuesta.status_code == 404
+    respuesta = cliente.get(f"/documentos/{documento.id}/descargar", headers={"Range": "bytes=0-9"})
+    assert respuesta.status_code == 404
+
+
+@pytest.fixture
+def almacen_s3(tmp_path):
+    servidor = ServidorS3(("127.0.0.1", 0), str(tmp_path), "clave", "secreto")
+    hilo = threading.Thread(target=servidor.serve_forever, daemon=True)
+    hilo.start()
+    yield AlmacenS3(ClienteS3(f"http://127.0.0.1:{servidor.server_address[1]}", "prospectos", "clave", "secreto"))
+    servidor.shutdown()
+
+
+def test_s3_leer_falla_antes_de_iterar(almacen_s3, tmp_path):
+    origen = tmp_path / "origen.pdf"
+    origen.write_bytes(PDF)
+    almacen_s3.subir("blobs/aa/x.pdf", str(origen), hashlib.sha256(PDF).hexdigest())
+    assert b"".join(almacen_s3.leer("blobs/aa/x.pdf", 0, 9)) == PDF[:10]
+    with pytest.raises(FileNotFoundError):
+        almacen_s3.leer("blobs/aa/no_existe.pdf")
+
+
+def test_subida_no_retiene_el_bloqueo_de_escritura(cliente, datos, monkeypatch):
+    """Mientras se sube al almacenamiento, otro escritor puede confirmar sin esperar"""
+    from sqlalchemy import text, update
+    subir_original = documentos.almacen.subir
+    escrituras = []
+
+    def subir_y_escribir(*args, **kwargs):
+        with database.engine.connect() as conn:
+            if conn.dialect.name == "sqlite":
+                conn.exec_driver_sql("PRAGMA busy_timeout=200")
+            else:
+                conn.execute(text("SET lock_timeout = 200"))
+            conn.execute(update(models.MedioIngreso).values(activo=1))
+            conn.commit()
+            if conn.dialect.name == "sqlite":
+                conn.exec_driver_sql(f"PRAGMA busy_timeout={database.SQLITE_PRAGMAS['busy_timeout']}")
+            else:
+                conn.execute(text("RESET lock_timeout"))
+        escrituras.append(True)
+        return subir_original(*args, **kwargs)
+
+    monkeypatch.setattr(documentos.almacen, "subir", subir_y_escribir)
+    iniciar_sesion(cliente, "admin", "admin123")
+    documento = _subir(cliente, datos["prospectos"][5], PDF + b"sin bloqueo")
+    assert escrituras and documento.hash_sha256 == hashlib.sha256(PDF + b"sin bloqueo").hexdigest()
+
+
+def test_purga_cruzada_con_subida_vuelve_a_subir(cliente, datos, monkeypatch):
+    """Una purga entre la lectura de referencias y el UPSERT no deja al documento sin archivo"""
+    from sqlalchemy import delete
+    iniciar_sesion(cliente, "admin", "admin123")
+    contenido = PDF + b"purga cruzada"
+    primero = _subir(cliente, datos["prospectos"][6], contenido)
+    sumar_original = documentos.sumar_referencias
+
+    def purgar_y_sumar(connection, hash_sha256, *args, **kwargs):
+        # Otro nodo elimina el primer documento y purga el blob justo antes del UPSERT
+        with database.engine.begin() as otra:
+            otra.execute(delete(models.ArchivoBlob).where(models.ArchivoBlob.hash_sha256 == hash_sha256))
+        documentos.almacen.borrar(primero.ruta_archivo)
+        return sumar_original(connection, hash_sha256, *args, **kwargs)
+
+    monkeypatch.setattr(documentos, "sumar_referencias", purgar_y_sumar)
+    segundo = _subir(cliente, datos["prospectos"][7], contenido)
+    assert segundo.ruta_archivo == primero.ruta_archivo
+    respuesta = cliente.get(f"/documentos/{segundo.id}/descargar")
+    assert respuesta.status_code == 200 and respuesta.content == contenido
+
+
+def test_rollback_tras_subir_no_deja_el_archivo_huerfano(url_bd):
+    """Si el handler falla después de subir, la purga encuentra el blob sin referencias"""
+    import io
+    contenido = PDF + b"rollback"
+    hash_sha256 = hashlib.sha256(contenido).hexdigest()
+    db = database.SessionLocal()
+    try:
+        clave, _, _ = documentos.guardar_blob(db, io.BytesIO(contenido), "cotizacion.pdf")
+        db.rollback()
+        assert documentos.almacen.existe(clave)
+        assert db.get(models.ArchivoBlob, hash_sha256).referencias == 0
+
+        assert documentos.purgar_blobs(db) >= 1
+        assert not documentos.almacen.existe(clave)
+        assert db.get(models.ArchivoBlob, hash_sha256) is None
+    finally:
+        db.close()
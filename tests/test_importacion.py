@@ -0,0 +1,123 @@
+"""
+Importación masiva (CSV y XLSX): filas inválidas, teléfonos repetidos en el archivo,
+clientes recurrentes, códigos, resumen diario e índice de destinos.
+"""
+import io
+import re
+from datetime import date, datetime
+
+import pytest
+from openpyxl import Workbook
+
+import database
+import destinos
+import estadisticas
+import importacion
+import models
+from conftest import filas_resumen
+
+ENCABEZADOS = ["Nombre", "Apellido", "Teléfono", "Destino", "Fecha ida", "Adultos", "Agente"]
+
+
+def _filas(formato: str) -> list:
+    """Filas 2 a 7 del archivo; los teléfonos nuevos son distintos en cada formato"""
+    prefijo = {"csv": "321", "xlsx": "322"}[formato]
+    return [
+        [f"Importado{formato}", "Nuevo", f"{prefijo}5550001", f"Bogotá {formato.upper()}", "15/06/2031", "2", "agente_a"],
+        ["SinTelefono", "", "", "", "", "", ""],
+        ["FechaMala", "", f"{prefijo}5550002", "", "31/02/2031", "-1", ""],
+        ["", "", f"{prefijo}555-0001", "", "", "", ""],  # Repite el teléfono de la fila 2
+        ["", "", "300 233 7205", "", "", "", ""],  # Cliente5 de los datos de prueba
+        ["AgenteMalo", "", f"{prefijo}5550003", "", "", "", "nadie"],
+    ]
+
+
+def _archivo(formato: str) -> io.BytesIO:
+    filas = _filas(formato)
+    if formato == "csv":
+        texto = "\n".join(";".join(fila) for fila in [ENCABEZADOS] + filas)
+        return io.BytesIO(texto.encode("utf-8-sig"))
+    libro = Workbook()
+    hoja = libro.active
+    hoja.append(ENCABEZADOS)
+    for fila in filas:
+        # Como los deja Excel: números y fechas con su tipo, celdas vacías en None
+        fila = [valor or None for valor in fila]
+        if fila[2] and fila[2].isdigit():
+            fila[2] = int(fila[2])
+        if fila[4] == "15/06/2031":
+            fila[4] = datetime(2031, 6, 15)
+        if fila[5]:
+            fila[5] = int(fila[5])
+        hoja.append(fila)
+    salida = io.BytesIO()
+    libro.save(salida)
+    salida.seek(0)
+    return salida
+
+
+def _registrados_del_dia(resumen, dia: date) -> int:
+    return sum(clave[5] * veces for clave, veces in resumen.items() if clave[0] == dia)
+
+
+@pytest.mark.parametrize("formato", ["csv", "xlsx"])
+def test_importar_archivo(datos, formato):
+    hoy = date.today()
+    destino = f"Bogotá {formato.upper()}"
+    db = database.SessionLocal()
+    creados = []
+    try:
+        # Índice de destinos construido antes: la importación debe invalidarlo
+        assert destino not in destinos.indice_destinos.sugerir(db, destino)
+        registrados_antes = _registrados_del_dia(filas_resumen(db), hoy)
+
+        admin = db.get(models.Usuario, datos["admin_id"])
+        contexto = importacion.crear_contexto(db, admin, "REDES")
+        resultado = importacion.importar_prospectos(db, _archivo(formato), f"leads.{formato}", contexto)
+
+        assert resultado.resumen() == {"total": 6, "creados": 3, "recurrentes": 2, "con_errores": 3}
+        por_fila = {fila["fila"]: fila for fila in resultado.filas}
+        assert [por_fila[n]["estado"] for n in range(2, 8)] == [
+            "creado", "error", "error", "recurrente", "recurrente", "error"
+        ]
+        assert por_fila[3]["errores"] == ["Teléfono vacío o sin dígitos"]
+        assert por_fila[4]["errores"] == ["Fecha de ida inválida (DD/MM/AAAA)", "Pasajeros adultos inválido"]
+        assert por_fila[7]["errores"] == ["Agente desconocido"]
+
+        creados = [por_fila[n]["prospecto_id"] for n in (2, 5, 6)]
+        codigos = [por_fila[n]["id_cliente"] for n in (2, 5, 6)]
+        assert len(set(codigos)) == 3
+        assert all(re.fullmatch(rf"CL-{hoy:%Y%m%d}-\d{{4}}", codigo) for codigo in codigos)
+
+        nuevo, repetido, recurrente = (db.get(models.Prospecto, i) for i in creados)
+        assert [nuevo.id_cliente, repetido.id_cliente, recurrente.id_cliente] == codigos
+        assert nuevo.agente_asignado_id == datos["agentes"][0][0]
+        assert nuevo.pasajeros_adultos == 2 and nuevo.fecha_ida == date(2031, 6, 15)
+        assert not nuevo.cliente_recurrente and nuevo.tiene_datos_completos
+        # Teléfono repetido en el archivo: se inserta después y encuentra a la fila 2
+        assert repetido.cliente_recurrente and repetido.prospecto_original_id == nuevo.id
+        assert repetido.nombre == f"Importado{formato}"
+        # Cliente que ya estaba en la base de datos
+        assert recurrente.cliente_recurrente and recurrente.prospecto_original_id == datos["prospectos"][5]
+        assert recurrente.nombre == "Cliente5"
+        assert db.query(models.Interaccion).filter(
+            models.Interaccion.prospecto_id.in_(creados), models.Interaccion.tipo_interaccion == "sistema"
+        ).count() == 2
+
+        # Resumen diario: las inserciones masivas marcaron el día y cuadra con el reconstruido
+        incremental = filas_resumen(db)
+        assert _registrados_del_dia(incremental, hoy) == registrados_antes + 3
+        estadisticas.reconstruir_resumen_diario(db)
+        assert filas_resumen(db) == incremental
+
+        assert destino in destinos.indice_destinos.sugerir(db, destino)
+    finally:
+        db.rollback()
+        # Borrado por ORM (los listeners mantienen el resumen); el repetido antes que su original
+        for interaccion in db.query(models.Interaccion).filter(models.Interaccion.prospecto_id.in_(creados)):
+            db.delete(interaccion)
+        for prospecto_id in sorted(creados, reverse=True):
+            db.delete(db.get(models.Prospecto, prospecto_id))
+            db.flush()
+        db.commit()
+        db.close()
@@ -0,0 +1,240 @@
+"""
+Migraciones, resumen diario y listados en cada motor (SQLite y PostgreSQL).
+"""
+import html
+import re
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import inspect
+
+import database
+import estadisticas
+import models
+from conftest import filas_resumen, iniciar_sesion
+from models import EstadoProspecto
+
+
+def _ids_listado(texto: str) -> list:
+    return [int(i) for i in re.findall(r'href="/prospectos/(\d+)/seguimiento"', texto)]
+
+
+def test_migraciones_idempotentes(url_bd):
+    assert database.check_and_migrate()
+    with database.engine.connect() as conn:
+        inspector = inspect(conn)
+        for tabla in models.Base.metadata.sorted_tables:
+            assert inspector.has_table(tabla.name), tabla.name
+            existentes = {indice["name"] for indice in inspector.get_indexes(tabla.name)}
+            for indice in tabla.indexes:
+                assert indice.name in existentes, (tabla.name, indice.name)
+
+
+def test_resumen_incremental_igual_al_reconstruido(datos):
+    db = database.SessionLocal()
+    try:
+        incremental = filas_resumen(db)
+        assert incremental
+        estadisticas.reconstruir_resumen_diario(db)
+        assert filas_resumen(db) == incremental
+    finally:
+        db.close()
+
+
+def test_estadisticas_dashboard_cuadran(datos):
+    db = database.SessionLocal()
+    try:
+        P = models.Prospecto
+        stats = estadisticas.calcular_estadisticas_dashboard(db, date.today() - timedelta(days=30), date.today())
+        assert stats.total_prospectos == db.query(P).count() == len(datos["prospectos"])
+        assert stats.clientes_sin_asignar == db.query(P).filter(
+            P.agente_asignado_id == None, P.estado == models.EstadoProspecto.NUEVO.value
+        ).count()
+        assert stats.prospectos_cotizados == db.query(models.EstadisticaCotizacion).count()
+        agente_id = datos["agentes"][0][0]
+        del_agente = estadisticas.calcular_estadisticas_dashboard(
+            db, date.today() - timedelta(days=30), date.today(), agente_id=agente_id
+        )
+        assert del_agente.total_prospectos == db.query(P).filter(P.agente_asignado_id == agente_id).count()
+    finally:
+        db.close()
+
+
+def test_listado_paginado_por_cursor(cliente, datos):
+    iniciar_sesion(cliente, "admin", "admin123")
+    url, vistos = "/prospectos?estado=todos&limit=7", []
+    while url:
+        respuesta = cliente.get(url)
+        assert respuesta.status_code == 200
+        vistos.extend(_ids_listado(respuesta.text))
+        siguiente = re.search(r'<li class="page-item ">\s*<a[^>]*href="([^"]+)">Siguiente', respuesta.text)
+        url = html.unescape(siguiente.group(1)) if siguiente else None
+    assert sorted(vistos) == sorted(datos["prospectos"])
+
+
+def test_listado_busqueda_y_filtros(cliente, datos):
+    iniciar_sesion(cliente, "admin", "admin123")
+    respuesta = cliente.get("/prospectos?estado=todos&busqueda_global=Cliente7&limit=50")
+    assert respuesta.status_code == 200
+    assert _ids_listado(respuesta.text) == [datos["prospectos"][7]]
+
+    # Solo dígitos: final del teléfono (3002337207)
+    respuesta = cliente.get("/prospectos?estado=todos&busqueda_global=2337207&limit=50")
+    assert _ids_listado(respuesta.text) == [datos["prospectos"][7]]
+    respuesta = cliente.get("/clientes/historial?busqueda=233%207207")
+    assert respuesta.status_code == 200 and "Cliente7" in respuesta.text and "Cliente8" not in respuesta.text
+
+    respuesta = cliente.get("/prospectos?estado=todos&destino=madrid&limit=50")
+    assert set(_ids_listado(respuesta.text)) == set(datos["prospectos"][2::4])
+
+    assert cliente.get("/dashboard?periodo=año").status_code == 200
+
+
+def test_historial_cliente_con_indicativo_distinto_de_57(cliente, datos):
+    """Un cliente con indicativo 1 se encuentra desde el enlace del listado"""
+    db = database.SessionLocal()
+    try:
+        prospecto = models.Prospecto(
+            nombre="Miami", apellido="Indicativo", telefono="305-555-1234", indicativo_telefono="1",
+            estado=EstadoProspecto.NUEVO.value
+        )
+        db.add(prospecto)
+        db.commit()
+        assert prospecto.telefono_normalizado == "+13055551234"
+
+        iniciar_sesion(cliente, "admin", "admin123")
+        listado = cliente.get("/prospectos?estado=todos&busqueda_global=Miami").text
+        enlace = html.unescape(re.search(r'href="(/clientes/historial\?[^"]+)"', listado).group(1))
+        assert "indicativo=1" in enlace
+        for url in (enlace, "/clientes/historial?telefono=3055551234&indicativo=1",
+                    "/clientes/historial?telefono=305-555-1234"):  # Sin indicativo: texto exacto
+            respuesta = cliente.get(url)
+            assert respuesta.status_code == 200 and "Miami" in respuesta.text, url
+        assert "Miami" not in cliente.get("/clientes/historial?telefono=3055551234").text
+    finally:
+        for prospecto in db.query(models.Prospecto).filter(models.Prospecto.nombre == "Miami"):
+            db.delete(prospecto)
+        db.commit()
+        db.close()
+
+
+def test_listado_agente_solo_sus_prospectos(cliente, datos):
+    agente_id, usuario = datos["agentes"][0]
+    iniciar_sesion(cliente, usuario, "clave123")
+    respuesta = cliente.get("/prospectos?estado=todos&limit=100")
+    assert respuesta.status_code == 200
+    db = database.SessionLocal()
+    try:
+        propios = {i for (i,) in db.query(models.Prospecto.id).filter(models.Prospecto.agente_asignado_id == agente_id)}
+    finally:
+        db.close()
+    assert propios and set(_ids_listado(respuesta.text)) == propios
+
+
+def test_resumen_con_objetos_expirados(datos):
+    """Editar o eliminar objetos expirados (tras un commit) recalcula su día, no el de hoy"""
+    (agente_a, _), (agente_b, _) = datos["agentes"]
+    hace_ocho_dias = datetime.now() - timedelta(days=8)
+    db = database.SessionLocal()
+
+    def cuadra():
+        db.commit()  # Expira los objetos de la sesión
+        incremental = filas_resumen(db)
+        estadisticas.reconstruir_resumen_diario(db)
+        return filas_resumen(db) == incremental
+
+    try:
+        prospecto = models.Prospecto(
+            nombre="Expirado", telefono="3135550001", destino="Quito", agente_asignado_id=agente_a,
+            fecha_registro=hace_ocho_dias, estado=EstadoProspecto.NUEVO.value
+        )
+        db.add(prospecto)
+        assert cuadra()
+        historial = models.HistorialEstado(
+            prospecto_id=prospecto.id, estado_anterior=EstadoProspecto.NUEVO.value,
+            estado_nuevo=EstadoProspecto.EN_SEGUIMIENTO.value, usuario_id=agente_a,
+            fecha_cambio=hace_ocho_dias + timedelta(days=2)
+        )
+        prospecto.estado = EstadoProspecto.EN_SEGUIMIENTO.value
+        db.add(historial)
+        assert cuadra()
+
+        prospecto.agente_asignado_id = agente_b  # fecha_registro sin cargar
+        assert cuadra()
+        prospecto.destino = "Lima"  # Mueve la fila del historial de su día
+        assert cuadra()
+        historial.fecha_cambio = hace_ocho_dias + timedelta(days=3)  # Deja un día y llega a otro
+        assert cuadra()
+        db.delete(historial)
+        assert cuadra()
+        db.delete(prospecto)
+        assert cuadra()
+    finally:
+        db.rollback()
+        db.close()
+
+
+def test_resumen_mismo_dia_en_transacciones_concurrentes(datos):
+    """Dos commits que recalculan el mismo día no duplican sus filas del resumen"""
+    # Cambios de estado: las altas de prospectos y cotizaciones ya se serializan por día
+    # en contadores_codigo
+    agente_id = datos["agentes"][0][0]
+    hoy = datetime.now()
+    db_a, db_b = database.SessionLocal(), database.SessionLocal()
+
+    def cambio(db, indice):
+        db.add(models.HistorialEstado(
+            prospecto_id=datos["prospectos"][indice], estado_anterior=EstadoProspecto.NUEVO.value,
+            estado_nuevo=EstadoProspecto.EN_SEGUIMIENTO.value, usuario_id=agente_id,
+            fecha_cambio=hoy, comentario="concurrente"
+        ))
+
+    try:
+        cambio(db_a, 1)
+        db_a.flush()
+        estadisticas.actualizar_resumen_diario(db_a, [hoy.date()])  # A ya recalculó el día, sin confirmar
+
+        def confirmar_b():
+            cambio(db_b, 5)
+            db_b.commit()
+
+        hilo = threading.Thread(target=confirmar_b)
+        hilo.start()
+        time.sleep(0.5)  # B llega al recálculo del mismo día mientras A sigue abierta
+        db_a.commit()
+        hilo.join()
+
+        incremental = filas_resumen(db_a)
+        estadisticas.reconstruir_resumen_diario(db_a)
+        assert filas_resumen(db_a) == incremental
+    finally:
+        db_b.close()
+        H = models.HistorialEstado
+        for historial in db_a.query(H).filter(H.comentario == "concurrente"):
+            db_a.delete(historial)
+        db_a.commit()
+        db_a.close()
+
+
+def test_engine_sqlite_en_memoria():
+    """sqlite:// usa SingletonThreadPool: sin pool_size/max_overflow/pool_timeout"""
+    from sqlalchemy import create_engine
+    for url in ("sqlite://", "sqlite:///:memory:"):
+        engine = create_engine(url, **database._opciones_engine(url))
+        models.Base.metadata.create_all(engine)
+        with engine.connect() as conn:
+            assert inspect(conn).has_table("prospectos")
+        engine.dispose()
+
+
+def test_hilos_de_trabajo_caben_en_el_pool(cliente, monkeypatch):
+    import main
+    capacidad = database.capacidad_pool()
+    assert capacidad == database.engine.pool.size() + database.engine.pool._max_overflow
+    monkeypatch.delenv("HILOS_TRABAJO", raising=False)
+    assert main.hilos_trabajo() == capacidad - main.CONEXIONES_RESERVADAS
+    monkeypatch.setenv("HILOS_TRABAJO", str(capacidad + 10))
+    assert main.hilos_trabajo() == capacidad - main.CONEXIONES_RESERVADAS
+    monkeypatch.setenv("HILOS_TRABAJO", "8")
+    assert main.hilos_trabajo() == 8
@@ -0,0 +1,77 @@
+"""
+Planes de consulta (SQLite): las consultas de las rutas más usadas no recorren
+completas las tablas grandes.
+
+Se capturan los SELECT que emiten las rutas con before_cursor_execute y se pasa
+cada uno por EXPLAIN QUERY PLAN. Los recorridos ordenados por un índice
+(SCAN ... USING INDEX, el orden de la paginación por cursor con LIMIT) valen;
+un SCAN de la tabla sin índice no. El filtro por destino (contiene, LIKE '%x%')
+no puede usar un índice y no está en la lista.
+"""
+import re
+
+import pytest
+from sqlalchemy import event
+
+import database
+from conftest import iniciar_sesion
+
+TABLAS_GRANDES = (
+    "prospectos", "historial_estados", "estadisticas_cotizacion", "interacciones", "notificaciones"
+)
+SCAN_COMPLETO = re.compile(r"^SCAN (%s)(?: AS \w+)?$" % "|".join(TABLAS_GRANDES))
+
+RUTAS = [
+    "/dashboard",
+    "/dashboard?periodo=año",
+    "/prospectos?estado=todos",
+    "/prospectos?estado=nuevo",
+    "/prospectos?estado=todos&busqueda_global=Cliente7",
+    "/prospectos?estado=todos&busqueda_global=2337207",  # Solo dígitos: final del teléfono
+    "/prospectos/cerrados",
+    "/prospectos/filtro?tipo_filtro=total&valor_filtro=todos",
+    "/prospectos/filtro?tipo_filtro=estado&valor_filtro=cotizado&periodo=año",
+    "/estadisticas/cotizaciones",
+    "/notificaciones",
+    "/clientes/historial?telefono=3002337207",
+    "/clientes/historial?busqueda=233%207207",
+]
+
+
+def _selects_de(cliente, rutas) -> dict:
+    """SELECT distintos (con sus parámetros) que emiten las rutas"""
+    capturados = {}
+
+    def capturar(conn, cursor, sentencia, parametros, contexto, varios):
+        if not varios and sentencia.lstrip().upper().startswith("SELECT"):
+            capturados.setdefault(re.sub(r"\s+", " ", sentencia), (sentencia, parametros))
+
+    event.listen(database.engine, "before_cursor_execute", capturar)
+    try:
+        for ruta in rutas:
+            assert cliente.get(ruta).status_code == 200, ruta
+    finally:
+        event.remove(database.engine, "before_cursor_execute", capturar)
+    return capturados
+
+
+@pytest.mark.parametrize("usuario,clave", [("admin", "admin123"), ("agente_a", "clave123")])
+def test_rutas_sin_scan_de_tablas_grandes(cliente, datos, usuario, clave):
+    if database.engine.dialect.name != "sqlite":
+        pytest.skip("EXPLAIN QUERY PLAN es de SQLite")
+    iniciar_sesion(cliente, usuario, clave)
+    consultas = _selects_de(cliente, RUTAS)
+    assert consultas
+
+    conexion = database.engine.raw_connection()
+    try:
+        cursor = conexion.cursor()
+        recorridos = []
+        for sentencia, parametros in consultas.values():
+            plan = [fila[3] for fila in cursor.execute("EXPLAIN QUERY PLAN " + sentencia, parametros)]
+            malos = [paso for paso in plan if SCAN_COMPLETO.match(paso)]
+            if malos:
+                recorridos.append((malos, sentencia))
+    finally:
+        conexion.close()
+    assert not recorridos, "\n\n".join(f"{malos}\n{sentencia}" for malos, sentencia in recorridos)
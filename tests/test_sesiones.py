@@ -0,0 +1,124 @@
+"""
+Sesiones: validación en el almacén en cada petición, backends del almacén
+(memoria, base de datos y Redis con el servidor de reemplazo) y cliente RESP.
+"""
+import asyncio
+import threading
+import time
+
+import pytest
+
+import auth
+import database
+import models
+import sesiones
+from conftest import iniciar_sesion
+from models import TipoUsuario
+from redis_resp import ClienteResp, ErrorResp, ServidorResp
+
+
+def test_logout_en_otro_worker_se_respeta_con_la_cache(cliente, datos):
+    token = iniciar_sesion(cliente, "admin", "admin123")
+    assert cliente.get("/dashboard", follow_redirects=False).status_code == 200  # Llena la caché
+    assert sesiones.usuario_en_cache(token, datos["admin_id"]) is not None
+
+    # Otro worker cierra la sesión: borra el token del almacén, no la caché de este proceso
+    sesiones.almacen.eliminar(token)
+    assert cliente.get("/dashboard", follow_redirects=False).status_code == 303
+
+
+# ========== BACKENDS DEL ALMACÉN ==========
+
+@pytest.fixture
+def servidor_resp():
+    """ServidorResp (reemplazo local de Redis) en un puerto libre; devuelve su URL"""
+    bucle = asyncio.new_event_loop()
+    escucha = bucle.run_until_complete(ServidorResp().iniciar("127.0.0.1", 0))
+    hilo = threading.Thread(target=bucle.run_forever, daemon=True)
+    hilo.start()
+    yield f"redis://127.0.0.1:{escucha.sockets[0].getsockname()[1]}/0"
+    bucle.call_soon_threadsafe(bucle.stop)
+    hilo.join()
+    escucha.close()
+
+
+@pytest.fixture(params=["memoria", "bd", "redis"])
+def almacen(request, url_bd):
+    if request.param == "memoria":
+        return sesiones.AlmacenMemoria()
+    if request.param == "bd":
+        return sesiones.AlmacenBaseDatos()
+    return sesiones.AlmacenRedis(request.getfixturevalue("servidor_resp"))
+
+
+def test_almacen_ida_y_vuelta(almacen, datos):
+    admin_id, (agente_id, _) = datos["admin_id"], datos["agentes"][0]
+    almacen.guardar("token-a", admin_id, 60)
+    almacen.guardar("token-b", agente_id, 60)
+    almacen.guardar("token-c", agente_id, 60)
+    almacen.guardar("token-caducado", agente_id, 1)
+    time.sleep(1.1)
+
+    assert almacen.obtener("token-a") == admin_id
+    assert almacen.obtener("token-b") == agente_id
+    assert almacen.obtener("token-caducado") is None
+    assert almacen.obtener("no-existe") is None
+
+    almacen.eliminar("token-a")
+    assert almacen.obtener("token-a") is None
+    almacen.eliminar_de_usuario(agente_id)
+    assert almacen.obtener("token-b") is None and almacen.obtener("token-c") is None
+
+
+def test_cliente_y_servidor_resp(servidor_resp):
+    cliente = ClienteResp(servidor_resp)
+    assert cliente.ping()
+    cliente.set("clave:1", "uno")
+    cliente.set("clave:2", 2, ex=1)
+    cliente.set("otra", "x")
+    assert cliente.get("clave:1") == "uno" and cliente.get("clave:2") == "2"
+    assert sorted(cliente.scan_iter("clave:*")) == ["clave:1", "clave:2"]
+    time.sleep(1.1)
+    assert cliente.get("clave:2") is None
+    assert cliente.delete("clave:1", "clave:2") == 1
+    with pytest.raises(ErrorResp):
+        cliente.ejecutar("HSET", "h", "a", "b")
+
+    # Publicar/suscribir con la conexión propia del suscriptor
+    recibidos = []
+    mensajes = cliente.escuchar("canal")
+    hilo = threading.Thread(target=lambda: recibidos.append(next(mensajes)), daemon=True)
+    hilo.start()
+    for _ in range(50):
+        if cliente.publish("canal", "hola") == 1:
+            break
+        time.sleep(0.05)
+    hilo.join(5)
+    assert recibidos == ["hola"]
+    cliente.cerrar()
+
+
+def test_eliminar_usuario_con_sesiones(cliente, datos):
+    db = database.SessionLocal()
+    try:
+        usuario = models.Usuario(
+            username="temporal", email="temporal@prueba.com",
+            hashed_password=auth.get_password_hash("clave123"), tipo_usuario=TipoUsuario.AGENTE.value
+        )
+        db.add(usuario)
+        db.commit()
+        usuario_id = usuario.id
+    finally:
+        db.close()
+    token = iniciar_sesion(cliente, "temporal", "clave123")
+
+    iniciar_sesion(cliente, "admin", "admin123")
+    respuesta = cliente.post(f"/usuarios/{usuario_id}/eliminar", follow_redirects=False)
+    assert "success" in respuesta.headers["location"]
+    assert sesiones.obtener_usuario_id(token) is None
+    db = database.SessionLocal()
+    try:
+        assert db.get(models.Usuario, usuario_id) is None
+        assert db.query(models.Sesion).filter(models.Sesion.usuario_id == usuario_id).count() == 0
+    finally:
+        db.close()